@@ -0,0 +1,36 @@
+import numpy as np
+import numpy.typing as npt
+
+
+# Active voxel lists.
+#
+# The dose engines convolve the kernel with every voxel of non-zero TERMA.
+# Outside the beam and the phantom most of the grid has none, so rather than
+# visiting every voxel and skipping the empty ones, the voxels with TERMA are
+# packed into a list once and the engines iterate over that. Work is then
+# spread evenly between threads, whatever the shape of the field. Voxels of
+# negligible TERMA can also be left out, with a threshold relative to the
+# maximum TERMA.
+
+
+def active_voxels(dose_grid_terma: npt.NDArray[np.float32], threshold=0.0) -> npt.NDArray[np.int32]:
+    """ Pack the indices of the voxels that contribute dose.
+
+    Parameters
+    ----------
+    dose_grid_terma : ndarray
+        Grid of TERMA values
+    threshold : float
+        Fraction of the maximum TERMA that a voxel's TERMA must exceed
+
+    Returns
+    -------
+    ndarray
+        Index of each active voxel, in C order, shape (num_active, 3)
+    """
+    if not 0 <= threshold < 1:
+        raise ValueError("The TERMA threshold must be in [0, 1).")
+    cutoff = threshold * np.max(dose_grid_terma, initial=0)
+    return np.ascontiguousarray(
+        np.argwhere(dose_grid_terma > cutoff), dtype=np.int32
+    )
@@ -0,0 +1,296 @@
+import numpy as np
+import numpy.typing as npt
+import numba
+from numba import cuda
+import math
+from pydicom.dataset import FileDataset
+from .cpu import cpu_dot, cpu_line_block_plane_collision
+
+
+# Analytic jaw/MLC aperture.
+#
+# Rather than rasterising the jaws and leaves into a 0.1 mm transmission map
+# (see Block), only the jaw positions, leaf boundaries and leaf ends are
+# stored, and the transmission is evaluated where it is needed. The leaf is
+# modelled as in Block: over its outermost 0.1 mm rows the leaf blocks 20%,
+# 50% and 75% of the beam (interleaf leakage), and its blocking falls off
+# linearly over the 1.5 mm nearest the leaf end.
+#
+# Positions are in cm on the block plane, with u across the leaves (the Y jaw
+# direction) and v along the direction of leaf travel (the X jaw direction),
+# matching the axes of Block.block_values.
+
+LEAF_SIDE_BLOCKING = (0.20, 0.50, 0.75)  # Outermost 0.1 mm rows of a leaf
+LEAF_END_PIXELS = 14  # 0.1 mm steps of the leaf end blocking ramp
+
+
+class Aperture:
+
+    def __init__(self, jaws: npt.NDArray[np.float64], leaf_boundaries: npt.NDArray[np.float64]|None = None, leaf_ends: npt.NDArray[np.float64]|None = None):
+        """ Create an aperture from jaw and leaf positions.
+
+        Parameters
+        ----------
+        jaws : ndarray
+            Jaw positions [u_min, u_max, v_min, v_max], in cm
+        leaf_boundaries : ndarray, optional
+            Leaf boundary positions along u, in cm. Without leaves the
+            aperture is defined by the jaws alone.
+        leaf_ends : ndarray, optional
+            End positions along v of the A (first row) and B (second row)
+            bank leaves, shape (2, len(leaf_boundaries) - 1), in cm
+        """
+        self.jaws = np.asarray(jaws, dtype=np.float64)
+        if leaf_boundaries is None:
+            self.leaf_boundaries = np.zeros(0, dtype=np.float64)
+            self.leaf_ends = np.zeros((2, 0), dtype=np.float64)
+        else:
+            self.leaf_boundaries = np.asarray(leaf_boundaries, dtype=np.float64)
+            self.leaf_ends = np.asarray(leaf_ends, dtype=np.float64)
+            assert self.leaf_ends.shape == (2, len(self.leaf_boundaries) - 1), \
+                "leaf_ends must hold an A and B bank end for every leaf"
+
+    @classmethod
+    def square(cls, length: float) -> "Aperture":
+        """ Create a square jaw-defined opening with a given side length.
+
+        Parameters
+        ----------
+        length : float
+            Side length of square opening, in cm
+        """
+        return cls(np.array([-length / 2, length / 2, -length / 2, length / 2]))
+
+    @classmethod
+    def from_plan(cls, plan: FileDataset, beam_index: int = -1) -> "Aperture":
+        """ Create the aperture of a beam in a DICOM RT plan.
+
+        Parameters
+        ----------
+        plan : FileDataset
+            The RT plan
+        beam_index : int
+            Index of the beam in the plan's beam sequence. Defaults to the
+            last beam, as for Block.
+        """
+        beam = plan.BeamSequence[beam_index]
+        if beam.BeamType != 'STATIC':
+            raise NotImplementedError(
+                "Only beams with type 'STATIC' are currently implemented."
+            )
+
+        leaf_boundaries = None
+        for collimator in beam.BeamLimitingDeviceSequence:
+            if collimator.RTBeamLimitingDeviceType == 'MLCX':
+                leaf_boundaries = np.array(collimator.LeafPositionBoundaries, dtype=np.float64) / 10
+
+        leaf_ends = None
+        for collimator in beam.ControlPointSequence[0].BeamLimitingDevicePositionSequence:
+            if collimator.RTBeamLimitingDeviceType in ('X', 'ASYMX'):
+                jaw_x_positions = np.array(collimator.LeafJawPositions, dtype=np.float64) / 10
+            if collimator.RTBeamLimitingDeviceType in ('Y', 'ASYMY'):
+                jaw_y_positions = np.array(collimator.LeafJawPositions, dtype=np.float64) / 10
+            elif collimator.RTBeamLimitingDeviceType == 'MLCX':
+                leaf_ends = np.array(collimator.LeafJawPositions, dtype=np.float64).reshape((2, -1)) / 10
+
+        jaws = np.concatenate((jaw_y_positions, jaw_x_positions))
+        if leaf_ends is None:
+            return cls(jaws)
+        return cls(jaws, leaf_boundaries, leaf_ends)
+
+    def transmission(self, position: npt.NDArray[np.float32]) -> float:
+        """Return the transmission value at the given position
+
+        Parameters
+        ----------
+        position : ndarray
+            Position [u, v] in the isocentre plane at which to return the
+            transmission, in cm
+
+        Returns
+        -------
+        float
+            The aperture transmission value, from 0.0 to 1.0
+        """
+        return cpu_aperture_transmission(
+            float(position[0]),
+            float(position[1]),
+            self.jaws,
+            self.leaf_boundaries,
+            self.leaf_ends
+        )
+
+
+@numba.njit
+def cpu_aperture_transmission(u, v, jaws, leaf_boundaries, leaf_ends):
+
+    # Jaws
+    if u < jaws[0] or u >= jaws[1] or v < jaws[2] or v >= jaws[3]:
+        return 0.0
+
+    num_leaves = len(leaf_boundaries) - 1
+    if num_leaves < 1:
+        return 1.0
+    if u < leaf_boundaries[0] or u >= leaf_boundaries[num_leaves]:
+        return 0.0
+
+    # Binary search for the leaf row holding u
+    low = 0
+    high = num_leaves
+    while high - low > 1:
+        middle = (low + high) // 2
+        if u < leaf_boundaries[middle]:
+            high = middle
+        else:
+            low = middle
+    leaf = low
+
+    # Blocking towards the sides of the leaf
+    side = min(u - leaf_boundaries[leaf], leaf_boundaries[leaf + 1] - u)
+    rows = int(math.floor(side * 100))
+    if rows < 3:
+        blocking = LEAF_SIDE_BLOCKING[rows]
+    else:
+        blocking = 1.0
+
+    # Distance behind the end of the leaf blocking v, if any
+    if v < leaf_ends[0, leaf]:
+        behind = leaf_ends[0, leaf] - v
+    elif v >= leaf_ends[1, leaf]:
+        behind = v - leaf_ends[1, leaf]
+    else:
+        return 1.0
+    ramp = math.floor(behind * 100) / LEAF_END_PIXELS
+    if ramp < 1.0:
+        blocking *= ramp
+    return 1.0 - blocking
+
+
+@numba.njit(parallel=True)
+def cpu_aperture_hit_test(dose_grid_blocked, dose_grid_size, dose_grid_origin, dose_grid_spacing, source_position, source_v_y, source_transform, jaws, leaf_boundaries, leaf_ends, samples):
+
+    offset = dose_grid_spacing / samples
+
+    for x in numba.prange(dose_grid_size[0]):
+
+        ray_direction = np.empty(3, dtype=np.float64)
+        pos_plane = np.empty(3, dtype=np.float64)
+
+        for y in range(dose_grid_size[1]):
+            for z in range(dose_grid_size[2]):
+
+                position_x = dose_grid_origin[0] + dose_grid_spacing[0] * x
+                position_y = dose_grid_origin[1] + dose_grid_spacing[1] * y
+                position_z = dose_grid_origin[2] + dose_grid_spacing[2] * z
+
+                block_factor = 0.0
+                for ix in range(samples):
+                    for iy in range(samples):
+                        for iz in range(samples):
+
+                            # Position of sample, as a ray towards the source
+                            ray_direction[0] = source_position[0] - (position_x - dose_grid_spacing[0]/2 + offset[0]/2 + offset[0] * ix)
+                            ray_direction[1] = source_position[1] - (position_y - dose_grid_spacing[1]/2 + offset[1]/2 + offset[1] * iy)
+                            ray_direction[2] = source_position[2] - (position_z - dose_grid_spacing[2]/2 + offset[2]/2 + offset[2] * iz)
+
+                            # Determine position on blocking plane in global coords
+                            cpu_line_block_plane_collision(pos_plane, source_position, ray_direction, source_v_y, 1e-6)
+
+                            # Convert to source coords and reduce to 2D
+                            block_factor += cpu_aperture_transmission(
+                                cpu_dot(source_transform[0, :], pos_plane),
+                                cpu_dot(source_transform[2, :], pos_plane),
+                                jaws,
+                                leaf_boundaries,
+                                leaf_ends
+                            ) / samples**3
+
+                dose_grid_blocked[x, y, z] = block_factor
+
+
+@cuda.jit(device=True)
+def cuda_aperture_transmission(u, v, jaws, leaf_boundaries, leaf_ends):
+
+    # Jaws
+    if u < jaws[0] or u >= jaws[1] or v < jaws[2] or v >= jaws[3]:
+        return 0.0
+
+    num_leaves = len(leaf_boundaries) - 1
+    if num_leaves < 1:
+        return 1.0
+    if u < leaf_boundaries[0] or u >= leaf_boundaries[num_leaves]:
+        return 0.0
+
+    # Binary search for the leaf row holding u
+    low = 0
+    high = num_leaves
+    while high - low > 1:
+        middle = (low + high) // 2
+        if u < leaf_boundaries[middle]:
+            high = middle
+        else:
+            low = middle
+    leaf = low
+
+    # Blocking towards the sides of the leaf
+    side = min(u - leaf_boundaries[leaf], leaf_boundaries[leaf + 1] - u)
+    rows = int(math.floor(side * 100))
+    if rows == 0:
+        blocking = 0.20
+    elif rows == 1:
+        blocking = 0.50
+    elif rows == 2:
+        blocking = 0.75
+    else:
+        blocking = 1.0
+
+    # Distance behind the end of the leaf blocking v, if any
+    if v < leaf_ends[0, leaf]:
+        behind = leaf_ends[0, leaf] - v
+    elif v >= leaf_ends[1, leaf]:
+        behind = v - leaf_ends[1, leaf]
+    else:
+        return 1.0
+    ramp = math.floor(behind * 100) / LEAF_END_PIXELS
+    if ramp < 1.0:
+        blocking *= ramp
+    return 1.0 - blocking
+
+
+@cuda.jit
+def cuda_aperture_hit_test(dose_grid_blocked, dose_grid_size, dose_grid_origin, dose_grid_spacing, source_position, source_v_y, source_transform, jaws, leaf_boundaries, leaf_ends, samples):
+
+    x, y, z = cuda.grid(3)
+    if x < dose_grid_size[0] and y < dose_grid_size[1] and z < dose_grid_size[2]:
+
+        position_x = dose_grid_origin[0] + dose_grid_spacing[0] * x
+        position_y = dose_grid_origin[1] + dose_grid_spacing[1] * y
+        position_z = dose_grid_origin[2] + dose_grid_spacing[2] * z
+        n_s = source_v_y[0] * source_position[0] + source_v_y[1] * source_position[1] + source_v_y[2] * source_position[2]
+
+        block_factor = 0.0
+        for ix in range(samples):
+            for iy in range(samples):
+                for iz in range(samples):
+
+                    # Position of sample, as a ray towards the source
+                    d0 = source_position[0] - (position_x - dose_grid_spacing[0]/2 + dose_grid_spacing[0] / samples * (ix + 0.5))
+                    d1 = source_position[1] - (position_y - dose_grid_spacing[1]/2 + dose_grid_spacing[1] / samples * (iy + 0.5))
+                    d2 = source_position[2] - (position_z - dose_grid_spacing[2]/2 + dose_grid_spacing[2] / samples * (iz + 0.5))
+
+                    # Determine position on blocking plane in global coords
+                    si = -n_s / (source_v_y[0] * d0 + source_v_y[1] * d1 + source_v_y[2] * d2)
+                    p0 = source_position[0] + si * d0
+                    p1 = source_position[1] + si * d1
+                    p2 = source_position[2] + si * d2
+
+                    # Convert to source coords and reduce to 2D
+                    block_factor += cuda_aperture_transmission(
+                        source_transform[0, 0] * p0 + source_transform[0, 1] * p1 + source_transform[0, 2] * p2,
+                        source_transform[2, 0] * p0 + source_transform[2, 1] * p1 + source_transform[2, 2] * p2,
+                        jaws,
+                        leaf_boundaries,
+                        leaf_ends
+                    ) / samples**3
+
+        dose_grid_blocked[x, y, z] = block_factor
@@ -0,0 +1,387 @@
+import numpy as np
+import numpy.typing as npt
+import numba
+import math
+from .cpu import cpu_block_transmission
+from .aperture import Aperture, cpu_aperture_transmission
+
+
+# Divergent beam's-eye-view calculation frame.
+#
+# The hit test, effective depth and off-axis distance stages each project
+# every dose grid voxel back to the source on their own. In the beam frame
+# the densities are instead resampled once onto a divergent grid whose
+# columns are rays from the source: columns are spaced evenly in (u, v), the
+# block plane coordinates of the ray (see Block), and samples along a column
+# are spaced evenly in depth d along the central axis. A column then has a
+# single block transmission and off-axis distance, and the effective depth is
+# a cumulative sum of density along the column, scaled by the path length
+# per unit depth of its ray. The beam frame grids are resampled back onto the
+# dose grid at the end.
+
+
+class BeamFrame:
+
+    def __init__(self, source, dose_grid_size, dose_grid_origin, dose_grid_spacing, resampling=2):
+        """ Fit a beam frame around a dose grid.
+
+        Parameters
+        ----------
+        source : Source
+            Source, at its current gantry and collimator angles
+        dose_grid_size : ndarray
+            Shape of the dose grid
+        dose_grid_origin : ndarray
+            Position of the first dose grid voxel centre, in cm
+        dose_grid_spacing : ndarray
+            Voxel dimensions, in form [dim_x, dim_y, dim_z]
+        resampling : int
+            Beam frame samples per (smallest) voxel dimension, across the
+            columns at the isocentre and along the columns
+        """
+        self.dose_grid_size = np.asarray(dose_grid_size, dtype=np.int64)
+        self.dose_grid_origin = np.asarray(dose_grid_origin, dtype=np.float64)
+        self.dose_grid_spacing = np.asarray(dose_grid_spacing, dtype=np.float64)
+        self.source_position = np.asarray(source.position, dtype=np.float64)
+        self.source_transform = np.asarray(source.transform, dtype=np.float64)
+
+        self.iso_distance, lateral, depths = block_plane_bounds(
+            self.source_position, self.source_transform, self.dose_grid_size,
+            self.dose_grid_origin, self.dose_grid_spacing
+        )
+
+        step = np.min(self.dose_grid_spacing) / resampling
+        self.spacing = np.array([step, step, step])
+        num_u, origin_u = centred_samples(lateral[:, 0], step)
+        num_v, origin_v = centred_samples(lateral[:, 1], step)
+        num_d = int(np.ceil(np.ptp(depths) / step))
+        self.shape = (num_u, num_v, num_d)
+        self.origin = np.array([origin_u, origin_v, np.min(depths) + step / 2])
+
+    def coordinates(self, axis):
+        """ Positions of the beam frame samples along an axis.
+
+        Parameters
+        ----------
+        axis : int
+            Axis of the frame, 0 (u), 1 (v) or 2 (d)
+
+        Returns
+        -------
+        ndarray
+            Block plane positions of the columns (u, v) or depths along the
+            central axis (d), in cm
+        """
+        return self.origin[axis] + np.arange(self.shape[axis]) * self.spacing[axis]
+
+    def densities(self, dose_grid_densities):
+        """ Resample dose grid densities into the beam frame.
+
+        Parameters
+        ----------
+        dose_grid_densities : ndarray
+            Density of each dose grid voxel
+
+        Returns
+        -------
+        ndarray
+            Density at each beam frame sample, zero outside the dose grid
+        """
+        beam_densities = np.zeros(self.shape, dtype=np.float32)
+        cpu_dose_grid_to_beam(
+            beam_densities,
+            dose_grid_densities,
+            self.dose_grid_size,
+            self.dose_grid_origin,
+            self.dose_grid_spacing,
+            self.source_position,
+            self.source_transform,
+            self.iso_distance,
+            self.origin,
+            self.spacing
+        )
+        return beam_densities
+
+    def d_eff(self, beam_densities):
+        """ Effective depth of each beam frame sample.
+
+        Parameters
+        ----------
+        beam_densities : ndarray
+            Density at each beam frame sample
+
+        Returns
+        -------
+        ndarray
+            Radiological path length from the source to each sample, in cm
+        """
+        u, v = np.meshgrid(self.coordinates(0), self.coordinates(1), indexing='ij')
+        plane = (
+            u[..., None] * self.source_transform[0] +
+            v[..., None] * self.source_transform[2]
+        )
+        path = np.linalg.norm(plane - self.source_position, axis=2) / self.iso_distance
+
+        # Midpoint rule: each sample counts half of its own step
+        d_eff = np.cumsum(beam_densities, axis=2, dtype=np.float32)
+        d_eff -= beam_densities / 2
+        d_eff *= (path * self.spacing[2]).astype(np.float32)[..., None]
+        return d_eff
+
+    def oad(self):
+        """ Off-axis distance of each beam frame column.
+
+        Returns
+        -------
+        ndarray
+            Distance from the central axis in the block plane, shape
+            (num_u, num_v, 1), in cm
+        """
+        u, v = np.meshgrid(self.coordinates(0), self.coordinates(1), indexing='ij')
+        return np.sqrt(u * u + v * v).astype(np.float32)[..., None]
+
+    def transmission(self, block, samples):
+        """ Block transmission of each beam frame column.
+
+        Parameters
+        ----------
+        block : Block or Aperture
+            Beam collimation
+        samples : int
+            Samples per column along u and v
+
+        Returns
+        -------
+        ndarray
+            Mean transmission over each column's cell in the block plane,
+            shape (num_u, num_v, 1)
+        """
+        columns = np.zeros(self.shape[:2] + (1,), dtype=np.float32)
+        if isinstance(block, Aperture):
+            cpu_beam_aperture_transmission(
+                columns,
+                self.origin,
+                self.spacing,
+                block.jaws,
+                block.leaf_boundaries,
+                block.leaf_ends,
+                samples
+            )
+        else:
+            cpu_beam_block_transmission(
+                columns,
+                self.origin,
+                self.spacing,
+                block.block_values,
+                samples
+            )
+        return columns
+
+    def to_dose_grid(self, beam_grid: npt.NDArray[np.float32]) -> npt.NDArray[np.float32]:
+        """ Resample a beam frame grid onto the dose grid.
+
+        Parameters
+        ----------
+        beam_grid : ndarray
+            Value at each beam frame sample, or of each column when the last
+            axis has length 1
+
+        Returns
+        -------
+        ndarray
+            Value at each dose grid voxel centre
+        """
+        dose_grid_values = np.zeros(tuple(self.dose_grid_size), dtype=np.float32)
+        cpu_beam_to_dose_grid(
+            dose_grid_values,
+            beam_grid,
+            self.dose_grid_size,
+            self.dose_grid_origin,
+            self.dose_grid_spacing,
+            self.source_position,
+            self.source_transform,
+            self.iso_distance,
+            self.origin,
+            self.spacing,
+            False
+        )
+        return dose_grid_values
+
+
+def block_plane_bounds(source_position, source_transform, dose_grid_size, dose_grid_origin, dose_grid_spacing):
+    """ Project the corners of a dose grid from the source onto the block plane.
+
+    Parameters
+    ----------
+    source_position : ndarray
+        Position of the source, in cm
+    source_transform : ndarray
+        Rotation from world to source coordinates
+    dose_grid_size : ndarray
+        Shape of the dose grid
+    dose_grid_origin : ndarray
+        Position of the first dose grid voxel centre, in cm
+    dose_grid_spacing : ndarray
+        Voxel dimensions, in form [dim_x, dim_y, dim_z]
+
+    Returns
+    -------
+    tuple
+        Distance from the source to the block plane along the central axis,
+        block plane coordinates (u, v) of the eight outer corners of the
+        grid, shape (8, 2), and their depths along the central axis, in cm
+    """
+    iso_distance = -np.dot(source_transform[1], source_position)
+    corners = np.array([
+        [i, j, k] for i in (0, 1) for j in (0, 1) for k in (0, 1)
+    ]) * dose_grid_size * dose_grid_spacing
+    corners += dose_grid_origin - dose_grid_spacing / 2
+    depths = (corners - source_position) @ source_transform[1]
+    if np.min(depths) <= 0:
+        raise NotImplementedError("Block plane frames are not yet implemented"
+                                  " for sources inside the dose grid.")
+    plane = source_position + (corners - source_position) * (iso_distance / depths)[:, None]
+    lateral = np.stack((
+        plane @ source_transform[0],
+        plane @ source_transform[2]
+    ), axis=1)
+    return iso_distance, lateral, depths
+
+
+def centred_samples(positions, step):
+    """ Fit evenly spaced samples, centred on a range of positions.
+
+    Parameters
+    ----------
+    positions : ndarray
+        Positions the samples must cover, in cm
+    step : float
+        Spacing of the samples, in cm
+
+    Returns
+    -------
+    tuple
+        Number of samples and position of the first, in cm
+    """
+    num = int(np.ceil(np.ptp(positions) / step)) + 1
+    return num, (np.min(positions) + np.max(positions) - (num - 1) * step) / 2
+
+
+@numba.njit(parallel=True)
+def cpu_dose_grid_to_beam(beam_grid, dose_grid_values, dose_grid_size, dose_grid_origin, dose_grid_spacing, source_position, source_transform, iso_distance, frame_origin, frame_spacing):
+
+    for i in numba.prange(beam_grid.shape[0]):
+        plane = np.empty(3, dtype=np.float64)
+        for j in range(beam_grid.shape[1]):
+
+            # Ray through the column's position in the block plane
+            u = frame_origin[0] + frame_spacing[0] * i
+            v = frame_origin[1] + frame_spacing[1] * j
+            for a in range(3):
+                plane[a] = u * source_transform[0, a] + v * source_transform[2, a] - source_position[a]
+
+            for k in range(beam_grid.shape[2]):
+                scale = (frame_origin[2] + frame_spacing[2] * k) / iso_distance
+
+                # Voxels are uniform, as when tracing the dose grid
+                x = int(math.floor((source_position[0] + plane[0] * scale - dose_grid_origin[0]) / dose_grid_spacing[0] + 0.5))
+                y = int(math.floor((source_position[1] + plane[1] * scale - dose_grid_origin[1]) / dose_grid_spacing[1] + 0.5))
+                z = int(math.floor((source_position[2] + plane[2] * scale - dose_grid_origin[2]) / dose_grid_spacing[2] + 0.5))
+                if x < 0 or x >= dose_grid_size[0] or y < 0 or y >= dose_grid_size[1] or z < 0 or z >= dose_grid_size[2]:
+                    continue
+                beam_grid[i, j, k] = dose_grid_values[x, y, z]
+
+
+@numba.njit(parallel=True)
+def cpu_beam_to_dose_grid(dose_grid_values, beam_grid, dose_grid_size, dose_grid_origin, dose_grid_spacing, source_position, source_transform, iso_distance, frame_origin, frame_spacing, inverse_square):
+
+    for x in numba.prange(dose_grid_size[0]):
+        distance = np.empty(3, dtype=np.float64)
+        for y in range(dose_grid_size[1]):
+            for z in range(dose_grid_size[2]):
+                distance[0] = dose_grid_origin[0] + dose_grid_spacing[0] * x - source_position[0]
+                distance[1] = dose_grid_origin[1] + dose_grid_spacing[1] * y - source_position[1]
+                distance[2] = dose_grid_origin[2] + dose_grid_spacing[2] * z - source_position[2]
+
+                # Depth along the central axis and position in the block plane
+                depth = 0.0
+                for a in range(3):
+                    depth += source_transform[1, a] * distance[a]
+                scale = iso_distance / depth
+                u = 0.0
+                v = 0.0
+                for a in range(3):
+                    u += source_transform[0, a] * (source_position[a] + distance[a] * scale)
+                    v += source_transform[2, a] * (source_position[a] + distance[a] * scale)
+
+                value = _trilinear(
+                    beam_grid,
+                    (u - frame_origin[0]) / frame_spacing[0],
+                    (v - frame_origin[1]) / frame_spacing[1],
+                    (depth - frame_origin[2]) / frame_spacing[2]
+                )
+                if inverse_square:
+                    value *= scale * scale
+                dose_grid_values[x, y, z] = value
+
+
+@numba.njit
+def _trilinear(values, fx, fy, fz):
+
+    # Interpolate at a fractional index, clamped to the grid
+    fx = min(max(fx, 0.0), values.shape[0] - 1.0)
+    fy = min(max(fy, 0.0), values.shape[1] - 1.0)
+    fz = min(max(fz, 0.0), values.shape[2] - 1.0)
+    i = min(int(fx), values.shape[0] - 2) if values.shape[0] > 1 else 0
+    j = min(int(fy), values.shape[1] - 2) if values.shape[1] > 1 else 0
+    k = min(int(fz), values.shape[2] - 2) if values.shape[2] > 1 else 0
+    i1 = min(i + 1, values.shape[0] - 1)
+    j1 = min(j + 1, values.shape[1] - 1)
+    k1 = min(k + 1, values.shape[2] - 1)
+    tx = fx - i
+    ty = fy - j
+    tz = fz - k
+    return (
+        (values[i, j, k] * (1 - tz) + values[i, j, k1] * tz) * (1 - tx) * (1 - ty) +
+        (values[i1, j, k] * (1 - tz) + values[i1, j, k1] * tz) * tx * (1 - ty) +
+        (values[i, j1, k] * (1 - tz) + values[i, j1, k1] * tz) * (1 - tx) * ty +
+        (values[i1, j1, k] * (1 - tz) + values[i1, j1, k1] * tz) * tx * ty
+    )
+
+
+@numba.njit(parallel=True)
+def cpu_beam_block_transmission(columns, frame_origin, frame_spacing, block_values, samples):
+
+    for i in numba.prange(columns.shape[0]):
+        for j in range(columns.shape[1]):
+            u = frame_origin[0] + frame_spacing[0] * (i - 0.5)
+            v = frame_origin[1] + frame_spacing[1] * (j - 0.5)
+            block_factor = 0.0
+            for iu in range(samples):
+                for iv in range(samples):
+                    block_factor += cpu_block_transmission(
+                        u + frame_spacing[0] * (iu + 0.5) / samples,
+                        v + frame_spacing[1] * (iv + 0.5) / samples,
+                        block_values
+                    )
+            columns[i, j, 0] = block_factor / samples**2
+
+
+@numba.njit(parallel=True)
+def cpu_beam_aperture_transmission(columns, frame_origin, frame_spacing, jaws, leaf_boundaries, leaf_ends, samples):
+
+    for i in numba.prange(columns.shape[0]):
+        for j in range(columns.shape[1]):
+            u = frame_origin[0] + frame_spacing[0] * (i - 0.5)
+            v = frame_origin[1] + frame_spacing[1] * (j - 0.5)
+            block_factor = 0.0
+            for iu in range(samples):
+                for iv in range(samples):
+                    block_factor += cpu_aperture_transmission(
+                        u + frame_spacing[0] * (iu + 0.5) / samples,
+                        v + frame_spacing[1] * (iv + 0.5) / samples,
+                        jaws,
+                        leaf_boundaries,
+                        leaf_ends
+                    )
+            columns[i, j, 0] = block_factor / samples**2
@@ -0,0 +1,61 @@
+from collections import OrderedDict
+
+
+# Bounded caches.
+#
+# Several engines precompute a table that only depends on the grid and the
+# kernel or source (kernel FFTs, ray-template stencils, source profile
+# FFTs), which is worth keeping across calculations. Those tables are
+# keyed on array contents, which functools.lru_cache cannot hash, and can
+# run to hundreds of megabytes, so they are held in a least recently used
+# cache of a few entries instead.
+
+
+class LRUCache:
+    """ Least recently used cache holding at most `maxsize` entries.
+
+    Parameters
+    ----------
+    maxsize : int
+        Number of entries kept before the least recently used is evicted
+    """
+
+    def __init__(self, maxsize):
+        if maxsize < 1:
+            raise ValueError("The cache must hold at least one entry.")
+        self.maxsize = maxsize
+        self._entries = OrderedDict()
+
+    def __len__(self):
+        return len(self._entries)
+
+    def __contains__(self, key):
+        return key in self._entries
+
+    def get(self, key, build):
+        """ Fetch an entry, building and storing it if missing.
+
+        Parameters
+        ----------
+        key : hashable
+            Key of the entry
+        build : callable
+            Called with no arguments to compute a missing entry
+
+        Returns
+        -------
+        object
+            The cached entry
+        """
+        if key in self._entries:
+            self._entries.move_to_end(key)
+            return self._entries[key]
+        value = build()
+        self._entries[key] = value
+        if len(self._entries) > self.maxsize:
+            self._entries.popitem(last=False)
+        return value
+
+    def clear(self):
+        """ Drop every entry. """
+        self._entries.clear()
@@ -2,7 +2,6 @@ import numpy as np
 import os; os.environ["NUMBA_ENABLE_CUDASIM"] = "0"; os.environ["NUMBA_CUDA_DEBUGINFO"] = "0";
 import numba
 from numba import cuda
-import matplotlib.pyplot as plt
 from scipy.interpolate import RegularGridInterpolator
 from scipy.spatial.distance import euclidean
 import math
@@ -11,10 +10,35 @@ from .geometry import (
     line_block_plane_collision,
     #line_calc_limit_plane_collision, isocentre_plane_position
 )
-from .kernel import KernelMono, KernelPoly
+from .kernel import (
+    polyenergetic_kernel, truncated_kernel, primary_scatter_kernel,
+    KERNEL_SAMPLING
+)
 from .dosegrid import DoseGrid
-# from .convolve_c import convolve_c # pylint: disable=E0611
-from .nist import mu_water
+from .result import CalculationResult, INTERMEDIATES
+from .terma import attenuation_table, ATTENUATION_TABLE_STEP
+from .active_voxels import active_voxels
+from .tilting import cone_table, divergence_bins
+from .points import (
+    point_receivers, cpu_mark_cone_lines, cpu_voxels_blocked_d_eff,
+    cpu_voxels_terma, cpu_voxels_gather_dose
+)
+from .cpu import (
+    cpu_hit_test, cpu_d_eff, cpu_oad, cpu_fluence, cpu_terma, cpu_fused_terma,
+    cpu_dose, cpu_gather_dose
+)
+from .stencil import ray_template_stencil, cpu_stencil_dose, cuda_stencil_dose
+from .collapsed_cone import (
+    cpu_collapsed_cone, exponential_kernel_fit, DECAY_COEFFICIENTS
+)
+from .fft_convolution import fft_dose
+from .aperture import Aperture, cpu_aperture_hit_test, cuda_aperture_hit_test
+from .source_ray import cpu_source_ray_d_eff
+from .beam_frame import BeamFrame
+from .fluence_map import FluenceMap
+from .footprint import (
+    summed_area_table, cpu_footprint_hit_test, cuda_footprint_hit_test
+)
 
 
 
@@ -121,89 +145,37 @@ def cuda_hit_test(dose_grid_blocked, dose_grid_size, dose_grid_origin, dose_grid
 
 
 @cuda.jit(device=True)
-def cuda_dda_3d(current_voxel, direction, dose_grid_spacing, dose_grid_size, voxels_traversed, intersection_t_values):
+def cuda_dda_init(direction, dose_grid_spacing, step, t, delta_t):
+
+    # Step along each axis, and distances from the voxel centre to the first
+    # boundary and between boundaries
+    for a in range(3):
+        step[a] = -1 if direction[a] < 0 else 1
+        d = abs(direction[a])
+        if d == 0.0:
+            t[a] = 1000000000.0
+            delta_t[a] = 1000000000.0
+        else:
+            t[a] = (dose_grid_spacing[a] / 2) / d
+            delta_t[a] = dose_grid_spacing[a] / d
 
-    step = cuda.local.array(3, numba.int32)
-    step[0] = -1 if direction[0] < 0 else 1
-    step[1] = -1 if direction[1] < 0 else 1
-    step[2] = -1 if direction[2] < 0 else 1
 
-    if direction[0] < 0:
-        direction[0] = -1 * direction[0]
-    if direction[1] < 0:
-        direction[1] = -1 * direction[1]
-    if direction[2] < 0:
-        direction[2] = -1 * direction[2]
+@cuda.jit(device=True)
+def cuda_dda_axis(t):
 
-    t = cuda.local.array(3, numba.float32)
-    t[0] = 0.0
-    t[1] = 0.0
-    t[2] = 0.0
+    # Axis of the next boundary crossed
+    if t[0] < t[1]:
+        return 0 if t[0] < t[2] else 2
+    return 1 if t[1] < t[2] else 2
 
-    delta_t = cuda.local.array(3, numba.float32)
-    delta_t[0] = 0.0
-    delta_t[1] = 0.0
-    delta_t[2] = 0.0
-    big_number = 1000000000.0
-
-    if direction[0] == 0.0:
-        t[0] = big_number
-        delta_t[0] = big_number
-    else:
-        t[0] = (dose_grid_spacing[0] / 2) / direction[0]
-        delta_t[0] = dose_grid_spacing[0] / direction[0]
-    if direction[1] == 0.0:
-        t[1] = big_number
-        delta_t[1] = big_number
-    else:
-        t[1] = (dose_grid_spacing[1] / 2) / direction[1]
-        delta_t[1] = dose_grid_spacing[1] / direction[1]
-    if direction[2] == 0.0:
-        t[2] = big_number
-        delta_t[2] = big_number
-    else:
-        t[2] = (dose_grid_spacing[2] / 2) / direction[2]
-        delta_t[2] = dose_grid_spacing[2] / direction[2]
-
-    xmax = dose_grid_size[0]
-    ymax = dose_grid_size[1]
-    zmax = dose_grid_size[2]
-
-    intersection_t_values_count = 0
-    voxels_traversed_count = 0
-
-    while (current_voxel[0] >= 0 and current_voxel[0] < xmax and
-           current_voxel[1] >= 0 and current_voxel[1] < ymax and
-           current_voxel[2] >= 0 and current_voxel[2] < zmax):
-
-        voxels_traversed[voxels_traversed_count, 0] = current_voxel[0]
-        voxels_traversed[voxels_traversed_count, 1] = current_voxel[1]
-        voxels_traversed[voxels_traversed_count, 2] = current_voxel[2]
-        voxels_traversed_count += 1
-        if t[0] < t[1]:
-            if t[0] < t[2]:
-                intersection_t_values[intersection_t_values_count] = t[0]
-                intersection_t_values_count += 1
-                t[0] += delta_t[0]
-                current_voxel[0] += step[0]
-            else:
-                intersection_t_values[intersection_t_values_count] = t[2]
-                intersection_t_values_count += 1
-                t[2] += delta_t[2]
-                current_voxel[2] += step[2]
-        else:
-            if t[1] < t[2]:
-                intersection_t_values[intersection_t_values_count] = t[1]
-                intersection_t_values_count += 1
-                t[1] += delta_t[1]
-                current_voxel[1] += step[1]
-            else:
-                intersection_t_values[intersection_t_values_count] = t[2]
-                intersection_t_values_count += 1
-                t[2] += delta_t[2]
-                current_voxel[2] += step[2]
 
-    return (voxels_traversed_count, intersection_t_values_count)
+@cuda.jit(device=True)
+def cuda_dda_inside(voxel, dose_grid_size):
+    return (
+        voxel[0] >= 0 and voxel[0] < dose_grid_size[0] and
+        voxel[1] >= 0 and voxel[1] < dose_grid_size[1] and
+        voxel[2] >= 0 and voxel[2] < dose_grid_size[2]
+    )
 
 
 @cuda.jit
@@ -217,9 +189,9 @@ def cuda_d_eff(dose_grid_size, dose_grid_origin, dose_grid_spacing, dose_grid_de
 
     if x < dose_grid_size[0] and y < dose_grid_size[1] and z < dose_grid_size[2]:
 
-        max_array_length = 444  # Should be equal to or larger than longest diagonal of grid
-        intersection_t_values = cuda.local.array(max_array_length, numba.float32)
-        voxels_traversed = cuda.local.array((max_array_length, 3), numba.int32)
+        step = cuda.local.array(3, numba.int32)
+        t = cuda.local.array(3, numba.float32)
+        delta_t = cuda.local.array(3, numba.float32)
 
         # Get voxel position
         position = cuda.local.array(3, numba.float32)
@@ -237,23 +209,18 @@ def cuda_d_eff(dose_grid_size, dose_grid_origin, dose_grid_spacing, dose_grid_de
         ray_direction[1] /= mag
         ray_direction[2] /= mag
 
-
-        voxels_traversed_count, intersection_t_values_count = cuda_dda_3d(
-            current_voxel,
-            ray_direction,
-            dose_grid_spacing,
-            dose_grid_size,
-            voxels_traversed,
-            intersection_t_values
-        )
-        d_eff[x, y, z] = 0
-        for v in range(voxels_traversed_count):
-            if v == 0:
-                d_eff[x, y, z] += dose_grid_densities[voxels_traversed[v, 0], voxels_traversed[v, 1], voxels_traversed[v, 2]] * (intersection_t_values[v])
-            else:
-                d_eff[x, y, z] += dose_grid_densities[voxels_traversed[v, 0], voxels_traversed[v, 1], voxels_traversed[v, 2]] * (intersection_t_values[v] - intersection_t_values[v - 1])
-
-
+        # Accumulate density times path length while stepping through the
+        # voxels towards the source
+        cuda_dda_init(ray_direction, dose_grid_spacing, step, t, delta_t)
+        depth = 0.0
+        t_previous = 0.0
+        while cuda_dda_inside(current_voxel, dose_grid_size):
+            a = cuda_dda_axis(t)
+            depth += dose_grid_densities[current_voxel[0], current_voxel[1], current_voxel[2]] * (t[a] - t_previous)
+            t_previous = t[a]
+            t[a] += delta_t[a]
+            current_voxel[a] += step[a]
+        d_eff[x, y, z] = depth
 
 
 @cuda.jit(device=True)
@@ -317,6 +284,42 @@ def cuda_oad(dose_grid_oad, dose_grid_size, dose_grid_origin, dose_grid_spacing,
 
 
 
+@cuda.jit(device=True)
+def cuda_attenuation(attenuation, attenuation_step, depth):
+
+    # Linear interpolation of the attenuation table (see terma.py), clamped
+    # at both ends
+    position = depth / attenuation_step
+    if position <= 0:
+        return attenuation[0]
+    index = int(position)
+    if index >= len(attenuation) - 1:
+        return attenuation[len(attenuation) - 1]
+    fraction = position - index
+    return attenuation[index] + fraction * (attenuation[index + 1] - attenuation[index])
+
+
+@cuda.jit(device=True)
+def cuda_fluence_model(mag, oad, source_sad, sPri, zAnn, sAnn, rInner, rOuter, zExp, sExp, kExp):
+
+    # Point source
+    fluence_point = sPri * math.pow(source_sad / mag, 2)
+
+    # Annular source
+    r_ann = oad * zAnn / source_sad
+    if r_ann >= rInner and r_ann <= rOuter:
+        fluence_ann = sAnn * math.pow(source_sad - zAnn, 2) / math.pow(mag - zAnn, 2)
+    else:
+        fluence_ann = 0.0
+
+    # Exponential source
+    oad = 2.0 if oad < 2.0 else oad  # Avoid function blowing up near zero
+    r_exp = oad * zExp / source_sad
+    fluence_exp = sExp / r_exp * math.exp(-kExp * r_exp) * math.pow(source_sad - zExp, 2) / math.pow(mag - zExp, 2)
+
+    return fluence_point + fluence_ann + fluence_exp
+
+
 @cuda.jit
 def cuda_fluence(dose_grid_fluence, dose_grid_oad, dose_grid_blocked, dose_grid_size, dose_grid_origin, dose_grid_spacing, source_position, source_sad, sPri, zAnn, sAnn, rInner, rOuter, zExp, sExp, kExp):
 
@@ -340,39 +343,25 @@ def cuda_fluence(dose_grid_fluence, dose_grid_oad, dose_grid_blocked, dose_grid_
             distance[1] * distance[1] +
             distance[2] * distance[2]
         )
-        oad = dose_grid_oad[x, y, z]
 
-        # Point source
-        fluence_point = sPri * math.pow(source_sad / mag, 2)
-
-        # Annular source
-        r_ann = oad * zAnn / source_sad
-        if r_ann >= rInner and r_ann <= rOuter:
-            fluence_ann = sAnn * math.pow(source_sad - zAnn, 2) / math.pow(mag - zAnn, 2)
-        else:
-            fluence_ann = 0.0
-
-        # Exponential source
-        oad = 2.0 if oad < 2.0 else oad  # Avoid function blowing up near zero
-        r_exp = oad * zExp / source_sad
-        fluence_exp = sExp / r_exp * math.exp(-kExp * r_exp) * math.pow(source_sad - zExp, 2) / math.pow(mag - zExp, 2)
-
-        dose_grid_fluence[x, y, z] = (fluence_point + fluence_ann + fluence_exp) * dose_grid_blocked[x, y, z]
+        dose_grid_fluence[x, y, z] = cuda_fluence_model(
+            mag, dose_grid_oad[x, y, z], source_sad, sPri, zAnn, sAnn, rInner,
+            rOuter, zExp, sExp, kExp
+        ) * dose_grid_blocked[x, y, z]
 
 
 
 @cuda.jit
-def cuda_terma(dose_grid_terma, dose_grid_blocked, dose_grid_fluence, dose_grid_d_eff, dose_grid_size, energy, energy_weights, mu_w, f_soften, f_horn):
+def cuda_terma(dose_grid_terma, dose_grid_blocked, dose_grid_fluence, dose_grid_d_eff, dose_grid_size, attenuation, attenuation_step, f_soften, f_horn):
 
     x, y, z = cuda.grid(3)
 
     if x < dose_grid_size[0] and y < dose_grid_size[1] and z < dose_grid_size[2]:
 
-        terma = numba.float32(0)
-        for i in range(len(energy)):
-            terma += energy_weights[i] * dose_grid_fluence[x, y, z] * math.exp(
-                -mu_w[i] * f_soften[x, y, z] * dose_grid_d_eff[x, y, z]
-            ) * energy[i] * mu_w[i] * f_horn[x, y, z]
+        terma = cuda_attenuation(
+            attenuation, attenuation_step,
+            f_soften[x, y, z] * dose_grid_d_eff[x, y, z]
+        ) * dose_grid_fluence[x, y, z] * f_horn[x, y, z]
 
         dose_grid_terma[x, y, z] = terma * dose_grid_blocked[x, y, z]
 
@@ -383,144 +372,986 @@ def cuda_terma(dose_grid_terma, dose_grid_blocked, dose_grid_fluence, dose_grid_
 
 
 @cuda.jit
-def cuda_dose(dose_grid_dose, dose_grid_spacing, dose_grid_size, dose_grid_terma, kernel_thetas, kernel_phis, kernel, source_transform):
-
-    current_voxel = cuda.local.array(3, numba.int32)
-    direction = cuda.local.array(3, numba.float32)
-    max_array_length = 800  # Should be equal to or larger than longest diagonal of grid (maybe? TODO)
-    intersection_t_values = cuda.local.array(max_array_length, numba.float32)
-    voxels_traversed = cuda.local.array((max_array_length, 3), numba.int32)
-    intersection_indices = cuda.local.array(max_array_length, numba.int32)
-
+def cuda_fused_terma(dose_grid_terma, dose_grid_blocked, dose_grid_d_eff, dose_grid_size, dose_grid_origin, dose_grid_spacing, source_position, source_sad, source_transform, source_v_y, sPri, zAnn, sAnn, rInner, rOuter, zExp, sExp, kExp, softRatio, softLimit, hornRatio, attenuation, attenuation_step):
 
     x, y, z = cuda.grid(3)
 
     if x < dose_grid_size[0] and y < dose_grid_size[1] and z < dose_grid_size[2]:
 
-        T = dose_grid_terma[x, y, z]
-        if T:
-
-            for i in range(len(kernel_thetas)):
-                for j in range(len(kernel_phis)):
-
-                    # Save current voxel index for later
-                    # current_voxel = cuda.local.array(3, numba.int32)
-                    current_voxel[0] = x
-                    current_voxel[1] = y
-                    current_voxel[2] = z
+        blocked = dose_grid_blocked[x, y, z]
+        if blocked == 0:
+            dose_grid_terma[x, y, z] = 0.0
+            return
 
+        # Determine distance/direction to source
+        distance = cuda.local.array(3, numba.float32)
+        distance[0] = source_position[0] - (dose_grid_origin[0] + dose_grid_spacing[0] * x)
+        distance[1] = source_position[1] - (dose_grid_origin[1] + dose_grid_spacing[1] * y)
+        distance[2] = source_position[2] - (dose_grid_origin[2] + dose_grid_spacing[2] * z)
+        mag = math.sqrt(cuda_dot(distance, distance))
 
-                    # Calculate direction vector
-                    theta_rad = kernel_thetas[i] * math.pi / 180.0
-                    phi_rad = kernel_phis[j] * math.pi / 180.0
-                    c_t = math.cos(theta_rad)
-                    s_t = math.sin(theta_rad)
-                    c_p = math.cos(phi_rad)
-                    s_p = math.sin(phi_rad)
-                    # direction = cuda.local.array(3, numba.float32)
-                    direction[0] = c_t * s_p
-                    direction[1] = c_p
-                    direction[2] = s_t * s_p
+        # Off-axis distance, on the iso plane in source coords
+        pos_plane = cuda.local.array(3, numba.float32)
+        pos_plane = cuda_line_block_plane_collision(pos_plane, source_position, distance, source_v_y, 1e-6)
+        pos_source_x = cuda_dot(source_transform[0, :], pos_plane)
+        pos_source_z = cuda_dot(source_transform[2, :], pos_plane)
+        oad = math.sqrt(pos_source_x * pos_source_x + pos_source_z * pos_source_z)
+
+        fluence = cuda_fluence_model(
+            mag, oad, source_sad, sPri, zAnn, sAnn, rInner, rOuter, zExp,
+            sExp, kExp
+        ) * blocked
+        f_soften = 1.0 / (1.0 - softRatio * oad) if oad < softLimit else 1.0
+        f_horn = 1.0 + oad * hornRatio
+
+        terma = cuda_attenuation(
+            attenuation, attenuation_step, f_soften * dose_grid_d_eff[x, y, z]
+        )
 
-                    # Normalise
-                    N = math.sqrt(direction[0] * direction[0] + direction[1] * direction[1] + direction[2] * direction[2])
-                    direction[0] /= N
-                    direction[1] /= N
-                    direction[2] /= N
+        dose_grid_terma[x, y, z] = terma * fluence * f_horn * blocked
 
 
-                    # if i == 0:
-                    #     print(kernel_thetas[i], kernel_phis[j], direction[0], direction[1], direction[2])
 
+@cuda.jit
+def cuda_dose(dose_grid_dose, dose_grid_spacing, dose_grid_size, dose_grid_terma, active_voxels, voxel_bins, cone_directions, cone_rows, kernel, kernel_cutoffs, dose_grid_densities, radiological):
 
-                    # Raycast to find voxels along cone line
-                    # and boundary intersection values
-                    # max_array_length = 444  # Should be equal to or larger than longest diagonal of grid
-                    # intersection_t_values = cuda.local.array(max_array_length, numba.float32)
-                    # voxels_traversed = cuda.local.array((max_array_length, 3), numba.int32)
-                    voxels_traversed_count, intersection_t_values_count = cuda_dda_3d(
-                        current_voxel,
-                        direction,
-                        dose_grid_spacing,
-                        dose_grid_size,
-                        voxels_traversed,
-                        intersection_t_values
-                    )
+    current_voxel = cuda.local.array(3, numba.int32)
+    direction = cuda.local.array(3, numba.float32)
+    step = cuda.local.array(3, numba.int32)
+    t = cuda.local.array(3, numba.float32)
+    delta_t = cuda.local.array(3, numba.float32)
 
-                    # Calculate which indices in kernel data array will
-                    # correspond to boundary intersection values
-                    # intersection_indices = cuda.local.array(max_array_length, numba.int32)
-                    for m in range(intersection_t_values_count):
-                        intersection = intersection_t_values[m]
+    # One thread per cone line of each active voxel, so every thread has
+    # work and neighbouring threads trace lines of similar length
+    n = cuda.grid(1)
+    num_cones = cone_directions.shape[1]
+
+    if n < active_voxels.shape[0] * num_cones:
+
+        v = n // num_cones
+        k = n % num_cones
+        j = cone_rows[k]
+
+        # Save current voxel index for later
+        current_voxel[0] = active_voxels[v, 0]
+        current_voxel[1] = active_voxels[v, 1]
+        current_voxel[2] = active_voxels[v, 2]
+
+        # Look up the direction in the table of the voxel's tilt bin (see
+        # tilting.py)
+        b = voxel_bins[v if voxel_bins.shape[0] > 1 else 0]
+        direction[0] = cone_directions[b, k, 0]
+        direction[1] = cone_directions[b, k, 1]
+        direction[2] = cone_directions[b, k, 2]
+
+        # Step along the cone line, depositing the difference in cumulative
+        # kernel across the traverse of each voxel. Past the cone's cutoff
+        # (see truncated_kernel) nothing more is deposited. With radiological
+        # scaling the kernel is looked up at the density weighted distance.
+        # Every channel of the stacked kernel is deposited on the way (see
+        # cpu_dose).
+        last_index = kernel_cutoffs[j]
+        cuda_dda_init(direction, dose_grid_spacing, step, t, delta_t)
+        index2 = -1
+        r = 0.0
+        t_previous = 0.0
+        while cuda_dda_inside(current_voxel, dose_grid_size):
+            a = cuda_dda_axis(t)
+            if radiological:
+                r += dose_grid_densities[current_voxel[0], current_voxel[1], current_voxel[2]] * (t[a] - t_previous)
+                t_previous = t[a]
+            else:
+                r = t[a]
+
+            # Convert intersection distance to 0.1 mm and subtract 0.5 mm
+            # (first kernel point)
+            index1 = abs(math.floor(r * 100.0 - 5.0))
+            if index1 > last_index:
+                index1 = last_index
+            for ch in range(kernel.shape[0]):
+                T = dose_grid_terma[ch if dose_grid_terma.shape[0] > 1 else 0, active_voxels[v, 0], active_voxels[v, 1], active_voxels[v, 2]]
+                k1 = kernel[ch, j, index1]
+                if index2 >= 0:
+                    k1 -= kernel[ch, j, index2]
+                cuda.atomic.add(dose_grid_dose, (ch, current_voxel[0], current_voxel[1], current_voxel[2]), T * k1)
+            if index1 == last_index:
+                break
+            index2 = index1
+            t[a] += delta_t[a]
+            current_voxel[a] += step[a]
 
-                        # Convert intersection t value to 0.1 mm and subtract 0.5 mm (first kernel point)
-                        intersection_index = abs(math.floor(intersection * 100.0 - 5.0))
 
-                        # Handle if ray larger than kernel data
-                        if intersection_index > 5995:
-                            intersection_index = 5995
+@cuda.jit
+def cuda_gather_dose(dose_grid_dose, dose_grid_spacing, dose_grid_size, dose_grid_terma, cone_directions, cone_rows, kernel, kernel_cutoffs):
 
-                        intersection_indices[m] = intersection_index
+    # One thread per receiving voxel, gathering along the reversed cone
+    # lines as in cpu_gather_dose, so no atomics are needed
+    current_voxel = cuda.local.array(3, numba.int32)
+    direction = cuda.local.array(3, numba.float32)
+    step = cuda.local.array(3, numba.int32)
+    t = cuda.local.array(3, numba.float32)
+    delta_t = cuda.local.array(3, numba.float32)
 
+    x, y, z = cuda.grid(3)
 
-                    for m in range(intersection_t_values_count):
-                        if m == 0:
-                            # First voxel, get appropriate kernal index
-                            # of and corresponding kernel value
-                            # (single intersection)
-                            index1 = intersection_indices[m]
-                            k3 = kernel[j, index1]
-                        else:
-                            # For al other voxels, get the diffeence
-                            # between cumulative kernal data across the
-                            # traverse of the voxel
-                            # (double intersection)
-                            index1 = intersection_indices[m]
-                            k1 = kernel[j, index1]
-                            index2 = intersection_indices[m - 1]
-                            k2 = kernel[j, index2]
-                            k3 = k1 - k2
-                        
-                            # if i == 0 and j == 0:
-                            #     print(index1, index2, k1, k2, k3)
+    if x < dose_grid_size[0] and y < dose_grid_size[1] and z < dose_grid_size[2]:
 
-                        # print(voxels_traversed[m, 0], voxels_traversed[m, 1], voxels_traversed[m, 2])
-                        cuda.atomic.add(dose_grid_dose, (voxels_traversed[m, 0], voxels_traversed[m, 1], voxels_traversed[m, 2]), T * k3)
+        dose = 0.0
+        for k in range(cone_rows.shape[0]):
+
+            current_voxel[0] = x
+            current_voxel[1] = y
+            current_voxel[2] = z
+
+            # Reversed direction vector, from the cone table
+            direction[0] = -cone_directions[k, 0]
+            direction[1] = -cone_directions[k, 1]
+            direction[2] = -cone_directions[k, 2]
+            j = cone_rows[k]
+
+            last_index = kernel_cutoffs[j]
+            cuda_dda_init(direction, dose_grid_spacing, step, t, delta_t)
+            k2 = 0.0
+            while cuda_dda_inside(current_voxel, dose_grid_size):
+                a = cuda_dda_axis(t)
+                index1 = abs(math.floor(t[a] * 100.0 - 5.0))
+                if index1 > last_index:
+                    index1 = last_index
+                k1 = kernel[j, index1]
+                dose += dose_grid_terma[current_voxel[0], current_voxel[1], current_voxel[2]] * (k1 - k2)
+                if index1 == last_index:
+                    break
+                k2 = k1
+                t[a] += delta_t[a]
+                current_voxel[a] += step[a]
+
+        dose_grid_dose[x, y, z] += dose
 
 
-            # dose_grid_dose[x, y, z] = 100.0
+class Conehead:
 
-    # cuda.syncthreads()
+    def calculate(self, source, block, phantom, settings):
 
+        backend = self._select_backend(settings)
+        dose_engine = self._select_dose_engine(settings)
+        hit_test = self._select_hit_test(settings)
+        depth_engine = self._select_depth_engine(settings)
+        calculation_frame = self._select_calculation_frame(settings)
+        keep = self._select_intermediates(settings)
+        terma_stage = self._select_terma_stage(settings, keep)
+        fluence_engine = self._select_fluence_engine(settings, calculation_frame, terma_stage, keep)
+        extra_focal = self._select_extra_focal(settings, fluence_engine)
+        kernel_energy_fraction = self._select_kernel_energy_fraction(settings, dose_engine)
+        kernel_scaling = self._select_kernel_scaling(settings, dose_engine)
+        dose_channels = self._select_dose_channels(settings, dose_engine, keep)
+        kernel_tilting = self._select_kernel_tilting(settings, dose_engine)
 
+        # Create dose grid (just the same size as the phantom for now)
+        self.dose_grid = DoseGrid(phantom.size, phantom.origin, phantom.spacing)
+        dose_grid_size = np.array(self.dose_grid.size)
 
 
+        # Perform hit testing to find which dose grid voxels are in the beam
+        print("Performing hit-testing of dose grid voxels...")
+        if isinstance(block, Aperture) and fluence_engine == 'voxel':
+            # Analytic apertures are evaluated at each supersampled point
+            if hit_test != 'supersample':
+                raise NotImplementedError("The requested hit test is not yet"
+                                          " implemented for apertures.")
+            hit_test = 'aperture'
+        if hit_test == 'footprint':
+            block_table = summed_area_table(block.block_values)
+            block_range = (
+                float(block.block_values.min()),
+                float(block.block_values.max())
+            )
+        fluence_map_values = None
+        if fluence_engine == 'map':
+            # Transmission is averaged over each cell of a map in the block
+            # plane, which is then projected onto the dose grid (on the host)
+            fluence_map = FluenceMap(
+                source,
+                dose_grid_size,
+                self.dose_grid.origin,
+                self.dose_grid.spacing,
+                settings.get('fluenceMapSpacing')
+            )
+            fluence_map_transmission = fluence_map.transmission(
+                block, settings['fluenceResampling']
+            )
+            dose_grid_blocked = fluence_map.project(fluence_map_transmission)
+            if backend == 'cuda':
+                dose_grid_blocked_device = cuda.to_device(dose_grid_blocked)
+        elif calculation_frame == 'beam':
+            # Looked up per column of the beam frame, with the effective depths
+            pass
+        elif backend == 'cuda':
+            dose_grid_blocked_device = cuda.to_device(np.zeros(self.dose_grid.size))
+            threadsperblock = (8, 8, 8)
+            blockspergrid_x = math.ceil(dose_grid_blocked_device.shape[0] / threadsperblock[0])
+            blockspergrid_y = math.ceil(dose_grid_blocked_device.shape[1] / threadsperblock[1])
+            blockspergrid_z = math.ceil(dose_grid_blocked_device.shape[2] / threadsperblock[2])
+            blockspergrid = (blockspergrid_x, blockspergrid_y, blockspergrid_z)
+            if hit_test == 'supersample':
+                cuda_hit_test[blockspergrid, threadsperblock](
+                    dose_grid_blocked_device,
+                    cuda.to_device(self.dose_grid.size),
+                    cuda.to_device(self.dose_grid.origin),
+                    cuda.to_device(self.dose_grid.spacing),
+                    cuda.to_device(source.position),
+                    cuda.to_device(source.v_y),
+                    cuda.to_device(source.transform),
+                    cuda.to_device(block.block_values),
+                    settings['fluenceResampling']
+                )
+            elif hit_test == 'footprint':
+                cuda_footprint_hit_test[blockspergrid, threadsperblock](
+                    dose_grid_blocked_device,
+                    cuda.to_device(self.dose_grid.size),
+                    cuda.to_device(self.dose_grid.origin),
+                    cuda.to_device(self.dose_grid.spacing),
+                    cuda.to_device(source.position),
+                    cuda.to_device(source.v_y),
+                    cuda.to_device(source.transform),
+                    cuda.to_device(block_table),
+                    *block_range,
+                    settings['fluenceResampling']
+                )
+            elif hit_test == 'aperture':
+                cuda_aperture_hit_test[blockspergrid, threadsperblock](
+                    dose_grid_blocked_device,
+                    cuda.to_device(self.dose_grid.size),
+                    cuda.to_device(self.dose_grid.origin),
+                    cuda.to_device(self.dose_grid.spacing),
+                    cuda.to_device(source.position),
+                    cuda.to_device(source.v_y),
+                    cuda.to_device(source.transform),
+                    cuda.to_device(block.jaws),
+                    cuda.to_device(block.leaf_boundaries),
+                    cuda.to_device(block.leaf_ends),
+                    settings['fluenceResampling']
+                )
+            dose_grid_blocked = dose_grid_blocked_device.copy_to_host()
+        else:
+            dose_grid_blocked = np.zeros(self.dose_grid.size)
+            if hit_test == 'supersample':
+                cpu_hit_test(
+                    dose_grid_blocked,
+                    dose_grid_size,
+                    self.dose_grid.origin,
+                    self.dose_grid.spacing,
+                    source.position,
+                    source.v_y,
+                    source.transform,
+                    block.block_values,
+                    settings['fluenceResampling']
+                )
+            elif hit_test == 'footprint':
+                cpu_footprint_hit_test(
+                    dose_grid_blocked,
+                    dose_grid_size,
+                    self.dose_grid.origin,
+                    self.dose_grid.spacing,
+                    source.position,
+                    source.v_y,
+                    source.transform,
+                    block_table,
+                    *block_range,
+                    settings['fluenceResampling']
+                )
+            elif hit_test == 'aperture':
+                cpu_aperture_hit_test(
+                    dose_grid_blocked,
+                    dose_grid_size,
+                    self.dose_grid.origin,
+                    self.dose_grid.spacing,
+                    source.position,
+                    source.v_y,
+                    source.transform,
+                    block.jaws,
+                    block.leaf_boundaries,
+                    block.leaf_ends,
+                    settings['fluenceResampling']
+                )
+
+
+        dose_grid_densities = self._dose_grid_densities(phantom)
 
 
+        print("Calculating effective depths...")
+        if calculation_frame == 'beam':
+            # Resample the densities once into the beam frame, where the
+            # block transmission, effective depth and off-axis distance are
+            # found along its columns
+            beam_frame = BeamFrame(
+                source,
+                dose_grid_size,
+                self.dose_grid.origin,
+                self.dose_grid.spacing,
+                settings.get('beamFrameResampling', 2)
+            )
+            dose_grid_blocked = beam_frame.to_dose_grid(
+                beam_frame.transmission(block, settings['fluenceResampling'])
+            )
+            dose_grid_d_eff = beam_frame.to_dose_grid(
+                beam_frame.d_eff(beam_frame.densities(dose_grid_densities))
+            )
+            if terma_stage == 'separate':
+                dose_grid_oad = beam_frame.to_dose_grid(beam_frame.oad())
+            del beam_frame
+            if backend == 'cuda':
+                dose_grid_blocked_device = cuda.to_device(dose_grid_blocked)
+                dose_grid_d_eff_device = cuda.to_device(dose_grid_d_eff)
+                if terma_stage == 'separate':
+                    dose_grid_oad_device = cuda.to_device(dose_grid_oad)
+        elif depth_engine == 'sourceRay':
+            # Source-ray engine runs on the host
+            dose_grid_d_eff = np.zeros_like(dose_grid_densities, dtype=np.float32)
+            cpu_source_ray_d_eff(
+                dose_grid_size,
+                self.dose_grid.origin,
+                self.dose_grid.spacing,
+                dose_grid_densities,
+                source.position,
+                dose_grid_d_eff,
+                settings.get('depthResampling', 2)
+            )
+            if backend == 'cuda':
+                dose_grid_d_eff_device = cuda.to_device(dose_grid_d_eff)
+        elif backend == 'cuda':
+            dose_grid_densities_device = cuda.to_device(dose_grid_densities)
+            dose_grid_d_eff_device = cuda.to_device(np.zeros_like(dose_grid_densities, dtype=np.float32))
+            threadsperblock = (8, 8, 8)
+            blockspergrid_x = math.ceil(dose_grid_densities.shape[0] / threadsperblock[0])
+            blockspergrid_y = math.ceil(dose_grid_densities.shape[1] / threadsperblock[1])
+            blockspergrid_z = math.ceil(dose_grid_densities.shape[2] / threadsperblock[2])
+            blockspergrid = (blockspergrid_x, blockspergrid_y, blockspergrid_z)
+            cuda_d_eff[blockspergrid, threadsperblock](
+                cuda.to_device(self.dose_grid.size),
+                cuda.to_device(self.dose_grid.origin),
+                cuda.to_device(self.dose_grid.spacing),
+                dose_grid_densities_device,
+                cuda.to_device(source.position),
+                dose_grid_d_eff_device
+            )
+            dose_grid_d_eff = dose_grid_d_eff_device.copy_to_host()
+        else:
+            dose_grid_d_eff = np.zeros_like(dose_grid_densities, dtype=np.float32)
+            cpu_d_eff(
+                dose_grid_size,
+                self.dose_grid.origin,
+                self.dose_grid.spacing,
+                dose_grid_densities,
+                source.position,
+                dose_grid_d_eff
+            )
 
 
+        energy = np.array([np.float32(x) for x in settings['energy_weights'].keys()], dtype=np.float32)
+        energy_weights = np.array([np.float32(x) for x in settings['energy_weights'].values()], dtype=np.float32)
 
+        # Tabulate the spectrum-weighted attenuation out to the deepest
+        # softened effective depth
+        print("Tabulating spectrum attenuation...")
+        f_soften_max = 1 / (1 - settings['softRatio'] * settings['softLimit'])
+        attenuation = attenuation_table(
+            energy,
+            energy_weights,
+            dose_grid_d_eff.max() * max(f_soften_max, 1)
+        )
+        fluence_settings = (
+            settings['sPri'],
+            settings['zAnn'],
+            settings['sAnn'],
+            settings['rInner'],
+            settings['rOuter'],
+            settings['zExp'],
+            settings['sExp'],
+            settings['kExp']
+        )
+        if terma_stage == 'fused':
+            # Off-axis distance, fluence, softening and horn are found per
+            # voxel on the way to TERMA, so only the TERMA grid is written
+            print("Calculating TERMA...")
+            dose_grid_oad = dose_grid_fluence = f_soften = f_horn = None
+            fused_settings = fluence_settings + (
+                settings['softRatio'],
+                settings['softLimit'],
+                settings['hornRatio']
+            )
+            dose_grid_terma = np.zeros_like(dose_grid_densities, dtype=np.float32)
+            if backend == 'cuda':
+                dose_grid_terma_device = cuda.to_device(dose_grid_terma)
+                threadsperblock = (8, 8, 8)
+                blockspergrid_x = math.ceil(dose_grid_terma.shape[0] / threadsperblock[0])
+                blockspergrid_y = math.ceil(dose_grid_terma.shape[1] / threadsperblock[1])
+                blockspergrid_z = math.ceil(dose_grid_terma.shape[2] / threadsperblock[2])
+                blockspergrid = (blockspergrid_x, blockspergrid_y, blockspergrid_z)
+                cuda_fused_terma[blockspergrid, threadsperblock](
+                    dose_grid_terma_device,
+                    dose_grid_blocked_device,
+                    dose_grid_d_eff_device,
+                    cuda.to_device(self.dose_grid.size),
+                    cuda.to_device(self.dose_grid.origin),
+                    cuda.to_device(self.dose_grid.spacing),
+                    cuda.to_device(source.position),
+                    source.sad,
+                    cuda.to_device(source.transform),
+                    cuda.to_device(source.v_y),
+                    *fused_settings,
+                    cuda.to_device(attenuation),
+                    ATTENUATION_TABLE_STEP
+                )
+                dose_grid_terma = dose_grid_terma_device.copy_to_host()
+            else:
+                cpu_fused_terma(
+                    dose_grid_terma,
+                    dose_grid_blocked,
+                    dose_grid_d_eff,
+                    dose_grid_size,
+                    self.dose_grid.origin,
+                    self.dose_grid.spacing,
+                    source.position,
+                    source.sad,
+                    source.transform,
+                    source.v_y,
+                    *fused_settings,
+                    attenuation,
+                    ATTENUATION_TABLE_STEP
+                )
+        else:
+            print("Calculating off-axis distances")
+            if calculation_frame == 'beam':
+                # Found in the beam frame, with the effective depths
+                pass
+            elif backend == 'cuda':
+                dose_grid_oad = np.zeros_like(dose_grid_densities, dtype=np.float32)
+                dose_grid_oad_device = cuda.to_device(dose_grid_oad)
+                threadsperblock = (8, 8, 8)
+                blockspergrid_x = math.ceil(dose_grid_oad.shape[0] / threadsperblock[0])
+                blockspergrid_y = math.ceil(dose_grid_oad.shape[1] / threadsperblock[1])
+                blockspergrid_z = math.ceil(dose_grid_oad.shape[2] / threadsperblock[2])
+                blockspergrid = (blockspergrid_x, blockspergrid_y, blockspergrid_z)
+                cuda_oad[blockspergrid, threadsperblock](
+                    dose_grid_oad_device,
+                    cuda.to_device(self.dose_grid.size),
+                    cuda.to_device(self.dose_grid.origin),
+                    cuda.to_device(self.dose_grid.spacing),
+                    cuda.to_device(source.position),
+                    source.sad,
+                    cuda.to_device(source.transform),
+                    cuda.to_device(source.v_y)
+                )
+                dose_grid_oad = dose_grid_oad_device.copy_to_host()
+            else:
+                dose_grid_oad = np.zeros_like(dose_grid_densities, dtype=np.float32)
+                cpu_oad(
+                    dose_grid_oad,
+                    dose_grid_size,
+                    self.dose_grid.origin,
+                    self.dose_grid.spacing,
+                    source.position,
+                    source.sad,
+                    source.transform,
+                    source.v_y
+                )
+
+
+            print("Calculating photon fluence...")
+            dose_grid_fluence = np.zeros_like(dose_grid_densities, dtype=np.float32)
+            if fluence_engine == 'map':
+                # Evaluated once in the block plane and scaled to each voxel
+                # by the inverse square law
+                fluence_map_values = fluence_map.fluence(
+                    fluence_map_transmission,
+                    *fluence_settings,
+                    zCol=settings.get('zCol', 40.0) if extra_focal == 'collimated' else None
+                )
+                dose_grid_fluence = fluence_map.project(
+                    fluence_map_values, inverse_square=True
+                )
+                del fluence_map, fluence_map_transmission
+                if backend == 'cuda':
+                    dose_grid_fluence_device = cuda.to_device(dose_grid_fluence)
+            elif backend == 'cuda':
+                dose_grid_fluence_device = cuda.to_device(dose_grid_fluence)
+                threadsperblock = (8, 8, 8)
+                blockspergrid_x = math.ceil(dose_grid_fluence.shape[0] / threadsperblock[0])
+                blockspergrid_y = math.ceil(dose_grid_fluence.shape[1] / threadsperblock[1])
+                blockspergrid_z = math.ceil(dose_grid_fluence.shape[2] / threadsperblock[2])
+                blockspergrid = (blockspergrid_x, blockspergrid_y, blockspergrid_z)
+                cuda_fluence[blockspergrid, threadsperblock](
+                    dose_grid_fluence_device,
+                    dose_grid_oad_device,
+                    dose_grid_blocked_device,
+                    cuda.to_device(self.dose_grid.size),
+                    cuda.to_device(self.dose_grid.origin),
+                    cuda.to_device(self.dose_grid.spacing),
+                    cuda.to_device(source.position),
+                    source.sad,
+                    *fluence_settings
+                )
+                dose_grid_fluence = dose_grid_fluence_device.copy_to_host()
+            else:
+                cpu_fluence(
+                    dose_grid_fluence,
+                    dose_grid_oad,
+                    dose_grid_blocked,
+                    dose_grid_size,
+                    self.dose_grid.origin,
+                    self.dose_grid.spacing,
+                    source.position,
+                    source.sad,
+                    *fluence_settings
+                )
+
+
+            # Calculate beam softening factor for dose grid voxels
+            print("Calculating beam softening factor...")
+            f_soften = np.ones_like(dose_grid_oad, dtype=np.float32)
+            f_soften[dose_grid_oad < settings['softLimit']] = 1 / (
+                1 - settings['softRatio'] *
+                dose_grid_oad[dose_grid_oad < settings['softLimit']]
+            )
 
 
+            # Calculate beam softening factor for dose grid voxels
+            print("Calculating horn factor...")
+            f_horn = np.ones_like(dose_grid_oad, dtype=np.float32)
+            f_horn += dose_grid_oad * settings['hornRatio']
+
+
+            # Calculate TERMA of dose grid voxels
+            print("Calculating TERMA...")
+            dose_grid_terma = np.zeros_like(dose_grid_densities, dtype=np.float32)
+            if backend == 'cuda':
+                dose_grid_terma_device = cuda.to_device(dose_grid_terma)
+                threadsperblock = (8, 8, 8)
+                blockspergrid_x = math.ceil(dose_grid_fluence.shape[0] / threadsperblock[0])
+                blockspergrid_y = math.ceil(dose_grid_fluence.shape[1] / threadsperblock[1])
+                blockspergrid_z = math.ceil(dose_grid_fluence.shape[2] / threadsperblock[2])
+                blockspergrid = (blockspergrid_x, blockspergrid_y, blockspergrid_z)
+                cuda_terma[blockspergrid, threadsperblock](
+                    dose_grid_terma_device,
+                    dose_grid_blocked_device,
+                    dose_grid_fluence_device,
+                    dose_grid_d_eff_device,
+                    cuda.to_device(self.dose_grid.size),
+                    cuda.to_device(attenuation),
+                    ATTENUATION_TABLE_STEP,
+                    cuda.to_device(f_soften),
+                    cuda.to_device(f_horn)
+                )
+                dose_grid_terma = dose_grid_terma_device.copy_to_host()
+            else:
+                cpu_terma(
+                    dose_grid_terma,
+                    dose_grid_blocked,
+                    dose_grid_fluence,
+                    dose_grid_d_eff,
+                    dose_grid_size,
+                    attenuation,
+                    ATTENUATION_TABLE_STEP,
+                    f_soften,
+                    f_horn
+                )
+
+
+
+        # Only hold on to the intermediate grids that were asked for
+        intermediates = {
+            name: grid for name, grid in (
+                ('blocked', dose_grid_blocked),
+                ('densities', dose_grid_densities),
+                ('d_eff', dose_grid_d_eff),
+                ('oad', dose_grid_oad),
+                ('fluence', dose_grid_fluence),
+                ('fluence_map', fluence_map_values),
+                ('f_soften', f_soften),
+                ('f_horn', f_horn),
+                ('terma', dose_grid_terma),
+            ) if name in keep
+        }
+        del dose_grid_blocked, dose_grid_d_eff, dose_grid_oad
+        del dose_grid_fluence, fluence_map_values, f_soften, f_horn
 
 
+        print("Building Polyenergetic Kernel...")
+        kernel_poly = polyenergetic_kernel(settings['energy_weights'])
+        kernel_thetas = np.linspace(0, 360 - (360 / 12), 12, dtype=np.float32)  # Baking in number of thetas to 12 for now
+        kernel_phis = kernel_poly.angles
+        kernel_cum, kernel_cutoffs, truncated_fraction = truncated_kernel(
+            kernel_poly.kernel_cum, kernel_energy_fraction
+        )
+        if dose_channels == 'primaryScatter':
+            kernel_channels = primary_scatter_kernel(
+                kernel_cum, kernel_poly.kernel_cum_primary, kernel_cutoffs
+            )
+        else:
+            kernel_channels = kernel_cum[np.newaxis]
 
 
+        print("Calculating dose...")
+        dose_grid_dose = np.zeros_like(dose_grid_densities, dtype=np.float32)
+        if dose_engine == 'raycast':
+            # The ray caster deposits each kernel channel into its own grid
+            dose_grid_dose = np.zeros((len(kernel_channels),) + dose_grid_dose.shape, dtype=np.float32)
+        terma_threshold = settings.get('termaThreshold', 0.0)
+        radiological = kernel_scaling == 'radiological'
+        if radiological:
+            dose_grid_scaling_densities = dose_grid_densities
+        else:
+            dose_grid_scaling_densities = np.zeros((1, 1, 1), dtype=np.float32)
+        dose_grid_active = active_voxels(dose_grid_terma, terma_threshold)
+        if terma_threshold and dose_engine in ('collapsedCone', 'fft', 'gather'):
+            # These engines do not iterate over the TERMA voxels, so the
+            # threshold is applied to the TERMA
+            dose_grid_terma = np.where(
+                dose_grid_terma > terma_threshold * dose_grid_terma.max(),
+                dose_grid_terma, 0
+            ).astype(np.float32)
+        if dose_engine == 'raycast':
+            # Cone directions of each tilt bin, looked up by the ray caster
+            if kernel_tilting == 'divergent':
+                dose_grid_bins, tilt_axes = divergence_bins(
+                    dose_grid_active,
+                    self.dose_grid.origin,
+                    self.dose_grid.spacing,
+                    source.position,
+                    source.transform,
+                    settings.get('tiltBinAngle', 1.0)
+                )
+            else:
+                dose_grid_bins, tilt_axes = np.zeros(1, dtype=np.int32), None
+            cone_directions, cone_rows = cone_table(kernel_thetas, kernel_phis, tilt_axes)
+        if dose_engine == 'gather':
+            # The gather engine reverses the cone lines of a single bin
+            cone_directions, cone_rows = cone_table(kernel_thetas, kernel_phis)
+            cone_directions = cone_directions[0]
+        if dose_engine == 'stencil':
+            stencil_offsets, stencil_values = ray_template_stencil(
+                self.dose_grid.spacing,
+                dose_grid_size,
+                kernel_thetas,
+                kernel_phis,
+                kernel_cum
+            )
+        if dose_engine == 'collapsedCone':
+            # Lattice transport only runs on the CPU
+            cpu_collapsed_cone(
+                dose_grid_dose,
+                self.dose_grid.spacing,
+                dose_grid_size,
+                dose_grid_terma,
+                dose_grid_densities,
+                kernel_thetas,
+                kernel_phis,
+                exponential_kernel_fit(kernel_poly.kernel_cum),
+                DECAY_COEFFICIENTS
+            )
+        elif dose_engine == 'fft':
+            # The kernel is only spatially invariant in a uniform medium,
+            # where it scales with the density
+            density = dose_grid_densities.max()
+            if not np.allclose(dose_grid_densities, density):
+                raise NotImplementedError("The FFT dose engine is only"
+                                          " implemented for homogeneous"
+                                          " phantoms.")
+            dose_grid_dose = fft_dose(
+                dose_grid_terma,
+                self.dose_grid.spacing * density,
+                kernel_poly.angles,
+                kernel_poly.radii,
+                kernel_poly.kernel_diff
+            )
+            # Match the raycast engines, which deposit the full cone
+            # kernel along each theta
+            dose_grid_dose *= len(kernel_thetas)
+        elif dose_engine == 'cython':
+            # The compiled OpenMP engine only runs on the CPU
+            try:
+                from .convolve_c import convolve_c  # pylint: disable=E0611
+            except ImportError as e:
+                raise ImportError("The Cython dose engine has not been built."
+                                  " Run 'python setup.py build_ext"
+                                  " --inplace'.") from e
+            convolve_c(
+                dose_grid_terma,
+                dose_grid_dose,
+                self.dose_grid.spacing,
+                kernel_thetas,
+                kernel_phis,
+                kernel_cum,
+                dose_grid_active,
+                kernel_cutoffs,
+                dose_grid_densities if radiological else None
+            )
+        elif backend == 'cuda':
+            dose_grid_dose_device = cuda.to_device(dose_grid_dose)
+            dose_grid_active_device = cuda.to_device(dose_grid_active)
+            threadsperblock = 128
+            if dose_engine == 'raycast':
+                blockspergrid = math.ceil(len(dose_grid_active) * len(kernel_thetas) * len(kernel_phis) / threadsperblock)
+                cuda_dose[blockspergrid, threadsperblock](
+                    dose_grid_dose_device,
+                    cuda.to_device(self.dose_grid.spacing),
+                    cuda.to_device(self.dose_grid.size),
+                    dose_grid_terma_device.reshape((1,) + dose_grid_terma.shape),
+                    dose_grid_active_device,
+                    cuda.to_device(dose_grid_bins),
+                    cuda.to_device(cone_directions.astype(np.float32)),
+                    cuda.to_device(cone_rows),
+                    cuda.to_device(kernel_channels),
+                    cuda.to_device(kernel_cutoffs),
+                    cuda.to_device(dose_grid_scaling_densities),
+                    radiological
+                )
+            elif dose_engine == 'gather':
+                threadsperblock = (8, 8, 8)
+                blockspergrid_x = math.ceil(dose_grid_dose.shape[0] / threadsperblock[0])
+                blockspergrid_y = math.ceil(dose_grid_dose.shape[1] / threadsperblock[1])
+                blockspergrid_z = math.ceil(dose_grid_dose.shape[2] / threadsperblock[2])
+                blockspergrid = (blockspergrid_x, blockspergrid_y, blockspergrid_z)
+                cuda_gather_dose[blockspergrid, threadsperblock](
+                    dose_grid_dose_device,
+                    cuda.to_device(self.dose_grid.spacing),
+                    cuda.to_device(self.dose_grid.size),
+                    cuda.to_device(dose_grid_terma),
+                    cuda.to_device(cone_directions.astype(np.float32)),
+                    cuda.to_device(cone_rows),
+                    cuda.to_device(kernel_cum),
+                    cuda.to_device(kernel_cutoffs)
+                )
+            elif dose_engine == 'stencil':
+                blockspergrid = math.ceil(len(dose_grid_active) / threadsperblock)
+                cuda_stencil_dose[blockspergrid, threadsperblock](
+                    dose_grid_dose_device,
+                    cuda.to_device(self.dose_grid.size),
+                    dose_grid_terma_device,
+                    dose_grid_active_device,
+                    cuda.to_device(stencil_offsets),
+                    cuda.to_device(stencil_values)
+                )
+            dose_grid_dose = dose_grid_dose_device.copy_to_host()
+        else:
+            if dose_engine == 'raycast':
+                cpu_dose(
+                    dose_grid_dose,
+                    self.dose_grid.spacing,
+                    dose_grid_size,
+                    dose_grid_terma[np.newaxis],
+                    dose_grid_active,
+                    dose_grid_bins,
+                    cone_directions,
+                    cone_rows,
+                    kernel_channels,
+                    kernel_cutoffs,
+                    dose_grid_scaling_densities,
+                    radiological
+                )
+            elif dose_engine == 'gather':
+                cpu_gather_dose(
+                    dose_grid_dose,
+                    self.dose_grid.spacing,
+                    dose_grid_size,
+                    dose_grid_terma,
+                    cone_directions,
+                    cone_rows,
+                    kernel_cum,
+                    kernel_cutoffs
+                )
+            elif dose_engine == 'stencil':
+                cpu_stencil_dose(
+                    dose_grid_dose,
+                    dose_grid_size,
+                    dose_grid_terma,
+                    dose_grid_active,
+                    stencil_offsets,
+                    stencil_values
+                )
+
+        # Energy the truncated kernel left undeposited, in the units of the
+        # summed dose (every cone is cast along each theta)
+        metadata = {
+            'kernelEnergyFraction': kernel_energy_fraction,
+            'kernelCutoffRadii': KERNEL_SAMPLING[0] + kernel_cutoffs * (
+                (KERNEL_SAMPLING[1] - KERNEL_SAMPLING[0]) / (KERNEL_SAMPLING[2] - 1)
+            ),
+            'truncatedEnergyFraction': truncated_fraction,
+            'truncatedEnergy': float(
+                truncated_fraction * np.sum(kernel_poly.kernel_cum[:, -1]) *
+                len(kernel_thetas) *
+                np.sum(dose_grid_terma[tuple(dose_grid_active.T)], dtype=np.float64)
+            ),
+        }
 
+        if dose_engine == 'raycast':
+            if dose_channels == 'primaryScatter':
+                intermediates.update({
+                    name: dose_grid_dose[c] for c, name in
+                    enumerate(('dose_primary', 'dose_scatter')) if name in keep
+                })
+            dose_grid_dose = dose_grid_dose.sum(axis=0)
 
+        self.dose_grid.dose = dose_grid_dose
+        return CalculationResult(self.dose_grid, intermediates, metadata)
 
+    def calculate_points(self, source, block, phantom, points, settings):
+        """ Calculate the dose at a set of points, without the full grid.
 
+        The dose of the voxels around each point is gathered along the
+        reversed cone lines (see points.py), so the hit test, effective
+        depth and TERMA are only found at the voxels those lines cross. At
+        voxel centres the dose matches calculate, with the default stages.
+        Runs on the CPU.
 
+        Parameters
+        ----------
+        source : Source
+            Source, at its gantry and collimator angles
+        block : Block
+            Beam collimation
+        phantom : Phantom
+            Phantom, which also defines the dose grid
+        points : ndarray
+            Positions of the points, in cm, shape (..., 3). For example a
+            line of points for a depth dose or profile, shape (n, 3), or a
+            plane of points, shape (n_u, n_v, 3).
+        settings : dict
+            Calculation settings, as for calculate
 
+        Returns
+        -------
+        ndarray
+            Dose at each point, shape points.shape[:-1]
+        """
+        if (isinstance(block, Aperture) or
+                self._select_hit_test(settings) != 'supersample' or
+                self._select_depth_engine(settings) != 'voxelRay' or
+                self._select_calculation_frame(settings) != 'doseGrid' or
+                settings.get('fluenceEngine', 'voxel') != 'voxel' or
+                settings.get('termaThreshold', 0.0)):
+            raise NotImplementedError("Point doses are not yet implemented"
+                                      " for the requested settings.")
+        kernel_energy_fraction = self._select_kernel_energy_fraction(settings, 'gather')
+        self._select_kernel_scaling(settings, 'gather')
+        self._select_dose_channels(settings, 'gather', set())
+        self._select_kernel_tilting(settings, 'gather')
+        points = np.asarray(points, dtype=np.float64)
 
+        self.dose_grid = DoseGrid(phantom.size, phantom.origin, phantom.spacing)
+        dose_grid_size = np.array(self.dose_grid.size)
+        receivers = point_receivers(
+            points, dose_grid_size, self.dose_grid.origin, self.dose_grid.spacing
+        )
 
+        print("Building Polyenergetic Kernel...")
+        kernel_poly = polyenergetic_kernel(settings['energy_weights'])
+        kernel_thetas = np.linspace(0, 360 - (360 / 12), 12, dtype=np.float32)  # As in calculate
+        kernel_phis = kernel_poly.angles
+        kernel_cum, kernel_cutoffs, _ = truncated_kernel(
+            kernel_poly.kernel_cum, kernel_energy_fraction
+        )
 
+        print("Marking voxels on the cone lines...")
+        dose_grid_marked = np.zeros(dose_grid_size, dtype=np.uint8)
+        cpu_mark_cone_lines(
+            dose_grid_marked,
+            receivers.voxels,
+            self.dose_grid.spacing,
+            dose_grid_size,
+            kernel_thetas,
+            kernel_phis,
+            kernel_cutoffs
+        )
+        voxels = active_voxels(dose_grid_marked)
+        del dose_grid_marked
+
+        print("Calculating effective depths and TERMA at marked voxels...")
+        dose_grid_densities = self._dose_grid_densities(phantom)
+        blocked = np.zeros(len(voxels), dtype=np.float64)
+        d_eff = np.zeros(len(voxels), dtype=np.float64)
+        cpu_voxels_blocked_d_eff(
+            blocked,
+            d_eff,
+            voxels,
+            dose_grid_size,
+            self.dose_grid.origin,
+            self.dose_grid.spacing,
+            dose_grid_densities,
+            source.position,
+            source.v_y,
+            source.transform,
+            block.block_values,
+            settings['fluenceResampling']
+        )
+        del dose_grid_densities
+        energy = np.array([np.float32(x) for x in settings['energy_weights'].keys()], dtype=np.float32)
+        energy_weights = np.array([np.float32(x) for x in settings['energy_weights'].values()], dtype=np.float32)
+        f_soften_max = 1 / (1 - settings['softRatio'] * settings['softLimit'])
+        attenuation = attenuation_table(
+            energy,
+            energy_weights,
+            np.max(d_eff, initial=0) * max(f_soften_max, 1)
+        )
+        dose_grid_terma = np.zeros(dose_grid_size, dtype=np.float32)
+        cpu_voxels_terma(
+            dose_grid_terma,
+            voxels,
+            blocked,
+            d_eff,
+            self.dose_grid.origin,
+            self.dose_grid.spacing,
+            source.position,
+            source.sad,
+            source.transform,
+            source.v_y,
+            settings['sPri'],
+            settings['zAnn'],
+            settings['sAnn'],
+            settings['rInner'],
+            settings['rOuter'],
+            settings['zExp'],
+            settings['sExp'],
+            settings['kExp'],
+            settings['softRatio'],
+            settings['softLimit'],
+            settings['hornRatio'],
+            attenuation,
+            ATTENUATION_TABLE_STEP
+        )
 
+        print("Gathering dose at points...")
+        cone_directions, cone_rows = cone_table(kernel_thetas, kernel_phis)
+        voxel_doses = np.zeros(len(receivers.voxels), dtype=np.float64)
+        cpu_voxels_gather_dose(
+            voxel_doses,
+            receivers.voxels,
+            self.dose_grid.spacing,
+            dose_grid_size,
+            dose_grid_terma,
+            cone_directions[0],
+            cone_rows,
+            kernel_cum,
+            kernel_cutoffs
+        )
+        return receivers.interpolate(
+            voxel_doses, points.size // 3
+        ).reshape(points.shape[:-1])
 
-class Conehead:
+    def _dose_grid_densities(self, phantom):
+        """Interpolate the phantom densities at the dose grid voxels.
 
-    def calculate(self, source, block, phantom, settings):
+        Parameters
+        ----------
+        phantom : Phantom
+            Phantom holding the densities
 
+        Returns
+        -------
+        ndarray
+            Density of each dose grid voxel
+        """
         print("Interpolating phantom densities...")
         phantom_densities_interp = RegularGridInterpolator(
             (np.linspace(phantom.origin[0], phantom.origin[0] + phantom.size[0] * phantom.spacing[0], phantom.size[0]),
@@ -532,267 +1363,387 @@ class Conehead:
             fill_value=0
         )
 
-        # Create dose grid (just the same size as the phantom for now)
-        self.dose_grid = DoseGrid(phantom.size, phantom.origin, phantom.spacing)
-
-
-        # Perform hit testing to find which dose grid voxels are in the beam
-        print("Performing hit-testing of dose grid voxels...")
-        dose_grid_blocked_device = cuda.to_device(np.zeros(self.dose_grid.size))
-        threadsperblock = (8, 8, 8)
-        blockspergrid_x = math.ceil(dose_grid_blocked_device.shape[0] / threadsperblock[0])
-        blockspergrid_y = math.ceil(dose_grid_blocked_device.shape[1] / threadsperblock[1])
-        blockspergrid_z = math.ceil(dose_grid_blocked_device.shape[2] / threadsperblock[2])
-        blockspergrid = (blockspergrid_x, blockspergrid_y, blockspergrid_z)
-        cuda_hit_test[blockspergrid, threadsperblock](
-            dose_grid_blocked_device,
-            cuda.to_device(self.dose_grid.size),
-            cuda.to_device(self.dose_grid.origin),
-            cuda.to_device(self.dose_grid.spacing),
-            cuda.to_device(source.position),
-            cuda.to_device(source.v_y),
-            cuda.to_device(source.transform),
-            cuda.to_device(block.block_values),
-            settings['fluenceResampling']
-        )
-        dose_grid_blocked = dose_grid_blocked_device.copy_to_host()
-
-
         print("Interpolating densities at points in dose grid...")
         xx, yy, zz = np.meshgrid(
             np.linspace(self.dose_grid.origin[0], self.dose_grid.origin[0] + self.dose_grid.size[0] * self.dose_grid.spacing[0], self.dose_grid.size[0]),
             np.linspace(self.dose_grid.origin[1], self.dose_grid.origin[1] + self.dose_grid.size[1] * self.dose_grid.spacing[1], self.dose_grid.size[1]),
             np.linspace(self.dose_grid.origin[2], self.dose_grid.origin[2] + self.dose_grid.size[2] * self.dose_grid.spacing[2], self.dose_grid.size[2])
         )
-        dose_grid_densities = np.float32(phantom_densities_interp((xx, yy, zz)))
-        dose_grid_densities_device = cuda.to_device(dose_grid_densities)
+        return np.float32(phantom_densities_interp((xx, yy, zz)))
 
+    def _select_backend(self, settings):
+        """Choose the device the calculation stages will run on.
 
+        Parameters
+        ----------
+        settings : dict
+            Calculation settings. The optional 'backend' entry may be 'cuda',
+            'cpu' or 'auto' (the default). 'auto' and 'cuda' both fall back to
+            the CPU when no CUDA device is available.
 
-        print("Calculating effective depths...")
-        dose_grid_densities_device = cuda.to_device(dose_grid_densities)
-        dose_grid_d_eff_device = cuda.to_device(np.zeros_like(dose_grid_densities, dtype=np.float32))
-        threadsperblock = (8, 8, 8)
-        blockspergrid_x = math.ceil(dose_grid_densities.shape[0] / threadsperblock[0])
-        blockspergrid_y = math.ceil(dose_grid_densities.shape[1] / threadsperblock[1])
-        blockspergrid_z = math.ceil(dose_grid_densities.shape[2] / threadsperblock[2])
-        blockspergrid = (blockspergrid_x, blockspergrid_y, blockspergrid_z)
-        cuda_d_eff[blockspergrid, threadsperblock](
-            cuda.to_device(self.dose_grid.size),
-            cuda.to_device(self.dose_grid.origin),
-            cuda.to_device(self.dose_grid.spacing),
-            dose_grid_densities_device,
-            cuda.to_device(source.position),
-            dose_grid_d_eff_device
-        )
-        dose_grid_d_eff = dose_grid_d_eff_device.copy_to_host()
-
-
-        print("Calculating off-axis distances")
-        dose_grid_oad = np.zeros_like(dose_grid_densities, dtype=np.float32)
-        dose_grid_oad_device = cuda.to_device(dose_grid_oad)
-        threadsperblock = (8, 8, 8)
-        blockspergrid_x = math.ceil(dose_grid_oad.shape[0] / threadsperblock[0])
-        blockspergrid_y = math.ceil(dose_grid_oad.shape[1] / threadsperblock[1])
-        blockspergrid_z = math.ceil(dose_grid_oad.shape[2] / threadsperblock[2])
-        blockspergrid = (blockspergrid_x, blockspergrid_y, blockspergrid_z)
-        cuda_oad[blockspergrid, threadsperblock](
-            dose_grid_oad_device,
-            cuda.to_device(self.dose_grid.size),
-            cuda.to_device(self.dose_grid.origin),
-            cuda.to_device(self.dose_grid.spacing),
-            cuda.to_device(source.position),
-            source.sad,
-            cuda.to_device(source.transform),
-            cuda.to_device(source.v_y)
-        )
-        dose_grid_oad = dose_grid_oad_device.copy_to_host()
-
-
-        print("Calculating photon fluence...")
-        dose_grid_fluence = np.zeros_like(dose_grid_densities, dtype=np.float32)
-        dose_grid_fluence_device = cuda.to_device(dose_grid_fluence)
-        threadsperblock = (8, 8, 8)
-        blockspergrid_x = math.ceil(dose_grid_fluence.shape[0] / threadsperblock[0])
-        blockspergrid_y = math.ceil(dose_grid_fluence.shape[1] / threadsperblock[1])
-        blockspergrid_z = math.ceil(dose_grid_fluence.shape[2] / threadsperblock[2])
-        blockspergrid = (blockspergrid_x, blockspergrid_y, blockspergrid_z)
-        cuda_fluence[blockspergrid, threadsperblock](
-            dose_grid_fluence_device,
-            dose_grid_oad_device,
-            dose_grid_blocked_device,
-            cuda.to_device(self.dose_grid.size),
-            cuda.to_device(self.dose_grid.origin),
-            cuda.to_device(self.dose_grid.spacing),
-            cuda.to_device(source.position),
-            source.sad,
-            settings['sPri'],
-            settings['zAnn'],
-            settings['sAnn'],
-            settings['rInner'],
-            settings['rOuter'],
-            settings['zExp'],
-            settings['sExp'],
-            settings['kExp']
-        )
-        dose_grid_fluence = dose_grid_fluence_device.copy_to_host()
+        Returns
+        -------
+        str
+            Either 'cuda' or 'cpu'
+        """
+        backend = settings.get('backend', 'auto')
+        if backend not in ('auto', 'cuda', 'cpu'):
+            raise NotImplementedError("The requested backend is not yet"
+                                      " implemented.")
+        if backend != 'cpu' and not cuda.is_available():
+            if backend == 'cuda':
+                print("CUDA is not available, falling back to the CPU backend...")
+            backend = 'cpu'
+        elif backend == 'auto':
+            backend = 'cuda'
+        return backend
+
+    def _select_dose_engine(self, settings):
+        """Choose the algorithm used to convolve the kernel with the TERMA.
 
+        Parameters
+        ----------
+        settings : dict
+            Calculation settings. The optional 'doseEngine' entry may be
+            'raycast' (the default), which casts every cone line from every
+            TERMA voxel, 'stencil', which scatters every TERMA voxel through
+            a precomputed ray template (uniform grids only), or
+            'collapsedCone', which transports energy recursively along a
+            lattice of parallel lines for each cone (CPU only), or 'fft',
+            which convolves the TERMA with a Cartesian kernel using FFTs
+            (homogeneous phantoms only, CPU only), or 'cython', which casts
+            the same cone lines as 'raycast' in a compiled OpenMP extension
+            (CPU only, see setup.py), or 'gather', which traces the reversed
+            cone lines from every receiving voxel, so no atomics are needed
+            and the result is reproducible.
 
-        # Calculate beam softening factor for dose grid voxels
-        print("Calculating beam softening factor...")
-        f_soften = np.ones_like(dose_grid_oad, dtype=np.float32)
-        f_soften[dose_grid_oad < settings['softLimit']] = 1 / (
-            1 - settings['softRatio'] *
-            dose_grid_oad[dose_grid_oad < settings['softLimit']]
-        )
-        f_soften_device = cuda.to_device(f_soften)
+        Returns
+        -------
+        str
+            Name of the dose engine
+        """
+        dose_engine = settings.get('doseEngine', 'raycast')
+        if dose_engine not in ('raycast', 'stencil', 'collapsedCone', 'fft', 'cython', 'gather'):
+            raise NotImplementedError("The requested dose engine is not yet"
+                                      " implemented.")
+        return dose_engine
 
+    def _select_hit_test(self, settings):
+        """Choose how the block transmission of each voxel is found.
 
-        # Calculate beam softening factor for dose grid voxels
-        print("Calculating horn factor...")
-        f_horn = np.ones_like(dose_grid_oad, dtype=np.float32)
-        f_horn += dose_grid_oad * settings['hornRatio']
-        f_horn_device = cuda.to_device(f_horn)
+        Parameters
+        ----------
+        settings : dict
+            Calculation settings. The optional 'hitTest' entry may be
+            'supersample' (the default), which looks up the transmission at
+            fluenceResampling^3 points of each voxel, or 'footprint', which
+            averages the transmission over the projected footprint of each
+            voxel with a summed-area table, splitting only voxels at field
+            edges into fluenceResampling^3 sub-voxels.
 
+        Returns
+        -------
+        str
+            Name of the hit test
+        """
+        hit_test = settings.get('hitTest', 'supersample')
+        if hit_test not in ('supersample', 'footprint'):
+            raise NotImplementedError("The requested hit test is not yet"
+                                      " implemented.")
+        return hit_test
 
-        # Calculate TERMA of dose grid voxels
-        print("Calculating TERMA...")
-        energy = np.array([np.float32(x) for x in settings['energy_weights'].keys()], dtype=np.float32)
-        energy_weights = np.array([np.float32(x) for x in settings['energy_weights'].values()], dtype=np.float32)
-        mu_w = mu_water(energy)
-        dose_grid_terma = np.zeros_like(dose_grid_densities, dtype=np.float32)
-        dose_grid_terma_device = cuda.to_device(dose_grid_terma)
-        threadsperblock = (8, 8, 8)
-        blockspergrid_x = math.ceil(dose_grid_fluence.shape[0] / threadsperblock[0])
-        blockspergrid_y = math.ceil(dose_grid_fluence.shape[1] / threadsperblock[1])
-        blockspergrid_z = math.ceil(dose_grid_fluence.shape[2] / threadsperblock[2])
-        blockspergrid = (blockspergrid_x, blockspergrid_y, blockspergrid_z)
-        cuda_terma[blockspergrid, threadsperblock](
-            dose_grid_terma_device,
-            dose_grid_blocked_device,
-            dose_grid_fluence_device,
-            dose_grid_d_eff_device,
-            cuda.to_device(self.dose_grid.size),
-            cuda.to_device(energy),
-            cuda.to_device(energy_weights),
-            cuda.to_device(mu_w),
-            f_soften_device,
-            f_horn_device
-        )
-        dose_grid_terma = dose_grid_terma_device.copy_to_host()
+    def _select_depth_engine(self, settings):
+        """Choose how the effective depth of each voxel is found.
 
+        Parameters
+        ----------
+        settings : dict
+            Calculation settings. The optional 'depthEngine' entry may be
+            'voxelRay' (the default), which traces a ray from every voxel
+            back to the source, or 'sourceRay', which traverses rays cast
+            from the source through depthResampling^2 points per voxel on
+            the grid faces once each, and gives every voxel the depth of the
+            nearest ray (CPU only).
 
-        print("Building Polyenergetic Kernel...")
-        kernels = {
-            "0.5": KernelMono("kernels/0.5MeV/0.5MeV.egslst"),
-            "1.0": KernelMono("kernels/1.5MeV/1.5MeV.egslst"),
-            "1.5": KernelMono("kernels/1.5MeV/1.5MeV.egslst"),
-            "2.0": KernelMono("kernels/2.0MeV/2.0MeV.egslst"),
-            "2.5": KernelMono("kernels/2.5MeV/2.5MeV.egslst"),
-            "3.0": KernelMono("kernels/3.0MeV/3.0MeV.egslst"),
-            "3.5": KernelMono("kernels/3.5MeV/3.5MeV.egslst"),
-            "4.0": KernelMono("kernels/4.0MeV/4.0MeV.egslst"),
-            "4.5": KernelMono("kernels/4.5MeV/4.5MeV.egslst"),
-            "5.0": KernelMono("kernels/5.0MeV/5.0MeV.egslst"),
-            "5.5": KernelMono("kernels/5.5MeV/5.5MeV.egslst"),
-            "6.0": KernelMono("kernels/6.0MeV/6.0MeV.egslst"),
-        }
-        kernel_diff = np.zeros_like(kernels["0.5"].kernel_diff)
-        for e in settings['energy_weights'].keys():
-            kernel_diff += kernels[e].kernel_diff * settings['energy_weights'][e]
-        kernel_diff = kernel_diff / kernel_diff.sum()  # normalise
-        kernel_poly = KernelPoly(kernels["0.5"].angles, kernels["0.5"].radii, kernel_diff)
-        kernel_thetas = np.linspace(0, 360 - (360 / 12), 12, dtype=np.float32)  # Baking in number of thetas to 12 for now
-        kernel_phis = kernel_poly.angles
+        Returns
+        -------
+        str
+            Name of the depth engine
+        """
+        depth_engine = settings.get('depthEngine', 'voxelRay')
+        if depth_engine not in ('voxelRay', 'sourceRay'):
+            raise NotImplementedError("The requested depth engine is not yet"
+                                      " implemented.")
+        return depth_engine
 
+    def _select_calculation_frame(self, settings):
+        """Choose the frame the hit test, effective depth and off-axis
+        distance are calculated in.
 
+        Parameters
+        ----------
+        settings : dict
+            Calculation settings. The optional 'calculationFrame' entry may
+            be 'doseGrid' (the default), which projects every dose grid
+            voxel back to the source in each stage, or 'beam', which
+            resamples the densities once onto a divergent grid of rays from
+            the source (beamFrameResampling samples per voxel), finds the
+            stages along its columns and resamples them back onto the dose
+            grid (CPU only). The beam frame replaces the hitTest and
+            depthEngine settings.
 
-        
-        
-        # dose_grid_terma = np.zeros_like(dose_grid_densities, dtype=np.float32)
-        # dose_grid_terma[20, 20, 20] = 1.0
-        # dose_grid_terma_device = cuda.to_device(dose_grid_terma)
-        # print(kernel_thetas)
-        # print(kernel_phis)
+        Returns
+        -------
+        str
+            Name of the calculation frame
+        """
+        calculation_frame = settings.get('calculationFrame', 'doseGrid')
+        if calculation_frame not in ('doseGrid', 'beam'):
+            raise NotImplementedError("The requested calculation frame is not"
+                                      " yet implemented.")
+        return calculation_frame
 
+    def _select_terma_stage(self, settings, keep):
+        """Choose how the fluence and TERMA stages are run.
 
+        Parameters
+        ----------
+        settings : dict
+            Calculation settings. The optional 'termaStage' entry may be
+            'separate' (the default), which calculates the off-axis
+            distance, fluence, softening and horn grids in turn before the
+            TERMA, or 'fused', which finds them per voxel in one pass and
+            only writes the TERMA grid.
+        keep : set
+            Names of the intermediate grids to keep. The fused stage never
+            holds the off-axis distance, fluence, softening or horn grids.
 
-        print("Calculating dose...")
-        dose_grid_dose = np.zeros_like(dose_grid_densities, dtype=np.float32)
-        dose_grid_dose_device = cuda.to_device(dose_grid_dose)
-        threadsperblock = (8, 8, 8)
-        blockspergrid_x = math.ceil(dose_grid_dose.shape[0] / threadsperblock[0])
-        blockspergrid_y = math.ceil(dose_grid_dose.shape[1] / threadsperblock[1])
-        blockspergrid_z = math.ceil(dose_grid_dose.shape[2] / threadsperblock[2])
-        blockspergrid = (blockspergrid_x, blockspergrid_y, blockspergrid_z)
-        cuda_dose[blockspergrid, threadsperblock](
-            dose_grid_dose_device,
-            cuda.to_device(self.dose_grid.spacing),
-            cuda.to_device(self.dose_grid.size),
-            dose_grid_terma_device,
-            cuda.to_device(kernel_thetas),
-            cuda.to_device(kernel_phis),
-            cuda.to_device(kernel_poly.kernel_cum),
-            cuda.to_device(source.transform)
-        )
-        dose_grid_dose = dose_grid_dose_device.copy_to_host()
+        Returns
+        -------
+        str
+            Name of the TERMA stage
+        """
+        terma_stage = settings.get('termaStage', 'separate')
+        if terma_stage not in ('separate', 'fused'):
+            raise NotImplementedError("The requested TERMA stage is not yet"
+                                      " implemented.")
+        if terma_stage == 'fused' and keep & {'oad', 'fluence', 'f_soften', 'f_horn'}:
+            raise NotImplementedError("The requested intermediate grid is"
+                                      " not kept by the fused TERMA stage.")
+        return terma_stage
+
+    def _select_fluence_engine(self, settings, calculation_frame, terma_stage, keep):
+        """Choose how the block transmission and photon fluence are found.
 
+        Parameters
+        ----------
+        settings : dict
+            Calculation settings. The optional 'fluenceEngine' entry may be
+            'voxel' (the default), which evaluates the hit test and fluence
+            model at every dose grid voxel, or 'map', which evaluates them
+            once on a 2D map in the block plane (fluenceMapSpacing apart, in
+            cm, by default half the smallest voxel dimension) and projects
+            each voxel into it (CPU only). The map replaces
+            the hitTest setting.
+        calculation_frame : str
+            Name of the calculation frame. The map needs the dose grid frame.
+        terma_stage : str
+            Name of the TERMA stage. The map needs the separate stages.
+        keep : set
+            Names of the intermediate grids to keep. The 'fluence_map' grid
+            is only found by the map.
 
+        Returns
+        -------
+        str
+            Name of the fluence engine
+        """
+        fluence_engine = settings.get('fluenceEngine', 'voxel')
+        if fluence_engine not in ('voxel', 'map'):
+            raise NotImplementedError("The requested fluence engine is not yet"
+                                      " implemented.")
+        if fluence_engine == 'map' and (calculation_frame != 'doseGrid' or terma_stage != 'separate'):
+            raise NotImplementedError("The fluence map is not yet implemented"
+                                      " with the beam frame or fused TERMA"
+                                      " stage.")
+        if fluence_engine != 'map' and 'fluence_map' in keep:
+            raise NotImplementedError("The fluence_map grid is only kept by"
+                                      " the map fluence engine.")
+        return fluence_engine
+
+    def _select_extra_focal(self, settings, fluence_engine):
+        """Choose how the extra-focal (annular and exponential) sources are
+        collimated.
 
+        Parameters
+        ----------
+        settings : dict
+            Calculation settings. The optional 'extraFocal' entry may be
+            'radial' (the default), which multiplies their radial fluence by
+            the block transmission, or 'collimated', which multiplies it by
+            the fraction of each source's profile seen through the block,
+            placed in an effective collimating plane zCol (default 40) cm
+            below the target. The two agree for an open field.
+        fluence_engine : str
+            Name of the fluence engine. Collimated sources need the map.
 
+        Returns
+        -------
+        str
+            Name of the extra-focal source model
+        """
+        extra_focal = settings.get('extraFocal', 'radial')
+        if extra_focal not in ('radial', 'collimated'):
+            raise NotImplementedError("The requested extra-focal source model"
+                                      " is not yet implemented.")
+        if extra_focal == 'collimated' and fluence_engine != 'map':
+            raise NotImplementedError("Collimated extra-focal sources are only"
+                                      " implemented for the fluence map.")
+        return extra_focal
+
+    def _select_kernel_energy_fraction(self, settings, dose_engine):
+        """Choose how much of the kernel's energy the cone lines deposit.
 
+        Parameters
+        ----------
+        settings : dict
+            Calculation settings. The optional 'kernelEnergyFraction' entry
+            is the fraction of each cone's energy within its cutoff radius,
+            beyond which cone lines are not followed (see truncated_kernel).
+            Defaults to 1, the whole kernel. Truncation is implemented for
+            the 'raycast', 'stencil', 'cython' and 'gather' dose engines.
+        dose_engine : str
+            Name of the dose engine
 
+        Returns
+        -------
+        float
+            Fraction of the kernel energy kept
+        """
+        kernel_energy_fraction = settings.get('kernelEnergyFraction', 1.0)
+        if not 0 < kernel_energy_fraction <= 1:
+            raise ValueError("The kernel energy fraction must be in (0, 1].")
+        if kernel_energy_fraction < 1 and dose_engine in ('collapsedCone', 'fft'):
+            raise NotImplementedError("Kernel truncation is not yet"
+                                      " implemented for the requested dose"
+                                      " engine.")
+        return kernel_energy_fraction
+
+    def _select_kernel_scaling(self, settings, dose_engine):
+        """Choose how distances along the cone lines are measured for the
+        kernel lookup.
 
+        Parameters
+        ----------
+        settings : dict
+            Calculation settings. The optional 'kernelScaling' entry may be
+            'geometric' (the default), which looks the kernel up at the
+            distance from the releasing voxel, or 'radiological', which
+            looks it up at the density weighted distance, summed during the
+            same traversal (raycast and cython dose engines). The
+            collapsedCone and fft engines always scale with density.
+        dose_engine : str
+            Name of the dose engine
 
+        Returns
+        -------
+        str
+            Name of the kernel scaling
+        """
+        kernel_scaling = settings.get('kernelScaling', 'geometric')
+        if kernel_scaling not in ('geometric', 'radiological'):
+            raise NotImplementedError("The requested kernel scaling is not yet"
+                                      " implemented.")
+        if kernel_scaling == 'radiological' and dose_engine in ('stencil', 'gather'):
+            raise NotImplementedError("Radiological kernel scaling is not yet"
+                                      " implemented for the requested dose"
+                                      " engine.")
+        return kernel_scaling
+
+    def _select_dose_channels(self, settings, dose_engine, keep):
+        """Choose which parts of the dose are deposited separately.
 
-        index = 100
+        Parameters
+        ----------
+        settings : dict
+            Calculation settings. The optional 'doseChannels' entry may be
+            'total' (the default), which deposits the whole kernel, or
+            'primaryScatter', which deposits the primary and scatter kernels
+            as two channels of the same cone line traversal (raycast dose
+            engine only). Their sum is the dose.
+        dose_engine : str
+            Name of the dose engine
+        keep : set
+            Names of the intermediate grids to keep. The 'dose_primary' and
+            'dose_scatter' grids need the 'primaryScatter' channels.
 
-        fig, ax = plt.subplots(3, 3, figsize=[12, 12])
-        ax[0, 0].imshow(dose_grid_blocked[:, 10, :])
-        ax[0, 0].set_title("Hit test")
-        ax[0, 1].imshow(dose_grid_d_eff[index, :, :])
-        ax[0, 1].set_title("d_eff")
-        ax[0, 2].imshow(dose_grid_oad[index, :, :])
-        ax[0, 2].set_title("OAD")
-        ax[1, 0].imshow(dose_grid_fluence[index, :, :])
-        ax[1, 0].set_title("Fluence")
-        ax[1, 1].imshow(f_soften[index, :, :])
-        ax[1, 1].set_title("Beam softening")
-        ax[1, 2].imshow(f_horn[index, :, :])
-        ax[1, 2].set_title("Horn factor")
-        ax[2, 0].imshow(dose_grid_terma[index, :, :])
-        ax[2, 0].set_title("TERMA")
-        ax[2, 1].imshow(dose_grid_dose[index, :, :])
-        ax[2, 1].set_title("Dose")
-        ax[2, 2].plot(np.linspace(self.dose_grid.origin[1], self.dose_grid.origin[1] + self.dose_grid.size[1] * self.dose_grid.spacing[1], self.dose_grid.size[1]), dose_grid_fluence[index, :, index] / np.max(dose_grid_fluence[index, :, index]) * 100, label="Fluence")
-        ax[2, 2].plot(np.linspace(self.dose_grid.origin[1], self.dose_grid.origin[1] + self.dose_grid.size[1] * self.dose_grid.spacing[1], self.dose_grid.size[1]), dose_grid_terma[index, :, index] / np.max(dose_grid_terma[index, :, index]) * 100, label="TERMA")
-        ax[2, 2].plot(np.linspace(self.dose_grid.origin[1], self.dose_grid.origin[1] + self.dose_grid.size[1] * self.dose_grid.spacing[1], self.dose_grid.size[1]), dose_grid_dose[index, :, index] / np.max(dose_grid_dose[index, :, index]) * 100, label="Dose")
-        ax[2, 2].set_title("Dose")
-        ax[2, 2].legend()
-        plt.tight_layout()
-        plt.show()
+        Returns
+        -------
+        str
+            Name of the dose channels
+        """
+        dose_channels = settings.get('doseChannels', 'total')
+        if dose_channels not in ('total', 'primaryScatter'):
+            raise NotImplementedError("The requested dose channels are not yet"
+                                      " implemented.")
+        if dose_channels == 'primaryScatter' and dose_engine != 'raycast':
+            raise NotImplementedError("Dose channels are not yet implemented"
+                                      " for the requested dose engine.")
+        if dose_channels == 'total' and keep & {'dose_primary', 'dose_scatter'}:
+            raise NotImplementedError("The primary and scatter dose grids are"
+                                      " only kept with the 'primaryScatter'"
+                                      " dose channels.")
+        return dose_channels
+
+    def _select_kernel_tilting(self, settings, dose_engine):
+        """Choose how the cone directions follow the beam divergence.
 
+        Parameters
+        ----------
+        settings : dict
+            Calculation settings. The optional 'kernelTilting' entry may be
+            'none' (the default), which keeps the cone directions fixed in
+            the world frame, or 'divergent', which tilts each voxel's cones
+            along the ray from the source, binned every 'tiltBinAngle'
+            degrees of divergence (default 1) (see tilting.py, raycast dose
+            engine only).
+        dose_engine : str
+            Name of the dose engine
 
+        Returns
+        -------
+        str
+            Name of the kernel tilting
+        """
+        kernel_tilting = settings.get('kernelTilting', 'none')
+        if kernel_tilting not in ('none', 'divergent'):
+            raise NotImplementedError("The requested kernel tilting is not yet"
+                                      " implemented.")
+        if kernel_tilting == 'divergent' and dose_engine != 'raycast':
+            raise NotImplementedError("Kernel tilting is not yet implemented"
+                                      " for the requested dose engine.")
+        return kernel_tilting
+
+    def _select_intermediates(self, settings):
+        """Choose the intermediate grids kept in the calculation result.
 
+        Parameters
+        ----------
+        settings : dict
+            Calculation settings. The optional 'keepIntermediates' entry
+            lists the names of the grids to keep (see INTERMEDIATES). None
+            are kept by default.
 
-        # # Calculate dose of dose grid voxels
-        # print("Convolving kernel...")
-        # kernel = PolyenergeticKernel()
-        # dose_grid_dose = np.zeros_like(self.dose_grid_terma, dtype=np.float64)
-        # phis = np.array(
-        #     sorted([p for p in kernel.cumulative.keys() if p != "radii"]),
-        #     dtype=np.float64
-        # )
-        # thetas = np.linspace(0, 360, 12, endpoint=False, dtype=np.float64)
-        # convolve_c(
-        #     self.dose_grid_terma,
-        #     dose_grid_dose,
-        #     self.dose_grid_dim,
-        #     thetas,
-        #     phis,
-        #     kernel
-        # )
-        # self.dose_grid_dose = dose_grid_dose
+        Returns
+        -------
+        set
+            Names of the grids to keep
+        """
+        keep = set(settings.get('keepIntermediates', ()))
+        if not keep.issubset(INTERMEDIATES):
+            raise NotImplementedError("The requested intermediate grid is"
+                                      " not yet implemented.")
+        return keep
 
     def _in_annulus(self, r, R_inner, R_outer):
         """Check if point with distance r from origin lies inside annular
@@ -815,266 +1766,3 @@ class Conehead:
         inside = np.zeros_like(r)
         inside[(r > R_inner) & (r < R_outer)] = 1.0
         return inside
-
-    def plot(self):
-        # Plotting for debug purposes
-        print("Calculation complete. Now plotting...")
-
-        def plot_fluence():  # pylint: disable=W0612
-            f1 = plt.figure()  # pylint: disable=W0612
-            ax1 = plt.gca()
-            im = ax1.imshow(  # pylint: disable=W0612
-                np.rot90(self.dose_grid_fluence[:, 20, :]),
-                extent=[-20.5, 20.5, -40.5, .5],
-                aspect='equal',
-                cmap='viridis'
-            )
-            # Minor ticks
-            ax1.set_xticks(np.arange(-19.5, 20.0, 1.0), minor=True)
-            ax1.set_yticks(np.arange(-39.5, 0, 1.0), minor=True)
-            # ax1.grid(which="minor", color="#666666", linestyle='-', linewidth=1)
-            ax1.set_title('Fluence')
-            # plt.colorbar(im)
-
-        def plot_terma():  # pylint: disable=W0612
-            f2 = plt.figure()  # pylint: disable=W0612
-            ax2 = plt.gca()
-            im = ax2.imshow(  # pylint: disable=W0612
-                np.rot90(self.dose_grid_terma[:, 20, :]),
-                extent=[-20.5, 20.5, -40.5, .5],
-                aspect='equal',
-                cmap='viridis'
-            )
-            # Minor ticks
-            ax2.set_xticks(np.arange(-19.5, 20.0, 1.0), minor=True)
-            ax2.set_yticks(np.arange(-39.5, 0, 1.0), minor=True)
-            # ax2.grid(which="minor", color="#666666", linestyle='-', linewidth=1)
-            ax2.set_title('TERMA')
-            # plt.colorbar(im)
-
-        def plot_dose():
-            f3 = plt.figure()  # pylint: disable=W0612
-            ax3 = plt.gca()
-            im = ax3.imshow(  # pylint: disable=W0612
-                np.rot90(self.dose_grid_dose[:, 20, :]),
-                extent=[-20.5, 20.5, -40.5, .5],
-                aspect='equal',
-                cmap='viridis'
-            )
-            ax3.set_xlim([-20.5, 20.5])
-            ax3.set_ylim([-40.5, 0.5])
-            # Minor ticks
-            ax3.set_xticks(np.arange(-19.5, 20.0, 1.0), minor=True)
-            ax3.set_yticks(np.arange(-39.5, 0, 1.0), minor=True)
-            # ax3.grid(which="minor", color="#666666", linestyle='-', linewidth=1)
-            ax3.set_title('Dose')
-            # plt.colorbar(im)
-
-            f6 = plt.figure()  # pylint: disable=W0612
-            ax6 = plt.gca()
-            im = ax6.imshow(
-                self.dose_grid_dose[:, :, 30],
-                extent=[-20.5, 20.5, -20.5, 20.5],
-                aspect='equal',
-                cmap='viridis'
-            )
-            ax6.set_xlim([-20.5, 20.5])
-            ax6.set_ylim([-20.5, 20.5])
-            # Minor ticks
-            ax6.set_xticks(np.arange(-19.5, 20.0, 1.0), minor=True)
-            ax6.set_yticks(np.arange(-19.5, 20.0, 1.0), minor=True)
-            # ax6.grid(which="minor", color="#666666", linestyle='-', linewidth=1)
-            ax6.set_title('Dose')
-            # plt.colorbar(im)
-
-        def plot_30x30_profiles():  # pylint: disable=W0612
-            f4 = plt.figure()  # pylint: disable=W0612
-            ax4 = plt.gca()
-            ax4.plot(
-                self.dose_grid_positions[0, :, 20, 35],
-                self.dose_grid_dose[:, 20, 35] / self.dose_grid_dose[20, 20, 35] * 100,
-                'or',
-                # (self.dose_grid_dose[:, 20, 38] /
-                #  np.max(self.dose_grid_dose[:, 20, 38]) * 100),
-                label='5 cm calc'
-            )
-            x5 = 0.1 * np.array([-189, -186.9, -184.8, -182.7, -180.6, -178.5, -176.4, -174.3, -172.2, -170.1, -168, -166.95, -165.9, -164.85, -163.8, -162.75, -161.7, -160.65, -159.6, -158.55, -157.5, -156.45, -155.4, -154.35, -153.3, -152.25, -151.2, -150.15, -149.1, -148.05, -147, -144.9, -142.8, -140.7, -138.6, -136.5, -134.4, -132.3, -130.2, -128.1, -126, -123.9, -121.8, -119.7, -117.6, -115.5, -113.4, -111.3, -109.2, -107.1, -105, -102.9, -100.8, -98.7, -96.6, -94.5, -92.4, -90.3, -88.2, -86.1, -84, -81.9, -79.8, -77.7, -75.6, -73.5, -71.4, -69.3, -67.2, -65.1, -63, -60.9, -58.8, -56.7, -54.6, -52.5, -50.4, -48.3, -46.2, -44.1, -42, -39.9, -37.8, -35.7, -33.6, -31.5, -29.4, -27.3, -25.2, -23.1, -21, -18.9, -16.8, -14.7, -12.6, -10.5, -8.4, -6.3, -4.2, -2.1, 0, 2.1, 4.2, 6.3, 8.4, 10.5, 12.6, 14.7, 16.8, 18.9, 21, 23.1, 25.2, 27.3, 29.4, 31.5, 33.6, 35.7, 37.8, 39.9, 42, 44.1, 46.2, 48.3, 50.4, 52.5, 54.6, 56.7, 58.8, 60.9, 63, 65.1, 67.2, 69.3, 71.4, 73.5, 75.6, 77.7, 79.8, 81.9, 84, 86.1, 88.2, 90.3, 92.4, 94.5, 96.6, 98.7, 100.8, 102.9, 105, 107.1, 109.2, 111.3, 113.4, 115.5, 117.6, 119.7, 121.8, 123.9, 126, 128.1, 130.2, 132.3, 134.4, 136.5, 138.6, 140.7, 142.8, 144.9, 147, 148.05, 149.1, 150.15, 151.2, 152.25, 153.3, 154.35, 155.4, 156.45, 157.5, 158.55, 159.6, 160.65, 161.7, 162.75, 163.8, 164.85, 165.9, 166.95, 168, 170.1, 172.2, 174.3, 176.4, 178.5, 180.6, 182.7, 184.8, 186.9, 189])
-            d5 = np.array([2.32E-03, 2.36E-03, 2.55E-03, 2.62E-03, 2.83E-03, 2.93E-03, 3.11E-03, 3.19E-03, 3.47E-03, 3.62E-03, 3.89E-03, 4.04E-03, 4.15E-03, 4.35E-03, 4.52E-03, 4.73E-03, 5.07E-03, 5.50E-03, 6.33E-03, 8.43E-03, 1.34E-02, 2.17E-02, 2.81E-02, 3.10E-02, 3.18E-02, 3.24E-02, 3.30E-02, 3.30E-02, 3.33E-02, 3.34E-02, 3.38E-02, 3.39E-02, 3.40E-02, 3.42E-02, 3.43E-02, 3.44E-02, 3.45E-02, 3.45E-02, 3.45E-02, 3.49E-02, 3.48E-02, 3.50E-02, 3.48E-02, 3.50E-02, 3.52E-02, 3.50E-02, 3.51E-02, 3.51E-02, 3.51E-02, 3.50E-02, 3.54E-02, 3.52E-02, 3.53E-02, 3.52E-02, 3.52E-02, 3.50E-02, 3.52E-02, 3.53E-02, 3.53E-02, 3.52E-02, 3.52E-02, 3.54E-02, 3.52E-02, 3.51E-02, 3.53E-02, 3.52E-02, 3.54E-02, 3.51E-02, 3.52E-02, 3.53E-02, 3.52E-02, 3.53E-02, 3.52E-02, 3.50E-02, 3.52E-02, 3.51E-02, 3.51E-02, 3.51E-02, 3.50E-02, 3.50E-02, 3.50E-02, 3.49E-02, 3.49E-02, 3.49E-02, 3.47E-02, 3.48E-02, 3.47E-02, 3.46E-02, 3.46E-02, 3.46E-02, 3.46E-02, 3.45E-02, 3.45E-02, 3.44E-02, 3.46E-02, 3.42E-02, 3.44E-02, 3.42E-02, 3.44E-02, 3.43E-02, 3.43E-02, 3.45E-02, 3.42E-02, 3.42E-02, 3.46E-02, 3.43E-02, 3.46E-02, 3.45E-02, 3.46E-02, 3.45E-02, 3.45E-02, 3.46E-02, 3.46E-02, 3.48E-02, 3.45E-02, 3.46E-02, 3.47E-02, 3.46E-02, 3.47E-02, 3.49E-02, 3.50E-02, 3.49E-02, 3.50E-02, 3.50E-02, 3.49E-02, 3.49E-02, 3.50E-02, 3.52E-02, 3.51E-02, 3.53E-02, 3.51E-02, 3.51E-02, 3.54E-02, 3.51E-02, 3.51E-02, 3.52E-02, 3.55E-02, 3.54E-02, 3.53E-02, 3.51E-02, 3.52E-02, 3.52E-02, 3.54E-02, 3.53E-02, 3.53E-02, 3.52E-02, 3.54E-02, 3.53E-02, 3.51E-02, 3.52E-02, 3.51E-02, 3.53E-02, 3.51E-02, 3.52E-02, 3.52E-02, 3.50E-02, 3.50E-02, 3.53E-02, 3.49E-02, 3.51E-02, 3.49E-02, 3.49E-02, 3.48E-02, 3.48E-02, 3.46E-02, 3.46E-02, 3.47E-02, 3.44E-02, 3.41E-02, 3.40E-02, 3.38E-02, 3.37E-02, 3.36E-02, 3.36E-02, 3.32E-02, 3.28E-02, 3.24E-02, 3.15E-02, 2.97E-02, 2.48E-02, 1.67E-02, 1.00E-02, 7.03E-03, 5.86E-03, 5.27E-03, 4.95E-03, 4.69E-03, 4.50E-03, 4.33E-03, 4.19E-03, 4.08E-03, 3.79E-03, 3.63E-03, 3.43E-03, 3.25E-03, 3.08E-03, 2.99E-03, 2.80E-03, 2.70E-03, 2.50E-03, 2.56E-03])
-            d5 = d5 / d5[100] * 100
-            ax4.plot(x5, d5, 'r', markersize=5, label='5 cm tank')
-
-            ax4.plot(
-                self.dose_grid_positions[0, :, 20, 30],
-                self.dose_grid_dose[:, 20, 30] / self.dose_grid_dose[20, 20, 30] * 100,
-                'ob',
-                # (self.dose_grid_dose[:, 20, 30] /
-                #  np.max(self.dose_grid_dose[:, 20, 38]) * 100),
-                label='10 cm calc'
-            )
-            x10 =	0.1 * np.array([-198.00, -195.80, -193.60, -191.40, -189.20, -187.00, -184.80, -182.60, -180.40, -178.20, -176.00, -174.90, -173.80, -172.70, -171.60, -170.50, -169.40, -168.30, -167.20, -166.10, -165.00, -163.90, -162.80, -161.70, -160.60, -159.50, -158.40, -157.30, -156.20, -155.10, -154.00, -151.80, -149.60, -147.40, -145.20, -143.00, -140.80, -138.60, -136.40, -134.20, -132.00, -129.80, -127.60, -125.40, -123.20, -121.00, -118.80, -116.60, -114.40, -112.20, -110.00, -107.80, -105.60, -103.40, -101.20, -99.00, -96.80, -94.60, -92.40, -90.20, -88.00, -85.80, -83.60, -81.40, -79.20, -77.00, -74.80, -72.60, -70.40, -68.20, -66.00, -63.80, -61.60, -59.40, -57.20, -55.00, -52.80, -50.60, -48.40, -46.20, -44.00, -41.80, -39.60, -37.40, -35.20, -33.00, -30.80, -28.60, -26.40, -24.20, -22.00, -19.80, -17.60, -15.40, -13.20, -11.00, -8.80, -6.60, -4.40, -2.20, 0.00, 2.20, 4.40, 6.60, 8.80, 11.00, 13.20, 15.40, 17.60, 19.80, 22.00, 24.20, 26.40, 28.60, 30.80, 33.00, 35.20, 37.40, 39.60, 41.80, 44.00, 46.20, 48.40, 50.60, 52.80, 55.00, 57.20, 59.40, 61.60, 63.80, 66.00, 68.20, 70.40, 72.60, 74.80, 77.00, 79.20, 81.40, 83.60, 85.80, 88.00, 90.20, 92.40, 94.60, 96.80, 99.00, 101.20, 103.40, 105.60, 107.80, 110.00, 112.20, 114.40, 116.60, 118.80, 121.00, 123.20, 125.40, 127.60, 129.80, 132.00, 134.20, 136.40, 138.60, 140.80, 143.00, 145.20, 147.40, 149.60, 151.80, 154.00, 155.10, 156.20, 157.30, 158.40, 159.50, 160.60, 161.70, 162.80, 163.90, 165.00, 166.10, 167.20, 168.30, 169.40, 170.50, 171.60, 172.70, 173.80, 174.90, 176.00, 178.20, 180.40, 182.60, 184.80, 187.00, 189.20, 191.40, 193.60, 195.80, 198.00])
-            d10 = np.array([2.64E-03, 2.71E-03, 2.85E-03, 2.94E-03, 3.11E-03, 3.28E-03, 3.43E-03, 3.58E-03, 3.80E-03, 3.99E-03, 4.15E-03, 4.38E-03, 4.50E-03, 4.55E-03, 4.72E-03, 4.91E-03, 5.16E-03, 5.50E-03, 6.00E-03, 7.09E-03, 9.85E-03, 1.50E-02, 2.03E-02, 2.30E-02, 2.42E-02, 2.47E-02, 2.50E-02, 2.53E-02, 2.53E-02, 2.55E-02, 2.58E-02, 2.60E-02, 2.61E-02, 2.64E-02, 2.64E-02, 2.68E-02, 2.70E-02, 2.69E-02, 2.70E-02, 2.72E-02, 2.73E-02, 2.73E-02, 2.75E-02, 2.74E-02, 2.78E-02, 2.76E-02, 2.76E-02, 2.77E-02, 2.77E-02, 2.79E-02, 2.78E-02, 2.81E-02, 2.80E-02, 2.81E-02, 2.82E-02, 2.82E-02, 2.81E-02, 2.82E-02, 2.80E-02, 2.83E-02, 2.82E-02, 2.84E-02, 2.83E-02, 2.82E-02, 2.82E-02, 2.84E-02, 2.84E-02, 2.84E-02, 2.83E-02, 2.84E-02, 2.83E-02, 2.83E-02, 2.85E-02, 2.83E-02, 2.85E-02, 2.84E-02, 2.84E-02, 2.86E-02, 2.83E-02, 2.82E-02, 2.85E-02, 2.82E-02, 2.82E-02, 2.83E-02, 2.82E-02, 2.81E-02, 2.83E-02, 2.81E-02, 2.83E-02, 2.80E-02, 2.81E-02, 2.83E-02, 2.82E-02, 2.80E-02, 2.80E-02, 2.81E-02, 2.80E-02, 2.81E-02, 2.80E-02, 2.78E-02, 2.79E-02, 2.79E-02, 2.79E-02, 2.81E-02, 2.79E-02, 2.81E-02, 2.82E-02, 2.81E-02, 2.79E-02, 2.82E-02, 2.83E-02, 2.81E-02, 2.82E-02, 2.81E-02, 2.81E-02, 2.79E-02, 2.82E-02, 2.80E-02, 2.81E-02, 2.81E-02, 2.79E-02, 2.83E-02, 2.83E-02, 2.83E-02, 2.83E-02, 2.85E-02, 2.83E-02, 2.83E-02, 2.85E-02, 2.85E-02, 2.84E-02, 2.83E-02, 2.84E-02, 2.83E-02, 2.84E-02, 2.84E-02, 2.83E-02, 2.83E-02, 2.83E-02, 2.82E-02, 2.82E-02, 2.83E-02, 2.82E-02, 2.83E-02, 2.82E-02, 2.81E-02, 2.81E-02, 2.80E-02, 2.79E-02, 2.80E-02, 2.80E-02, 2.79E-02, 2.78E-02, 2.77E-02, 2.78E-02, 2.78E-02, 2.77E-02, 2.76E-02, 2.75E-02, 2.74E-02, 2.74E-02, 2.72E-02, 2.71E-02, 2.70E-02, 2.70E-02, 2.68E-02, 2.67E-02, 2.65E-02, 2.63E-02, 2.61E-02, 2.59E-02, 2.58E-02, 2.57E-02, 2.56E-02, 2.53E-02, 2.49E-02, 2.48E-02, 2.41E-02, 2.31E-02, 2.03E-02, 1.51E-02, 9.85E-03, 7.17E-03, 6.01E-03, 5.55E-03, 5.24E-03, 5.09E-03, 4.84E-03, 4.73E-03, 4.58E-03, 4.48E-03, 4.24E-03, 4.02E-03, 3.81E-03, 3.65E-03, 3.50E-03, 3.31E-03, 3.19E-03, 3.01E-03, 2.88E-03, 2.77E-03])
-            d10 = d10 / d10[100] * 100
-            ax4.plot(x10, d10, 'b', markersize=5, label='10 cm tank')
-
-            ax4.plot(
-                self.dose_grid_positions[0, :, 20, 20],
-                self.dose_grid_dose[:, 20, 20] / self.dose_grid_dose[20, 20, 20] * 100,
-                'og',
-                # (self.dose_grid_dose[:, 20, 10] /
-                #  np.max(self.dose_grid_dose[:, 20, 38]) * 100),
-                label='20 cm calc'
-            )
-            x20 = 0.1 * np.array([-216, -213.6, -211.2, -208.8, -206.4, -204, -201.6, -199.2, -196.8, -194.4, -192, -190.8, -189.6, -188.4, -187.2, -186, -184.8, -183.6, -182.4, -181.2, -180, -178.8, -177.6, -176.4, -175.2, -174, -172.8, -171.6, -170.4, -169.2, -168, -165.6, -163.2, -160.8, -158.4, -156, -153.6, -151.2, -148.8, -146.4, -144, -141.6, -139.2, -136.8, -134.4, -132, -129.6, -127.2, -124.8, -122.4, -120, -117.6, -115.2, -112.8, -110.4, -108, -105.6, -103.2, -100.8, -98.4, -96, -93.6, -91.2, -88.8, -86.4, -84, -81.6, -79.2, -76.8, -74.4, -72, -69.6, -67.2, -64.8, -62.4, -60, -57.6, -55.2, -52.8, -50.4, -48, -45.6, -43.2, -40.8, -38.4, -36, -33.6, -31.2, -28.8, -26.4, -24, -21.6, -19.2, -16.8, -14.4, -12, -9.6, -7.2, -4.8, -2.4, 0, 2.4, 4.8, 7.2, 9.6, 12, 14.4, 16.8, 19.2, 21.6, 24, 26.4, 28.8, 31.2, 33.6, 36, 38.4, 40.8, 43.2, 45.6, 48, 50.4, 52.8, 55.2, 57.6, 60, 62.4, 64.8, 67.2, 69.6, 72, 74.4, 76.8, 79.2, 81.6, 84, 86.4, 88.8, 91.2, 93.6, 96, 98.4, 100.8, 103.2, 105.6, 108, 110.4, 112.8, 115.2, 117.6, 120, 122.4, 124.8, 127.2, 129.6, 132, 134.4, 136.8, 139.2, 141.6, 144, 146.4, 148.8, 151.2, 153.6, 156, 158.4, 160.8, 163.2, 165.6, 168, 169.2, 170.4, 171.6, 172.8, 174, 175.2, 176.4, 177.6, 178.8, 180, 181.2, 182.4, 183.6, 184.8, 186, 187.2, 188.4, 189.6, 190.8, 192, 194.4, 196.8, 199.2, 201.6, 204, 206.4, 208.8, 211.2, 213.6, 216])
-            d20 = np.array([2.31E-03, 2.40E-03, 2.48E-03, 2.62E-03, 2.73E-03, 2.84E-03, 2.92E-03, 3.10E-03, 3.20E-03, 3.35E-03, 3.50E-03, 3.57E-03, 3.68E-03, 3.73E-03, 3.84E-03, 3.93E-03, 4.06E-03, 4.26E-03, 4.55E-03, 5.14E-03, 6.56E-03, 9.18E-03, 1.18E-02, 1.33E-02, 1.38E-02, 1.41E-02, 1.43E-02, 1.46E-02, 1.47E-02, 1.47E-02, 1.48E-02, 1.51E-02, 1.51E-02, 1.53E-02, 1.54E-02, 1.56E-02, 1.57E-02, 1.59E-02, 1.59E-02, 1.60E-02, 1.61E-02, 1.62E-02, 1.64E-02, 1.65E-02, 1.65E-02, 1.65E-02, 1.65E-02, 1.66E-02, 1.68E-02, 1.68E-02, 1.68E-02, 1.69E-02, 1.70E-02, 1.71E-02, 1.70E-02, 1.71E-02, 1.72E-02, 1.73E-02, 1.72E-02, 1.73E-02, 1.73E-02, 1.74E-02, 1.74E-02, 1.74E-02, 1.75E-02, 1.75E-02, 1.75E-02, 1.75E-02, 1.76E-02, 1.76E-02, 1.76E-02, 1.77E-02, 1.76E-02, 1.78E-02, 1.78E-02, 1.77E-02, 1.77E-02, 1.76E-02, 1.78E-02, 1.77E-02, 1.76E-02, 1.77E-02, 1.78E-02, 1.78E-02, 1.78E-02, 1.78E-02, 1.78E-02, 1.77E-02, 1.77E-02, 1.78E-02, 1.77E-02, 1.79E-02, 1.78E-02, 1.77E-02, 1.77E-02, 1.77E-02, 1.78E-02, 1.76E-02, 1.77E-02, 1.77E-02, 1.78E-02, 1.76E-02, 1.75E-02, 1.77E-02, 1.77E-02, 1.78E-02, 1.77E-02, 1.77E-02, 1.77E-02, 1.78E-02, 1.77E-02, 1.77E-02, 1.78E-02, 1.77E-02, 1.76E-02, 1.78E-02, 1.78E-02, 1.77E-02, 1.77E-02, 1.78E-02, 1.77E-02, 1.77E-02, 1.76E-02, 1.78E-02, 1.77E-02, 1.77E-02, 1.77E-02, 1.76E-02, 1.76E-02, 1.76E-02, 1.76E-02, 1.76E-02, 1.76E-02, 1.76E-02, 1.77E-02, 1.75E-02, 1.75E-02, 1.75E-02, 1.75E-02, 1.73E-02, 1.75E-02, 1.74E-02, 1.73E-02, 1.73E-02, 1.73E-02, 1.71E-02, 1.70E-02, 1.70E-02, 1.70E-02, 1.70E-02, 1.70E-02, 1.68E-02, 1.69E-02, 1.67E-02, 1.67E-02, 1.66E-02, 1.66E-02, 1.65E-02, 1.63E-02, 1.63E-02, 1.61E-02, 1.61E-02, 1.60E-02, 1.60E-02, 1.59E-02, 1.56E-02, 1.57E-02, 1.55E-02, 1.54E-02, 1.52E-02, 1.51E-02, 1.48E-02, 1.47E-02, 1.46E-02, 1.46E-02, 1.44E-02, 1.42E-02, 1.40E-02, 1.33E-02, 1.19E-02, 9.18E-03, 6.63E-03, 5.18E-03, 4.63E-03, 4.30E-03, 4.18E-03, 4.01E-03, 3.94E-03, 3.89E-03, 3.77E-03, 3.67E-03, 3.49E-03, 3.37E-03, 3.19E-03, 3.11E-03, 2.95E-03, 2.86E-03, 2.72E-03, 2.63E-03, 2.57E-03, 2.51E-03])
-            d20 = d20 / d20[101] * 100
-            ax4.plot(x20, d20, 'g', markersize=5, label='20 cm tank')
-
-            ax4.plot(
-                self.dose_grid_positions[0, :, 20, 10],
-                self.dose_grid_dose[:, 20, 10] / self.dose_grid_dose[20, 20, 10] * 100,
-                'om',
-                # (self.dose_grid_dose[:, 20, 10] /
-                #  np.max(self.dose_grid_dose[:, 20, 38]) * 100),
-                label='30 cm calc'
-            )
-            x30 = 0.1 * np.array([-234, -231.4, -228.8, -226.2, -223.6, -221, -218.4, -215.8, -213.2, -210.6, -208, -206.7, -205.4, -204.1, -202.8, -201.5, -200.2, -198.9, -197.6, -196.3, -195, -193.7, -192.4, -191.1, -189.8, -188.5, -187.2, -185.9, -184.6, -183.3, -182, -179.4, -176.8, -174.2, -171.6, -169, -166.4, -163.8, -161.2, -158.6, -156, -153.4, -150.8, -148.2, -145.6, -143, -140.4, -137.8, -135.2, -132.6, -130, -127.4, -124.8, -122.2, -119.6, -117, -114.4, -111.8, -109.2, -106.6, -104, -101.4, -98.8, -96.2, -93.6, -91, -88.4, -85.8, -83.2, -80.6, -78, -75.4, -72.8, -70.2, -67.6, -65, -62.4, -59.8, -57.2, -54.6, -52, -49.4, -46.8, -44.2, -41.6, -39, -36.4, -33.8, -31.2, -28.6, -26, -23.4, -20.8, -18.2, -15.6, -13, -10.4, -7.8, -5.2, -2.6, 0, 2.6, 5.2, 7.8, 10.4, 13, 15.6, 18.2, 20.8, 23.4, 26, 28.6, 31.2, 33.8, 36.4, 39, 41.6, 44.2, 46.8, 49.4, 52, 54.6, 57.2, 59.8, 62.4, 65, 67.6, 70.2, 72.8, 75.4, 78, 80.6, 83.2, 85.8, 88.4, 91, 93.6, 96.2, 98.8, 101.4, 104, 106.6, 109.2, 111.8, 114.4, 117, 119.6, 122.2, 124.8, 127.4, 130, 132.6, 135.2, 137.8, 140.4, 143, 145.6, 148.2, 150.8, 153.4, 156, 158.6, 161.2, 163.8, 166.4, 169, 171.6, 174.2, 176.8, 179.4, 182, 183.3, 184.6, 185.9, 187.2, 188.5, 189.8, 191.1, 192.4, 193.7, 195, 196.3, 197.6, 198.9, 200.2, 201.5, 202.8, 204.1, 205.4, 206.7, 208, 210.6, 213.2, 215.8])
-            d30 = np.array([1.64E-03, 1.70E-03, 1.77E-03, 1.86E-03, 1.91E-03, 1.97E-03, 2.06E-03, 2.15E-03, 2.21E-03, 2.32E-03, 2.42E-03, 2.45E-03, 2.48E-03, 2.53E-03, 2.60E-03, 2.64E-03, 2.76E-03, 2.79E-03, 2.93E-03, 3.23E-03, 3.80E-03, 4.90E-03, 6.50E-03, 7.47E-03, 7.95E-03, 8.19E-03, 8.31E-03, 8.35E-03, 8.43E-03, 8.43E-03, 8.62E-03, 8.66E-03, 8.78E-03, 8.89E-03, 9.00E-03, 9.04E-03, 9.12E-03, 9.14E-03, 9.26E-03, 9.45E-03, 9.44E-03, 9.53E-03, 9.64E-03, 9.61E-03, 9.72E-03, 9.72E-03, 9.81E-03, 9.85E-03, 9.88E-03, 9.95E-03, 1.01E-02, 1.00E-02, 1.02E-02, 1.01E-02, 1.02E-02, 1.02E-02, 1.02E-02, 1.03E-02, 1.03E-02, 1.04E-02, 1.04E-02, 1.04E-02, 1.05E-02, 1.04E-02, 1.06E-02, 1.06E-02, 1.06E-02, 1.06E-02, 1.07E-02, 1.07E-02, 1.06E-02, 1.07E-02, 1.08E-02, 1.08E-02, 1.08E-02, 1.08E-02, 1.09E-02, 1.08E-02, 1.08E-02, 1.09E-02, 1.08E-02, 1.09E-02, 1.09E-02, 1.09E-02, 1.09E-02, 1.09E-02, 1.09E-02, 1.09E-02, 1.09E-02, 1.09E-02, 1.08E-02, 1.09E-02, 1.09E-02, 1.09E-02, 1.10E-02, 1.09E-02, 1.09E-02, 1.09E-02, 1.09E-02, 1.09E-02, 1.10E-02, 1.09E-02, 1.09E-02, 1.09E-02, 1.09E-02, 1.09E-02, 1.09E-02, 1.09E-02, 1.08E-02, 1.09E-02, 1.09E-02, 1.10E-02, 1.09E-02, 1.09E-02, 1.09E-02, 1.08E-02, 1.09E-02, 1.09E-02, 1.08E-02, 1.09E-02, 1.08E-02, 1.08E-02, 1.08E-02, 1.09E-02, 1.08E-02, 1.08E-02, 1.09E-02, 1.08E-02, 1.08E-02, 1.07E-02, 1.07E-02, 1.07E-02, 1.07E-02, 1.07E-02, 1.06E-02, 1.06E-02, 1.05E-02, 1.06E-02, 1.06E-02, 1.05E-02, 1.05E-02, 1.04E-02, 1.04E-02, 1.04E-02, 1.04E-02, 1.02E-02, 1.03E-02, 1.02E-02, 1.01E-02, 1.01E-02, 1.01E-02, 1.00E-02, 9.96E-03, 9.96E-03, 9.89E-03, 9.80E-03, 9.80E-03, 9.75E-03, 9.61E-03, 9.57E-03, 9.62E-03, 9.52E-03, 9.37E-03, 9.36E-03, 9.20E-03, 9.17E-03, 9.10E-03, 8.96E-03, 8.94E-03, 8.81E-03, 8.73E-03, 8.65E-03, 8.58E-03, 8.56E-03, 8.44E-03, 8.41E-03, 8.25E-03, 8.14E-03, 7.85E-03, 7.28E-03, 6.11E-03, 4.64E-03, 3.63E-03, 3.18E-03, 2.97E-03, 2.83E-03, 2.74E-03, 2.66E-03, 2.63E-03, 2.55E-03, 2.56E-03, 2.44E-03, 2.32E-03, 2.24E-03])
-            d30 = d30 / d30[101] * 100
-            ax4.plot(x30, d30, 'm', markersize=5, label='30 cm tank')
-
-            ax4.set_xlim([-25, 25])
-            ax4.set_ylim([0, 110])
-            ax4.set_title("Profiles")
-            ax4.set_xlabel("Position [cm]")
-            ax4.set_ylabel("Relative Value [%]")
-            # x0, x1 = ax4.get_xlim()
-            # y0, y1 = ax4.get_ylim()
-            # ax4.set_aspect(abs(x1-x0)/abs(y1-y0))
-            ax4.legend()
-
-        def plot_10x10_profiles():  # pylint: disable=W0612
-            f4 = plt.figure()  # pylint: disable=W0612
-            ax4 = plt.gca()
-            ax4.plot(
-                self.dose_grid_positions[0, :, 20, 35],
-                self.dose_grid_dose[:, 20, 35] / self.dose_grid_dose[20, 20, 35] * 100,
-                # (self.dose_grid_dose[:, 20, 38] /
-                #  np.max(self.dose_grid_dose[:, 20, 38]) * 100),
-                label='5 cm calc'
-            )
-            x5 = 0.1 * np.array([-84, -81.9, -79.8, -77.7, -75.6, -73.5, -71.4, -69.3, -67.2, -65.1, -63, -61.95, -60.9, -59.85, -58.8, -57.75, -56.7, -55.65, -54.6, -53.55, -52.5, -51.45, -50.4, -49.35, -48.3, -47.25, -46.2, -45.15, -44.1, -43.05, -42, -39.9, -37.8, -35.7, -33.6, -31.5, -29.4, -27.3, -25.2, -23.1, -21, -18.9, -16.8, -14.7, -12.6, -10.5, -8.4, -6.3, -4.2, -2.1, 0, 2.1, 4.2, 6.3, 8.4, 10.5, 12.6, 14.7, 16.8, 18.9, 21, 23.1, 25.2, 27.3, 29.4, 31.5, 33.6, 35.7, 37.8, 39.9, 42, 43.05, 44.1, 45.15, 46.2, 47.25, 48.3, 49.35, 50.4, 51.45, 52.5, 53.55, 54.6, 55.65, 56.7, 57.75, 58.8, 59.85, 60.9, 61.95, 63, 65.1, 67.2, 69.3, 71.4, 73.5, 75.6, 77.7, 79.8, 81.9, 84])
-            d5 = np.array([1.19E-03, 1.24E-03, 1.32E-03, 1.44E-03, 1.59E-03, 1.62E-03, 1.79E-03, 1.91E-03, 2.13E-03, 2.33E-03, 2.57E-03, 2.72E-03, 2.88E-03, 3.01E-03, 3.24E-03, 3.53E-03, 3.96E-03, 4.70E-03, 6.25E-03, 1.00E-02, 1.80E-02, 2.70E-02, 3.21E-02, 3.39E-02, 3.46E-02, 3.53E-02, 3.54E-02, 3.58E-02, 3.60E-02, 3.63E-02, 3.62E-02, 3.63E-02, 3.63E-02, 3.66E-02, 3.67E-02, 3.69E-02, 3.69E-02, 3.68E-02, 3.69E-02, 3.69E-02, 3.68E-02, 3.73E-02, 3.71E-02, 3.72E-02, 3.70E-02, 3.69E-02, 3.69E-02, 3.70E-02, 3.68E-02, 3.69E-02, 3.67E-02, 3.68E-02, 3.66E-02, 3.67E-02, 3.68E-02, 3.68E-02, 3.70E-02, 3.67E-02, 3.69E-02, 3.67E-02, 3.69E-02, 3.69E-02, 3.68E-02, 3.68E-02, 3.68E-02, 3.66E-02, 3.67E-02, 3.63E-02, 3.62E-02, 3.63E-02, 3.60E-02, 3.58E-02, 3.56E-02, 3.59E-02, 3.53E-02, 3.50E-02, 3.44E-02, 3.38E-02, 3.20E-02, 2.75E-02, 1.89E-02, 1.05E-02, 6.44E-03, 4.73E-03, 3.98E-03, 3.56E-03, 3.24E-03, 3.00E-03, 2.83E-03, 2.69E-03, 2.58E-03, 2.33E-03, 2.14E-03, 1.92E-03, 1.81E-03, 1.63E-03, 1.53E-03, 1.40E-03, 1.35E-03, 1.23E-03, 1.20E-03])
-            d5 = d5 / d5[50] * 100
-            ax4.plot(x5, d5, markersize=2, label='5 cm tank')
-
-            ax4.plot(
-                self.dose_grid_positions[0, :, 20, 30],
-                self.dose_grid_dose[:, 20, 30] / self.dose_grid_dose[20, 20, 30] * 100,
-                # (self.dose_grid_dose[:, 20, 30] /
-                #  np.max(self.dose_grid_dose[:, 20, 38]) * 100),
-                label='10 cm calc'
-            )
-            x10 = 0.1 * np.array([-88, -85.8, -83.6, -81.4, -79.2, -77, -74.8, -72.6, -70.4, -68.2, -66, -64.9, -63.8, -62.7, -61.6, -60.5, -59.4, -58.3, -57.2, -56.1, -55, -53.9, -52.8, -51.7, -50.6, -49.5, -48.4, -47.3, -46.2, -45.1, -44, -41.8, -39.6, -37.4, -35.2, -33, -30.8, -28.6, -26.4, -24.2, -22, -19.8, -17.6, -15.4, -13.2, -11, -8.8, -6.6, -4.4, -2.2, 0, 2.2, 4.4, 6.6, 8.8, 11, 13.2, 15.4, 17.6, 19.8, 22, 24.2, 26.4, 28.6, 30.8, 33, 35.2, 37.4, 39.6, 41.8, 44, 45.1, 46.2, 47.3, 48.4, 49.5, 50.6, 51.7, 52.8, 53.9, 55, 56.1, 57.2, 58.3, 59.4, 60.5, 61.6, 62.7, 63.8, 64.9, 66, 68.2, 70.4, 72.6, 74.8, 77, 79.2, 81.4, 83.6, 85.8, 88])
-            d10 = np.array([1.39E-03, 1.49E-03, 1.58E-03, 1.64E-03, 1.75E-03, 1.90E-03, 2.04E-03, 2.16E-03, 2.35E-03, 2.52E-03, 2.80E-03, 2.83E-03, 3.08E-03, 3.16E-03, 3.38E-03, 3.61E-03, 3.87E-03, 4.36E-03, 5.34E-03, 7.59E-03, 1.27E-02, 1.93E-02, 2.35E-02, 2.52E-02, 2.61E-02, 2.65E-02, 2.66E-02, 2.69E-02, 2.70E-02, 2.72E-02, 2.72E-02, 2.74E-02, 2.76E-02, 2.79E-02, 2.79E-02, 2.80E-02, 2.82E-02, 2.83E-02, 2.84E-02, 2.85E-02, 2.85E-02, 2.85E-02, 2.85E-02, 2.84E-02, 2.85E-02, 2.84E-02, 2.84E-02, 2.84E-02, 2.85E-02, 2.83E-02, 2.83E-02, 2.86E-02, 2.84E-02, 2.85E-02, 2.84E-02, 2.83E-02, 2.84E-02, 2.84E-02, 2.82E-02, 2.84E-02, 2.83E-02, 2.83E-02, 2.82E-02, 2.80E-02, 2.80E-02, 2.79E-02, 2.79E-02, 2.77E-02, 2.75E-02, 2.74E-02, 2.72E-02, 2.70E-02, 2.71E-02, 2.67E-02, 2.67E-02, 2.65E-02, 2.59E-02, 2.56E-02, 2.44E-02, 2.16E-02, 1.60E-02, 9.74E-03, 6.17E-03, 4.72E-03, 4.08E-03, 3.67E-03, 3.52E-03, 3.22E-03, 3.03E-03, 2.93E-03, 2.77E-03, 2.63E-03, 2.42E-03, 2.22E-03, 2.07E-03, 1.90E-03, 1.82E-03, 1.69E-03, 1.54E-03, 1.49E-03, 1.39E-03])
-            d10 = d10 / d10[50] * 100
-            ax4.plot(x10, d10, markersize=2, label='10 cm tank')
-
-            ax4.plot(
-                self.dose_grid_positions[0, :, 20, 20],
-                self.dose_grid_dose[:, 20, 20] / self.dose_grid_dose[20, 20, 20] * 100,
-                # (self.dose_grid_dose[:, 20, 10] /
-                #  np.max(self.dose_grid_dose[:, 20, 38]) * 100),
-                label='20 cm calc'
-            )
-            x20 = 0.1 * np.array([-96, -93.6, -91.2, -88.8, -86.4, -84, -81.6, -79.2, -76.8, -74.4, -72, -70.8, -69.6, -68.4, -67.2, -66, -64.8, -63.6, -62.4, -61.2, -60, -58.8, -57.6, -56.4, -55.2, -54, -52.8, -51.6, -50.4, -49.2, -48, -45.6, -43.2, -40.8, -38.4, -36, -33.6, -31.2, -28.8, -26.4, -24, -21.6, -19.2, -16.8, -14.4, -12, -9.6, -7.2, -4.8, -2.4, 0, 2.4, 4.8, 7.2, 9.6, 12, 14.4, 16.8, 19.2, 21.6, 24, 26.4, 28.8, 31.2, 33.6, 36, 38.4, 40.8, 43.2, 45.6, 48, 49.2, 50.4, 51.6, 52.8, 54, 55.2, 56.4, 57.6, 58.8, 60, 61.2, 62.4, 63.6, 64.8, 66, 67.2, 68.4, 69.6, 70.8, 72, 74.4, 76.8, 79.2, 81.6, 84, 86.4, 88.8, 91.2, 93.6, 96])
-            d20 = np.array([1.24E-03, 1.31E-03, 1.35E-03, 1.43E-03, 1.56E-03, 1.63E-03, 1.72E-03, 1.84E-03, 1.98E-03, 2.05E-03, 2.18E-03, 2.26E-03, 2.42E-03, 2.51E-03, 2.59E-03, 2.73E-03, 2.96E-03, 3.11E-03, 3.66E-03, 4.88E-03, 7.39E-03, 1.08E-02, 1.31E-02, 1.41E-02, 1.46E-02, 1.49E-02, 1.50E-02, 1.51E-02, 1.53E-02, 1.53E-02, 1.53E-02, 1.54E-02, 1.56E-02, 1.57E-02, 1.58E-02, 1.58E-02, 1.61E-02, 1.61E-02, 1.62E-02, 1.62E-02, 1.63E-02, 1.63E-02, 1.63E-02, 1.63E-02, 1.63E-02, 1.62E-02, 1.64E-02, 1.63E-02, 1.63E-02, 1.63E-02, 1.63E-02, 1.62E-02, 1.64E-02, 1.63E-02, 1.63E-02, 1.62E-02, 1.63E-02, 1.63E-02, 1.62E-02, 1.62E-02, 1.60E-02, 1.62E-02, 1.60E-02, 1.60E-02, 1.59E-02, 1.58E-02, 1.58E-02, 1.57E-02, 1.54E-02, 1.54E-02, 1.51E-02, 1.52E-02, 1.52E-02, 1.51E-02, 1.51E-02, 1.48E-02, 1.46E-02, 1.44E-02, 1.37E-02, 1.22E-02, 9.26E-03, 6.02E-03, 4.15E-03, 3.36E-03, 2.96E-03, 2.74E-03, 2.63E-03, 2.54E-03, 2.40E-03, 2.34E-03, 2.21E-03, 2.12E-03, 1.96E-03, 1.86E-03, 1.75E-03, 1.64E-03, 1.56E-03, 1.47E-03, 1.39E-03, 1.30E-03, 1.27E-03])
-            d20 = d20 / d20[50] * 100
-            ax4.plot(x20, d20, markersize=2, label='20 cm tank')
-
-            ax4.plot(
-                self.dose_grid_positions[0, :, 20, 10],
-                self.dose_grid_dose[:, 20, 10] / self.dose_grid_dose[20, 20, 10] * 100,
-                # (self.dose_grid_dose[:, 20, 10] /
-                #  np.max(self.dose_grid_dose[:, 20, 38]) * 100),
-                label='30 cm calc'
-            )
-            x30 = 0.1 * np.array([-104, -101.4, -98.8, -96.2, -93.6, -91, -88.4, -85.8, -83.2, -80.6, -78, -76.7, -75.4, -74.1, -72.8, -71.5, -70.2, -68.9, -67.6, -66.3, -65, -63.7, -62.4, -61.1, -59.8, -58.5, -57.2, -55.9, -54.6, -53.3, -52, -49.4, -46.8, -44.2, -41.6, -39, -36.4, -33.8, -31.2, -28.6, -26, -23.4, -20.8, -18.2, -15.6, -13, -10.4, -7.8, -5.2, -2.6, 0, 2.6, 5.2, 7.8, 10.4, 13, 15.6, 18.2, 20.8, 23.4, 26, 28.6, 31.2, 33.8, 36.4, 39, 41.6, 44.2, 46.8, 49.4, 52, 53.3, 54.6, 55.9, 57.2, 58.5, 59.8, 61.1, 62.4, 63.7, 65, 66.3, 67.6, 68.9, 70.2, 71.5, 72.8, 74.1, 75.4, 76.7, 78, 80.6, 83.2, 85.8, 88.4, 91, 93.6, 96.2, 98.8, 101.4, 104])
-            d30 = np.array([9.06E-04, 9.08E-04, 9.47E-04, 1.01E-03, 1.07E-03, 1.15E-03, 1.18E-03, 1.26E-03, 1.35E-03, 1.41E-03, 1.51E-03, 1.48E-03, 1.60E-03, 1.60E-03, 1.68E-03, 1.73E-03, 1.83E-03, 1.93E-03, 2.19E-03, 2.62E-03, 3.73E-03, 5.53E-03, 7.00E-03, 7.89E-03, 8.20E-03, 8.30E-03, 8.48E-03, 8.56E-03, 8.72E-03, 8.66E-03, 8.70E-03, 8.78E-03, 8.98E-03, 8.92E-03, 8.97E-03, 9.08E-03, 9.17E-03, 9.16E-03, 9.20E-03, 9.18E-03, 9.29E-03, 9.31E-03, 9.32E-03, 9.41E-03, 9.36E-03, 9.33E-03, 9.33E-03, 9.35E-03, 9.41E-03, 9.35E-03, 9.39E-03, 9.32E-03, 9.38E-03, 9.31E-03, 9.42E-03, 9.32E-03, 9.36E-03, 9.33E-03, 9.25E-03, 9.32E-03, 9.26E-03, 9.24E-03, 9.22E-03, 9.28E-03, 9.16E-03, 9.15E-03, 9.07E-03, 9.00E-03, 8.94E-03, 8.74E-03, 8.76E-03, 8.65E-03, 8.61E-03, 8.58E-03, 8.57E-03, 8.42E-03, 8.26E-03, 8.17E-03, 7.94E-03, 7.23E-03, 5.90E-03, 4.12E-03, 2.86E-03, 2.25E-03, 1.99E-03, 1.84E-03, 1.78E-03, 1.68E-03, 1.65E-03, 1.54E-03, 1.57E-03, 1.44E-03, 1.42E-03, 1.31E-03, 1.21E-03, 1.15E-03, 1.12E-03, 1.06E-03, 1.03E-03, 9.64E-04, 9.21E-04])
-            d30 = d30 / d30[50] * 100
-            ax4.plot(x30, d30, markersize=2, label='30 cm tank')
-
-            ax4.set_xlim([-25, 25])
-            ax4.set_ylim([0, 110])
-            ax4.set_title("Profiles")
-            ax4.set_xlabel("Position [cm]")
-            ax4.set_ylabel("Relative Value [%]")
-            # x0, x1 = ax4.get_xlim()
-            # y0, y1 = ax4.get_ylim()
-            # ax4.set_aspect(abs(x1-x0)/abs(y1-y0))
-            ax4.legend()
-
-        def plot_cax():  # pylint: disable=W0612
-            f5 = plt.figure()  # pylint: disable=W0612
-            ax5 = plt.gca()
-            ax5.plot(
-                -self.dose_grid_positions[2, 20, 20, :] - 100,
-                (self.dose_grid_fluence[20, 20, :] /
-                np.max(self.dose_grid_fluence[20, 20, :]) * 100),
-                label='Fluence'
-            )
-            ax5.plot(
-                -self.dose_grid_positions[2, 20, 20, :] - 100,
-                (self.dose_grid_terma[20, 20, :] /
-                np.max(self.dose_grid_terma[20, 20, :]) * 100),
-                label='TERMA'
-            )
-            ax5.plot(
-                -self.dose_grid_positions[2, 20, 20, :] - 100,
-                (self.dose_grid_dose[20, 20, :] /
-                np.max(self.dose_grid_dose[20, 20, :]) * 100),
-                label='Dose'
-            )
-            ax5.set_xlim([0, 40.0])
-            ax5.set_ylim([0, 100])
-            ax5.set_title("PDD")
-            ax5.set_xlabel("Depth [cm]")
-            ax5.set_ylabel("Relative Value [%]")
-            # x0, x1 = ax5.get_xlim()
-            # y0, y1 = ax5.get_ylim()
-            # ax5.set_aspect(abs(x1-x0)/abs(y1-y0))
-            ax5.legend()
-
-        def plot_10x10_pdd():
-            f5 = plt.figure()  # pylint: disable=W0612
-            ax5 = plt.gca()
-            ax5.plot(
-                -self.dose_grid_positions[2, 20, 20, :] - 90,
-                (self.dose_grid_dose[20, 20, :] /
-                np.max(self.dose_grid_dose[20, 20, :]) * 100),
-                label='Calc'
-            )
-
-            xpdd = np.array([0, 0.5, 1, 1.5, 2, 2.5, 3, 3.5, 4, 4.5, 5, 5.5, 6, 6.5, 7, 7.5, 8, 8.5, 9, 9.5, 10, 10.5, 11, 11.5, 12, 12.5, 13, 13.5, 14, 14.5, 15, 15.5, 16, 16.5, 17, 17.5, 18, 18.5, 19, 19.5, 20, 22.5, 25, 27.5, 30, 32.5, 35, 37.5, 40, 42.5, 45, 47.5, 50, 52.5, 55, 57.5, 60, 65, 70, 75, 80, 85, 90, 95, 100, 105, 110, 115, 120, 125, 130, 135, 140, 145, 150, 155, 160, 165, 170, 175, 180, 185, 190, 195, 200, 205, 210, 215, 220, 225, 230, 235, 240, 245, 250, 255, 260, 265, 270, 275, 280, 285, 290, 295, 300])
-            xpdd *= 0.1
-            dpdd = np.array([1.65E-01, 1.67E-01, 1.68E-01, 1.71E-01, 1.78E-01, 1.94E-01, 2.03E-01, 2.16E-01, 2.29E-01, 2.35E-01, 2.44E-01, 2.50E-01, 2.55E-01, 2.60E-01, 2.63E-01, 2.66E-01, 2.70E-01, 2.71E-01, 2.73E-01, 2.75E-01, 2.76E-01, 2.77E-01, 2.78E-01, 2.79E-01, 2.80E-01, 2.80E-01, 2.80E-01, 2.80E-01, 2.80E-01, 2.80E-01, 2.80E-01, 2.80E-01, 2.79E-01, 2.79E-01, 2.78E-01, 2.78E-01, 2.77E-01, 2.77E-01, 2.77E-01, 2.76E-01, 2.76E-01, 2.72E-01, 2.69E-01, 2.66E-01, 2.63E-01, 2.60E-01, 2.57E-01, 2.54E-01, 2.51E-01, 2.48E-01, 2.44E-01, 2.41E-01, 2.38E-01, 2.35E-01, 2.32E-01, 2.29E-01, 2.26E-01, 2.20E-01, 2.14E-01, 2.08E-01, 2.02E-01, 1.97E-01, 1.91E-01, 1.86E-01, 1.81E-01, 1.76E-01, 1.71E-01, 1.66E-01, 1.61E-01, 1.57E-01, 1.52E-01, 1.48E-01, 1.44E-01, 1.40E-01, 1.36E-01, 1.32E-01, 1.28E-01, 1.24E-01, 1.21E-01, 1.17E-01, 1.14E-01, 1.11E-01, 1.08E-01, 1.05E-01, 1.02E-01, 9.87E-02, 9.58E-02, 9.31E-02, 9.06E-02, 8.79E-02, 8.54E-02, 8.28E-02, 8.07E-02, 7.84E-02, 7.62E-02, 7.42E-02, 7.20E-02, 7.01E-02, 6.81E-02, 6.61E-02, 6.41E-02, 6.24E-02, 6.06E-02, 5.90E-02, 5.73E-02])
-            dpdd = dpdd / np.max(dpdd) * 100
-            ax5.plot(xpdd, dpdd, markersize=2, label='Tank')
-
-            ax5.set_xlim([0, 30.0])
-            ax5.set_ylim([0, 110])
-            ax5.set_title("PDD")
-            ax5.set_xlabel("Depth [cm]")
-            ax5.set_ylabel("Relative Value [%]")
-            # x0, x1 = ax5.get_xlim()
-            # y0, y1 = ax5.get_ylim()
-            # ax5.set_aspect(abs(x1-x0)/abs(y1-y0))
-            ax5.legend()
-
-        plot_fluence()
-        # plot_terma()
-        plot_dose()
-        # plot_10x10_profiles()
-        # plot_10x10_pdd()
-        plot_30x30_profiles()
-        # plot_cax()
-        plt.show()
\ No newline at end of file
@@ -1,274 +1,285 @@
 import numpy as np
-from tqdm import tqdm
 cimport cython
 cimport numpy as cnp
-from libc.math cimport sin, cos, ceil, floor
-from libc.stdio cimport sprintf, printf, puts, fflush, stdout
-from libc.stdlib cimport malloc
-from conehead.dda_3d_c cimport dda_3d_c, result
-from conehead.vector cimport (
-    vector, vector_init, vector_append, vector_get, vector_set, vector_free,
-    vector_size
-)
+cimport openmp
+from cython.parallel cimport prange, threadid
+from libc.math cimport floor, INFINITY
+from .cpu import SCATTER_GRID_MEMORY
+
 
 @cython.boundscheck(False)  # Deactivate bounds checking
 @cython.wraparound(False)   # Deactivate negative indexing.
-@cython.cdivision(True)
-def convolve_c(cnp.float64_t[:,:,:] dose_grid_terma,
-               cnp.float64_t[:,:,:] dose_grid_dose,
-               cnp.float64_t[:] dose_grid_dim, cnp.float64_t[:] thetas,
-               cnp.float64_t[:] phis, kernel):
+def convolve_c(dose_grid_terma, dose_grid_dose, dose_grid_dim, thetas, phis,
+               kernel, active_voxels=None, kernel_cutoffs=None,
+               dose_grid_densities=None):
     """ Calculate 3D grid of doses by convolving a cumulative energy deposition
     kernel with a 3D grid of TERMA values.
 
+    Cone lines are cast as in cpu_dose, from each active voxel. The active
+    voxels are shared between OpenMP threads, which run without the GIL. Each thread traverses cone
+    lines into its own preallocated buffers and scatters into its own
+    float32 copy of the dose grid, and the copies are summed at the end, so
+    nothing is allocated per voxel or per cone. As in cpu_dose, the copies
+    are bounded by SCATTER_GRID_MEMORY, so on large grids fewer threads
+    run.
+
     Parameters
     ----------
-    dose_grid_terma : ndarray (memoryview)
+    dose_grid_terma : ndarray
         Grid of Terma values (n_dim = 3)
-    dose_grid_dose : ndarray (memoryview)
+    dose_grid_dose : ndarray
         Grid of dose values (n_dim = 3). Calculated doses are added directly
         to this array.
-    dose_grid_dim : ndarray (memoryview)
+    dose_grid_dim : ndarray
         Voxel dimensions, in form [dim_x, dim_y, dim_z]
-    thetas : ndarray (memoryview)
-        Azimuthal kernel cone angles (n_dim = 1)
-    phis : ndarray (memoryview)
-        Altitudinal kernel cone angles (n_dim = 1)
-    kernel : dict
-        Dictionary holding cumulative kernel data
+    thetas : ndarray
+        Azimuthal kernel cone angles, in degrees (n_dim = 1)
+    phis : ndarray
+        Altitudinal kernel cone angles, in degrees (n_dim = 1)
+    kernel : ndarray
+        Cumulative kernel of each altitudinal cone angle, sampled every
+        0.1 mm from 0.05 cm, shape (len(phis), num_samples)
+    active_voxels : ndarray, optional
+        Index of each voxel to convolve, shape (num_active, 3). Defaults to
+        every voxel with non-zero TERMA.
+    kernel_cutoffs : ndarray, optional
+        Last kernel index deposited along each altitudinal cone angle (see
+        truncated_kernel). Defaults to the end of the kernel.
+    dose_grid_densities : ndarray, optional
+        Density of each voxel. When given, the kernel is looked up at the
+        density weighted distance along each cone line, summed while its
+        voxels are stepped through, rather than at the geometric distance.
     """
-    cdef cnp.int32_t xlen = dose_grid_terma.shape[0]
-    cdef cnp.int32_t ylen = dose_grid_terma.shape[1]
-    cdef cnp.int32_t zlen = dose_grid_terma.shape[2]
-    cdef cnp.int32_t dose_grid_shape[3]
-    dose_grid_shape = [
-        xlen, ylen, zlen
-    ]
-    cdef cnp.float64_t T, N, N_inv, theta_rad, phi_rad, c_t, s_t, c_p, s_p
-    cdef cnp.float64_t pi = 3.14159265359
-    cdef cnp.int32_t num_thetas = thetas.shape[0]
-    cdef cnp.int32_t num_phis = phis.shape[0]
-    cdef cnp.int32_t x, y, z, i, j, m
-    cdef cnp.int32_t current_voxel[3]
-    cdef cnp.float64_t direction[3]
-    cdef cnp.float64_t dimensions[3]
-    dimensions = [
-        dose_grid_dim[0],
-        dose_grid_dim[1],
-        dose_grid_dim[2]
-    ]
-    cdef result r
-    cdef result* r_ptr = &r
-    cdef cnp.float64_t intersection
-    cdef cnp.int32_t intersection_index
-    cdef vector intersection_indices
-    cdef char key[10]
-    cdef vector kernel_data
-    vector_init(&kernel_data)
-    process_kernel(kernel, phis, &kernel_data)
-    cdef vector* current_cone_kernel_data
-    cdef cnp.int32_t* v
-    cdef cnp.float64_t* k1
-    cdef cnp.float64_t* k2
-    cdef cnp.float64_t k3
-    cdef cnp.int32_t index
-
-    # Iterate through all voxels
-    for x in tqdm(range(xlen)):
-        # printf("%d/%d...", x, xlen)  # Naive progress indicator
-        # fflush(stdout)
-        for y in range(ylen):
-            for z in range(zlen):
-
-                # Only convolve if the current voxel has non-zero TERMA
-                T = dose_grid_terma[x, y, z]
-                if T:
+    cdef cnp.float64_t[:, :, ::1] terma = np.ascontiguousarray(
+        dose_grid_terma, dtype=np.float64
+    )
+    if active_voxels is None:
+        active_voxels = np.argwhere(np.asarray(terma) != 0)
+    cdef cnp.int32_t[:, ::1] active = np.ascontiguousarray(
+        active_voxels, dtype=np.int32
+    ).reshape((-1, 3))
+    cdef cnp.float64_t[:, ::1] kernel_cum = np.ascontiguousarray(
+        kernel, dtype=np.float64
+    )
+    cdef cnp.float64_t[::1] dimensions = np.ascontiguousarray(
+        dose_grid_dim, dtype=np.float64
+    )
+    if kernel_cutoffs is None:
+        kernel_cutoffs = np.full(len(phis), kernel_cum.shape[1] - 1)
+    cdef cnp.int32_t[::1] cutoffs = np.ascontiguousarray(
+        kernel_cutoffs, dtype=np.int32
+    )
+    cdef bint radiological = dose_grid_densities is not None
+    if not radiological:
+        dose_grid_densities = np.zeros((1, 1, 1))
+    cdef cnp.float64_t[:, :, ::1] densities = np.ascontiguousarray(
+        dose_grid_densities, dtype=np.float64
+    )
+    cdef cnp.float64_t[:, ::1] directions = cone_directions(thetas, phis)
+    cdef cnp.int32_t num_phis = len(phis)
+    cdef cnp.int32_t grid_shape[3]
+    grid_shape[0] = terma.shape[0]
+    grid_shape[1] = terma.shape[1]
+    grid_shape[2] = terma.shape[2]
+    cdef cnp.int32_t num_threads = max(1, min(
+        openmp.omp_get_max_threads(),
+        SCATTER_GRID_MEMORY // (4 * grid_shape[0] * grid_shape[1] * grid_shape[2])
+    ))
 
-                    # Iterate through each cone
-                    for i in range(num_thetas):
-                        for j in range(num_phis):
+    # Per-thread dose grids and traversal buffers. A cone line never visits
+    # more voxels than the sum of the grid dimensions.
+    max_array_length = grid_shape[0] + grid_shape[1] + grid_shape[2]
+    cdef cnp.float32_t[:, :, :, ::1] partial = np.zeros(
+        (num_threads, grid_shape[0], grid_shape[1], grid_shape[2]),
+        dtype=np.float32
+    )
+    cdef cnp.int32_t[:, :, ::1] voxels_traversed = np.empty(
+        (num_threads, max_array_length, 3), dtype=np.int32
+    )
+    cdef cnp.float64_t[:, ::1] intersection_t_values = np.empty(
+        (num_threads, max_array_length), dtype=np.float64
+    )
 
-                            # Save current voxel index for later
-                            current_voxel = [x, y, z]
+    cdef cnp.int32_t x, y, z, c, m, n, count, thread, index1, index2
+    cdef cnp.int32_t last_index
+    cdef cnp.float64_t T, k3, r, t_previous, max_t
 
-                            # Calculate direction vector
-                            theta_rad = thetas[i] * pi / 180.0
-                            phi_rad = phis[j] * pi / 180.0
-                            c_t = cos(theta_rad)
-                            s_t = sin(theta_rad)
-                            c_p = cos(phi_rad)
-                            s_p = sin(phi_rad)
-                            direction = [c_t * s_p, s_t * s_p, c_p]
-                            N = (
-                                direction[0] * direction[0] +
-                                direction[1] * direction[1] +
-                                direction[2] * direction[2]
-                            )
-                            N_inv = 1.0 / N
-                            direction = [  # Normalise
-                                direction[0] * N_inv,
-                                direction[1] * N_inv,
-                                direction[2] * N_inv
-                            ]
-                            direction = [  # Discretise
-                                ceil(direction[0] * 100000) * 0.00001,
-                                ceil(direction[1] * 100000) * 0.00001,
-                                ceil(direction[2] * 100000) * 0.00001
-                            ]
+    for n in prange(active.shape[0], nogil=True, schedule='dynamic',
+                    num_threads=num_threads):
+        thread = threadid()
+        x = active[n, 0]
+        y = active[n, 1]
+        z = active[n, 2]
+        T = terma[x, y, z]
 
-                            # Perform raytracing to find voxels along cone line
-                            # and boundary intersection values
-                            vector_init(&r_ptr.intersection_t_values)
-                            vector_init(&r_ptr.voxels_traversed)
-                            dda_3d_c(
-                                direction,
-                                dose_grid_shape,
-                                current_voxel,
-                                dimensions,
-                                &r
-                            )
+        for c in range(directions.shape[0]):
 
-                            # Calculate which indices in kernel data array will
-                            # correspond to boundary intersection values
-                            vector_init(&intersection_indices)
-                            for m in range(r.intersection_t_values.size):
-                                intersection = (<cnp.float64_t*>vector_get(
-                                    &r.intersection_t_values, m
-                                ))[0]
-                                intersection_index = <cnp.int32_t>floor(
-                                    intersection * 100.0 - 50.0
-                                )
-                                intersection_index = abs(intersection_index)
+            # Perform raytracing to find voxels along cone line
+            # and boundary intersection values, up to the cone's cutoff.
+            # A radiological cutoff can lie anywhere along the line.
+            last_index = cutoffs[c % num_phis]
+            if radiological:
+                max_t = INFINITY
+            else:
+                max_t = (last_index + 6) / 100.0
+            count = _dda_3d(
+                &directions[c, 0],
+                grid_shape,
+                x, y, z,
+                &dimensions[0],
+                max_t,
+                &voxels_traversed[thread, 0, 0],
+                &intersection_t_values[thread, 0]
+            )
 
-                                # Handle if ray larger than kernel data
-                                if intersection_index > 5995:
-                                    continue
+            # Deposit the difference in cumulative kernel across the
+            # traverse of each voxel
+            index2 = 0
+            r = 0.0
+            t_previous = 0.0
+            for m in range(count):
+                if radiological:
+                    r = r + densities[
+                        voxels_traversed[thread, m, 0],
+                        voxels_traversed[thread, m, 1],
+                        voxels_traversed[thread, m, 2]
+                    ] * (intersection_t_values[thread, m] - t_previous)
+                    t_previous = intersection_t_values[thread, m]
+                else:
+                    r = intersection_t_values[thread, m]
+                index1 = <cnp.int32_t>floor(r * 100.0 - 5.0)
+                if index1 < 0:
+                    index1 = -index1
+                if index1 > last_index:
+                    index1 = last_index
+                if m == 0:
+                    k3 = kernel_cum[c % num_phis, index1]
+                else:
+                    k3 = (kernel_cum[c % num_phis, index1] -
+                          kernel_cum[c % num_phis, index2])
+                index2 = index1
+                partial[
+                    thread,
+                    voxels_traversed[thread, m, 0],
+                    voxels_traversed[thread, m, 1],
+                    voxels_traversed[thread, m, 2]
+                ] += <cnp.float32_t>(T * k3)
+                if index1 == last_index:
+                    break
 
-                                vector_append(
-                                    &intersection_indices,
-                                    copy_i(&intersection_index)
-                                )
+    # Sum the per-thread dose grids
+    cdef cnp.int32_t t
+    for x in prange(grid_shape[0], nogil=True, num_threads=num_threads):
+        for t in range(1, num_threads):
+            for y in range(grid_shape[1]):
+                for z in range(grid_shape[2]):
+                    partial[0, x, y, z] += partial[t, x, y, z]
+    dose_grid_dose += np.asarray(partial[0]).astype(dose_grid_dose.dtype)
 
-                            # Find corresponding kernel data value for each
-                            # voxel intersected by cone line
-                            current_cone_kernel_data = <vector*>vector_get(
-                                &kernel_data, j
-                            )
-                            for m in range(intersection_indices.size):
-                                v = <cnp.int32_t*>vector_get(
-                                    &r.voxels_traversed, m
-                                )
-                                if m == 0:
-                                    # First voxel, get appropriate kernal index
-                                    # of and corresponding kernel value
-                                    # (single intersection)
-                                    index1 = (<cnp.int32_t*>vector_get(
-                                        &intersection_indices, m
-                                    ))[0]
-                                    k3 = (<cnp.float64_t*>vector_get(
-                                        current_cone_kernel_data, index1
-                                    ))[0]
-                                else:
-                                    # For al other voxels, get the diffeence
-                                    # between cumulative kernal data across the
-                                    # traverse of the voxel
-                                    # (double intersection)
-                                    # printf("got m = %d", m)
-                                    index1 = (<cnp.int32_t*>vector_get(
-                                        &intersection_indices, m
-                                    ))[0]
-                                    k1 = <cnp.float64_t*>vector_get(
-                                        current_cone_kernel_data, index1
-                                    )
-                                    # printf("got index1 = %d", index1)
-                                    index2 = (<cnp.int32_t*>vector_get(
-                                        &intersection_indices, m - 1
-                                    ))[0]
-                                    k2 = <cnp.float64_t*>vector_get(
-                                        current_cone_kernel_data, index2
-                                    )
-                                    k3 = k1[0] - k2[0]
 
-                                dose_grid_dose[v[0], v[1], v[2]] += T * k3
-
-                            # Free memory in all arrays
-                            vector_free(&r.intersection_t_values)
-                            vector_free(&r.voxels_traversed)
-                            vector_free(&intersection_indices)
-
-
-cdef cnp.int32_t* copy_i(cnp.int32_t* i) nogil:
-    """ Copy an index.
+def cone_directions(thetas, phis):
+    """ Unit direction vector of every cone line.
 
     Parameters
     ----------
-    i : cnp.int32_t*
-        Pointer to the index to copy
+    thetas : ndarray
+        Azimuthal kernel cone angles, in degrees (n_dim = 1)
+    phis : ndarray
+        Altitudinal kernel cone angles, in degrees (n_dim = 1)
 
     Returns
     -------
-    cnp.int32_t*
-        Pointer to the newly created copy
+    ndarray
+        Directions, shape (len(thetas) * len(phis), 3), with the altitudinal
+        angle varying fastest. The primary photon direction is +y.
     """
-    cdef cnp.int32_t* new_i = <cnp.int32_t*>malloc(sizeof(cnp.int32_t))
-    new_i[0] = i[0]
-    return new_i
+    theta_rad, phi_rad = np.meshgrid(
+        np.radians(np.asarray(thetas, dtype=np.float64)),
+        np.radians(np.asarray(phis, dtype=np.float64)),
+        indexing='ij'
+    )
+    directions = np.stack((
+        np.cos(theta_rad) * np.sin(phi_rad),
+        np.cos(phi_rad),
+        np.sin(theta_rad) * np.sin(phi_rad)
+    ), axis=-1).reshape((-1, 3))
+    directions /= np.linalg.norm(directions, axis=1)[:, None]
+    return np.ascontiguousarray(directions)
 
 
-cdef cnp.float64_t* copy_f(cnp.float64_t* f) nogil:
-    """ Copy a float.
+@cython.boundscheck(False)
+@cython.wraparound(False)
+@cython.cdivision(True)
+cdef cnp.int32_t _dda_3d(cnp.float64_t* direction, cnp.int32_t* grid_shape,
+                        cnp.int32_t x, cnp.int32_t y, cnp.int32_t z,
+                        cnp.float64_t* voxel_size,
+                        cnp.float64_t max_t,
+                        cnp.int32_t* voxels_traversed,
+                        cnp.float64_t* intersection_t_values) noexcept nogil:
+    """ Calculate the intersection points of a ray with a voxel grid, using a
+    3D DDA algorithm. See Amanatides & Woo (1987) Eurographics 87(3).
 
     Parameters
     ----------
-    f : cnp.float64_t*
-        Pointer to the float to copy
+    direction : cnp.float64_t*
+        Direction vector of the ray, in form [dx, dy, dz]
+    grid_shape : cnp.int32_t*
+        Shape of 3D voxel grid, in form [len(x), len(y), len(z)]
+    x, y, z : cnp.int32_t
+        Index of ray source voxel
+    voxel_size : cnp.float64_t*
+        Size of voxel dimensions, in form [dim_x, dim_y, dim_z]
+    max_t : cnp.float64_t
+        Distance beyond which the ray is not traced further. The voxel the
+        ray leaves at or past this distance is the last one recorded.
+    voxels_traversed : cnp.int32_t*
+        Buffer receiving the index of each traversed voxel, three values per
+        voxel
+    intersection_t_values : cnp.float64_t*
+        Buffer receiving the distance at which the ray leaves each voxel
 
     Returns
     -------
-    cnp.float64_t*
-        Pointer to the newly created copy
+    cnp.int32_t
+        Number of voxels traversed
     """
-    cdef cnp.float64_t* new_f = <cnp.float64_t*>malloc(sizeof(cnp.float64_t))
-    new_f[0] = f[0]
-    return new_f
-
-
-cdef void process_kernel(kernel, phis, vector* kernel_data):
-    """ Convert kernel data from python dictionary to vector.
-
-    Parameters
-    ----------
-    kernel : dict
-        Dictionary of kernel data
-    phis : ndarray (memoryview)
-        Altitudinal kernel cone angles (n_dim = 1)
-    kernel_data : vector*
-        Pointer to vector that will hold the converted data
-    """
-    cdef vector* single_cone_data
-
-    for phi in phis:
-        single_cone_data = <vector*>malloc(sizeof(vector))
-        vector_init(single_cone_data)
-        get_single_cone_data(kernel, phi, single_cone_data)
-        vector_append(kernel_data, single_cone_data)
+    cdef cnp.int32_t step[3]
+    cdef cnp.int32_t current_voxel[3]
+    cdef cnp.float64_t t[3]
+    cdef cnp.float64_t delta_t[3]
+    cdef cnp.float64_t big_number = 1000000000
+    cdef cnp.float64_t d
+    cdef cnp.int32_t a, count = 0
 
+    current_voxel[0] = x
+    current_voxel[1] = y
+    current_voxel[2] = z
+    for a in range(3):
+        step[a] = -1 if direction[a] < 0 else 1
+        d = -direction[a] if direction[a] < 0 else direction[a]
+        if d == 0.0:
+            t[a] = big_number
+            delta_t[a] = big_number
+        else:
+            t[a] = (voxel_size[a] / 2) / d
+            delta_t[a] = voxel_size[a] / d
 
-cdef void get_single_cone_data(kernel, phi, vector* v):
-    """ Fill a vector with kernel data from a single cone line..
+    while (current_voxel[0] >= 0 and current_voxel[0] < grid_shape[0] and
+           current_voxel[1] >= 0 and current_voxel[1] < grid_shape[1] and
+           current_voxel[2] >= 0 and current_voxel[2] < grid_shape[2]):
 
-    Parameters
-    ----------
-    kernel : dict
-        Dictionary of kernel data
-    phi : cnp.float64_t
-        Altitudinal angle of cone
-    v : vector*
-        Pointer to vector that will hold the converted data
-    """
-    cdef cnp.int32_t N = len(kernel.cumulative["{:.2f}".format(phi)])
-    cdef cnp.float64_t value
+        voxels_traversed[3 * count] = current_voxel[0]
+        voxels_traversed[3 * count + 1] = current_voxel[1]
+        voxels_traversed[3 * count + 2] = current_voxel[2]
+        if t[0] < t[1]:
+            a = 0 if t[0] < t[2] else 2
+        else:
+            a = 1 if t[1] < t[2] else 2
+        intersection_t_values[count] = t[a]
+        count += 1
+        if t[a] >= max_t:
+            break
+        t[a] += delta_t[a]
+        current_voxel[a] += step[a]
 
-    for n in range(N):
-        value = kernel.cumulative["{:.2f}".format(phi)][n]
-        vector_append(v, copy_f(&value))
+    return count
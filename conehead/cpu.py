@@ -0,0 +1,546 @@
+import numpy as np
+import numba
+import math
+
+
+# CPU counterparts of the CUDA kernels in conehead.py. Each kernel takes the
+# same arguments as its CUDA twin and parallelises over the first dose grid
+# axis with prange, so the two backends can be swapped stage by stage.
+
+
+# Bound on the memory of the per-thread dose grids that the scatter engines
+# use in place of atomics, in bytes
+SCATTER_GRID_MEMORY = 512 * 2 ** 20
+
+
+@numba.njit(inline='always')
+def cpu_dot(a, b):
+    return a[0] * b[0] + a[1] * b[1] + a[2] * b[2]
+
+
+@numba.njit
+def cpu_line_block_plane_collision(pos_plane, ray_start, ray_direction, plane_normal, epsilon):
+
+    ndotu = cpu_dot(plane_normal, ray_direction)
+    if abs(ndotu) < epsilon:
+        raise RuntimeError("no intersection or line is within plane")
+
+    # Plane point is the isocentre, so w is just the ray start
+    si = -cpu_dot(plane_normal, ray_start) / ndotu
+    pos_plane[0] = ray_start[0] + si * ray_direction[0]
+    pos_plane[1] = ray_start[1] + si * ray_direction[1]
+    pos_plane[2] = ray_start[2] + si * ray_direction[2]
+
+    return pos_plane
+
+
+@numba.njit
+def cpu_block_transmission(position_x, position_y, block_values):
+
+    position_x = math.floor(position_x * 100) + 2000  # Convert tenth of a mm
+    position_y = math.floor(position_y * 100) + 2000
+
+    # Handle position lying outside the defined blocking area
+    if position_x < 0 or position_x > block_values.shape[0] - 1:
+        return 0.0
+    if position_y < 0 or position_y > block_values.shape[1] - 1:
+        return 0.0
+
+    return block_values[int(position_x) - 1, int(position_y) - 1]
+
+
+@numba.njit(parallel=True)
+def cpu_hit_test(dose_grid_blocked, dose_grid_size, dose_grid_origin, dose_grid_spacing, source_position, source_v_y, source_transform, block_values, samples):
+
+    offset = dose_grid_spacing / samples
+
+    for x in numba.prange(dose_grid_size[0]):
+
+        ray_direction = np.empty(3, dtype=np.float64)
+        pos_plane = np.empty(3, dtype=np.float64)
+
+        for y in range(dose_grid_size[1]):
+            for z in range(dose_grid_size[2]):
+                dose_grid_blocked[x, y, z] = cpu_voxel_transmission(
+                    x, y, z, dose_grid_origin, dose_grid_spacing, offset,
+                    source_position, source_v_y, source_transform,
+                    block_values, samples, ray_direction, pos_plane
+                )
+
+
+@numba.njit(inline='always')
+def cpu_voxel_transmission(x, y, z, dose_grid_origin, dose_grid_spacing, offset, source_position, source_v_y, source_transform, block_values, samples, ray_direction, pos_plane):
+
+    # Mean block transmission over samples**3 points of a voxel, with
+    # ray_direction and pos_plane as work buffers
+    position_x = dose_grid_origin[0] + dose_grid_spacing[0] * x
+    position_y = dose_grid_origin[1] + dose_grid_spacing[1] * y
+    position_z = dose_grid_origin[2] + dose_grid_spacing[2] * z
+
+    block_factor = 0.0
+    for ix in range(samples):
+        for iy in range(samples):
+            for iz in range(samples):
+
+                # Position of sample, as a ray towards the source
+                ray_direction[0] = source_position[0] - (position_x - dose_grid_spacing[0]/2 + offset[0]/2 + offset[0] * ix)
+                ray_direction[1] = source_position[1] - (position_y - dose_grid_spacing[1]/2 + offset[1]/2 + offset[1] * iy)
+                ray_direction[2] = source_position[2] - (position_z - dose_grid_spacing[2]/2 + offset[2]/2 + offset[2] * iz)
+
+                # Determine position on blocking plane in global coords
+                cpu_line_block_plane_collision(pos_plane, source_position, ray_direction, source_v_y, 1e-6)
+
+                # Convert to source coords and reduce to 2D
+                block_factor += cpu_block_transmission(
+                    cpu_dot(source_transform[0, :], pos_plane),
+                    cpu_dot(source_transform[2, :], pos_plane),
+                    block_values
+                ) / samples**3
+
+    return block_factor
+
+
+@numba.njit
+def cpu_dda_3d(current_voxel, direction, dose_grid_spacing, dose_grid_size, voxels_traversed, intersection_t_values):
+
+    step = np.empty(3, dtype=np.int32)
+    t = np.empty(3, dtype=np.float64)
+    delta_t = np.empty(3, dtype=np.float64)
+    big_number = 1000000000.0
+
+    for a in range(3):
+        step[a] = -1 if direction[a] < 0 else 1
+        if direction[a] < 0:
+            direction[a] = -1 * direction[a]
+        if direction[a] == 0.0:
+            t[a] = big_number
+            delta_t[a] = big_number
+        else:
+            t[a] = (dose_grid_spacing[a] / 2) / direction[a]
+            delta_t[a] = dose_grid_spacing[a] / direction[a]
+
+    xmax = dose_grid_size[0]
+    ymax = dose_grid_size[1]
+    zmax = dose_grid_size[2]
+
+    count = 0
+    while (current_voxel[0] >= 0 and current_voxel[0] < xmax and
+           current_voxel[1] >= 0 and current_voxel[1] < ymax and
+           current_voxel[2] >= 0 and current_voxel[2] < zmax):
+
+        voxels_traversed[count, 0] = current_voxel[0]
+        voxels_traversed[count, 1] = current_voxel[1]
+        voxels_traversed[count, 2] = current_voxel[2]
+        if t[0] < t[1]:
+            a = 0 if t[0] < t[2] else 2
+        else:
+            a = 1 if t[1] < t[2] else 2
+        intersection_t_values[count] = t[a]
+        t[a] += delta_t[a]
+        current_voxel[a] += step[a]
+        count += 1
+
+    return (count, count)
+
+
+@numba.njit(inline='always')
+def cpu_dda_init(direction, dose_grid_spacing, step, t, delta_t):
+
+    # Step along each axis, and distances from the voxel centre to the first
+    # boundary and between boundaries
+    for a in range(3):
+        step[a] = -1 if direction[a] < 0 else 1
+        d = abs(direction[a])
+        if d == 0.0:
+            t[a] = 1000000000.0
+            delta_t[a] = 1000000000.0
+        else:
+            t[a] = (dose_grid_spacing[a] / 2) / d
+            delta_t[a] = dose_grid_spacing[a] / d
+
+
+@numba.njit(inline='always')
+def cpu_dda_axis(t):
+
+    # Axis of the next boundary crossed
+    if t[0] < t[1]:
+        return 0 if t[0] < t[2] else 2
+    return 1 if t[1] < t[2] else 2
+
+
+@numba.njit(inline='always')
+def cpu_dda_inside(voxel, dose_grid_size):
+    return (
+        voxel[0] >= 0 and voxel[0] < dose_grid_size[0] and
+        voxel[1] >= 0 and voxel[1] < dose_grid_size[1] and
+        voxel[2] >= 0 and voxel[2] < dose_grid_size[2]
+    )
+
+
+@numba.njit(inline='always')
+def cpu_attenuation(attenuation, attenuation_step, depth):
+
+    # Linear interpolation of the attenuation table (see terma.py), clamped
+    # at both ends
+    position = depth / attenuation_step
+    if position <= 0:
+        return attenuation[0]
+    index = int(position)
+    if index >= len(attenuation) - 1:
+        return attenuation[len(attenuation) - 1]
+    fraction = position - index
+    return attenuation[index] + fraction * (attenuation[index + 1] - attenuation[index])
+
+
+@numba.njit(parallel=True)
+def cpu_d_eff(dose_grid_size, dose_grid_origin, dose_grid_spacing, dose_grid_densities, source_position, d_eff):
+
+    for x in numba.prange(dose_grid_size[0]):
+
+        step = np.empty(3, dtype=np.int32)
+        t = np.empty(3, dtype=np.float64)
+        delta_t = np.empty(3, dtype=np.float64)
+        current_voxel = np.empty(3, dtype=np.int32)
+        ray_direction = np.empty(3, dtype=np.float64)
+
+        for y in range(dose_grid_size[1]):
+            for z in range(dose_grid_size[2]):
+                d_eff[x, y, z] = cpu_voxel_d_eff(
+                    x, y, z, dose_grid_size, dose_grid_origin,
+                    dose_grid_spacing, dose_grid_densities, source_position,
+                    step, t, delta_t, current_voxel, ray_direction
+                )
+
+
+@numba.njit(inline='always')
+def cpu_voxel_d_eff(x, y, z, dose_grid_size, dose_grid_origin, dose_grid_spacing, dose_grid_densities, source_position, step, t, delta_t, current_voxel, ray_direction):
+
+    current_voxel[0] = x
+    current_voxel[1] = y
+    current_voxel[2] = z
+
+    # Determine direction to source
+    ray_direction[0] = source_position[0] - (dose_grid_origin[0] + dose_grid_spacing[0] * x)
+    ray_direction[1] = source_position[1] - (dose_grid_origin[1] + dose_grid_spacing[1] * y)
+    ray_direction[2] = source_position[2] - (dose_grid_origin[2] + dose_grid_spacing[2] * z)
+    mag = math.sqrt(cpu_dot(ray_direction, ray_direction))
+    ray_direction[0] /= mag
+    ray_direction[1] /= mag
+    ray_direction[2] /= mag
+
+    # Accumulate density times path length while stepping through the
+    # voxels towards the source
+    cpu_dda_init(ray_direction, dose_grid_spacing, step, t, delta_t)
+    depth = 0.0
+    t_previous = 0.0
+    while cpu_dda_inside(current_voxel, dose_grid_size):
+        a = cpu_dda_axis(t)
+        depth += dose_grid_densities[current_voxel[0], current_voxel[1], current_voxel[2]] * (t[a] - t_previous)
+        t_previous = t[a]
+        t[a] += delta_t[a]
+        current_voxel[a] += step[a]
+    return depth
+
+
+@numba.njit(parallel=True)
+def cpu_oad(dose_grid_oad, dose_grid_size, dose_grid_origin, dose_grid_spacing, source_position, source_sad, source_transform, source_v_y):
+
+    for x in numba.prange(dose_grid_size[0]):
+
+        distance = np.empty(3, dtype=np.float64)
+        pos_plane = np.empty(3, dtype=np.float64)
+
+        for y in range(dose_grid_size[1]):
+            for z in range(dose_grid_size[2]):
+
+                # Determine distance/direction to source
+                distance[0] = source_position[0] - (dose_grid_origin[0] + dose_grid_spacing[0] * x)
+                distance[1] = source_position[1] - (dose_grid_origin[1] + dose_grid_spacing[1] * y)
+                distance[2] = source_position[2] - (dose_grid_origin[2] + dose_grid_spacing[2] * z)
+
+                # Project position to iso plane and convert to source coords
+                cpu_line_block_plane_collision(pos_plane, source_position, distance, source_v_y, 1e-6)
+                pos_source_x = cpu_dot(source_transform[0, :], pos_plane)
+                pos_source_z = cpu_dot(source_transform[2, :], pos_plane)
+                dose_grid_oad[x, y, z] = math.sqrt(pos_source_x * pos_source_x + pos_source_z * pos_source_z)
+
+
+@numba.njit(inline='always')
+def cpu_fluence_model(mag, oad, source_sad, sPri, zAnn, sAnn, rInner, rOuter, zExp, sExp, kExp):
+
+    # Point source
+    fluence_point = sPri * math.pow(source_sad / mag, 2)
+
+    # Annular source
+    r_ann = oad * zAnn / source_sad
+    if r_ann >= rInner and r_ann <= rOuter:
+        fluence_ann = sAnn * math.pow(source_sad - zAnn, 2) / math.pow(mag - zAnn, 2)
+    else:
+        fluence_ann = 0.0
+
+    # Exponential source
+    oad = 2.0 if oad < 2.0 else oad  # Avoid function blowing up near zero
+    r_exp = oad * zExp / source_sad
+    fluence_exp = sExp / r_exp * math.exp(-kExp * r_exp) * math.pow(source_sad - zExp, 2) / math.pow(mag - zExp, 2)
+
+    return fluence_point + fluence_ann + fluence_exp
+
+
+@numba.njit(parallel=True)
+def cpu_fluence(dose_grid_fluence, dose_grid_oad, dose_grid_blocked, dose_grid_size, dose_grid_origin, dose_grid_spacing, source_position, source_sad, sPri, zAnn, sAnn, rInner, rOuter, zExp, sExp, kExp):
+
+    for x in numba.prange(dose_grid_size[0]):
+        for y in range(dose_grid_size[1]):
+            for z in range(dose_grid_size[2]):
+
+                # Determine distance to source
+                dx = source_position[0] - (dose_grid_origin[0] + dose_grid_spacing[0] * x)
+                dy = source_position[1] - (dose_grid_origin[1] + dose_grid_spacing[1] * y)
+                dz = source_position[2] - (dose_grid_origin[2] + dose_grid_spacing[2] * z)
+                mag = math.sqrt(dx * dx + dy * dy + dz * dz)
+
+                dose_grid_fluence[x, y, z] = cpu_fluence_model(
+                    mag, dose_grid_oad[x, y, z], source_sad, sPri, zAnn, sAnn,
+                    rInner, rOuter, zExp, sExp, kExp
+                ) * dose_grid_blocked[x, y, z]
+
+
+@numba.njit(parallel=True)
+def cpu_terma(dose_grid_terma, dose_grid_blocked, dose_grid_fluence, dose_grid_d_eff, dose_grid_size, attenuation, attenuation_step, f_soften, f_horn):
+
+    for x in numba.prange(dose_grid_size[0]):
+        for y in range(dose_grid_size[1]):
+            for z in range(dose_grid_size[2]):
+
+                terma = cpu_attenuation(
+                    attenuation, attenuation_step,
+                    f_soften[x, y, z] * dose_grid_d_eff[x, y, z]
+                ) * dose_grid_fluence[x, y, z] * f_horn[x, y, z]
+
+                dose_grid_terma[x, y, z] = terma * dose_grid_blocked[x, y, z]
+
+
+@numba.njit(parallel=True)
+def cpu_fused_terma(dose_grid_terma, dose_grid_blocked, dose_grid_d_eff, dose_grid_size, dose_grid_origin, dose_grid_spacing, source_position, source_sad, source_transform, source_v_y, sPri, zAnn, sAnn, rInner, rOuter, zExp, sExp, kExp, softRatio, softLimit, hornRatio, attenuation, attenuation_step):
+
+    # cpu_oad, cpu_fluence, the softening and horn factors and cpu_terma in
+    # a single pass, which keeps each voxel's intermediates in registers
+    for x in numba.prange(dose_grid_size[0]):
+
+        distance = np.empty(3, dtype=np.float64)
+        pos_plane = np.empty(3, dtype=np.float64)
+
+        for y in range(dose_grid_size[1]):
+            for z in range(dose_grid_size[2]):
+
+                blocked = dose_grid_blocked[x, y, z]
+                if blocked == 0:
+                    dose_grid_terma[x, y, z] = 0.0
+                    continue
+
+                dose_grid_terma[x, y, z] = cpu_voxel_terma(
+                    x, y, z, blocked, dose_grid_d_eff[x, y, z],
+                    dose_grid_origin, dose_grid_spacing, source_position,
+                    source_sad, source_transform, source_v_y, sPri, zAnn,
+                    sAnn, rInner, rOuter, zExp, sExp, kExp, softRatio,
+                    softLimit, hornRatio, attenuation, attenuation_step,
+                    distance, pos_plane
+                )
+
+
+@numba.njit(inline='always')
+def cpu_voxel_terma(x, y, z, blocked, d_eff, dose_grid_origin, dose_grid_spacing, source_position, source_sad, source_transform, source_v_y, sPri, zAnn, sAnn, rInner, rOuter, zExp, sExp, kExp, softRatio, softLimit, hornRatio, attenuation, attenuation_step, distance, pos_plane):
+
+    # Determine distance/direction to source
+    distance[0] = source_position[0] - (dose_grid_origin[0] + dose_grid_spacing[0] * x)
+    distance[1] = source_position[1] - (dose_grid_origin[1] + dose_grid_spacing[1] * y)
+    distance[2] = source_position[2] - (dose_grid_origin[2] + dose_grid_spacing[2] * z)
+    mag = math.sqrt(cpu_dot(distance, distance))
+
+    # Off-axis distance, on the iso plane in source coords
+    cpu_line_block_plane_collision(pos_plane, source_position, distance, source_v_y, 1e-6)
+    pos_source_x = cpu_dot(source_transform[0, :], pos_plane)
+    pos_source_z = cpu_dot(source_transform[2, :], pos_plane)
+    oad = math.sqrt(pos_source_x * pos_source_x + pos_source_z * pos_source_z)
+
+    fluence = cpu_fluence_model(
+        mag, oad, source_sad, sPri, zAnn, sAnn, rInner, rOuter, zExp, sExp,
+        kExp
+    ) * blocked
+    f_soften = 1.0 / (1.0 - softRatio * oad) if oad < softLimit else 1.0
+    f_horn = 1.0 + oad * hornRatio
+
+    terma = cpu_attenuation(attenuation, attenuation_step, f_soften * d_eff)
+
+    return terma * fluence * f_horn * blocked
+
+
+# Multi-channel kernels.
+#
+# Splitting the dose into parts (e.g. primary and scatter, or one part per
+# energy bin) needs one kernel per part, and casting the cone lines once per
+# kernel would repeat all of the ray tracing. So cpu_dose and cuda_dose take
+# a stacked kernel, shape (num_channels, num_cones, num_samples), and a
+# stacked TERMA, shape (num_channels, x, y, z), and deposit every channel
+# into its own dose grid while each cone line is traced once. A TERMA with a
+# single channel is shared by all kernel channels. Extra channels only cost
+# kernel lookups and dose writes. The cutoff of each cone line is the last
+# cutoff over the channels; the truncated kernels are flat beyond their own.
+
+
+@numba.njit
+def cpu_scatter_chunks(grid_bytes):
+
+    # Number of per-thread dose grids: one per thread, as far as
+    # SCATTER_GRID_MEMORY allows. On large grids fewer threads scatter, so
+    # memory does not grow with the number of cores (the gather engine
+    # needs no grid copies at all).
+    return max(1, min(numba.get_num_threads(), SCATTER_GRID_MEMORY // grid_bytes))
+
+
+@numba.njit(parallel=True)
+def cpu_dose(dose_grid_dose, dose_grid_spacing, dose_grid_size, dose_grid_terma, active_voxels, voxel_bins, cone_directions, cone_rows, kernel, kernel_cutoffs, dose_grid_densities, radiological):
+
+    # There are no atomics on the CPU, so each thread scatters into its own
+    # copy of the dose grid and the copies are summed at the end. Only the
+    # active voxels (see active_voxels.py) are convolved, dealt out
+    # round-robin so each thread gets an even share of the work, with the
+    # number of grids bounded by cpu_scatter_chunks. Every
+    # channel of the stacked kernel is deposited during the same traversal
+    # (see the multi-channel note above). The cone directions are looked up
+    # in the table of the voxel's tilt bin (see tilting.py); a single bin
+    # is shared by all voxels.
+    num_channels = kernel.shape[0]
+    n_chunks = cpu_scatter_chunks(num_channels * dose_grid_size[0] * dose_grid_size[1] * dose_grid_size[2] * dose_grid_dose.itemsize)
+    partial = np.zeros((n_chunks, num_channels, dose_grid_size[0], dose_grid_size[1], dose_grid_size[2]), dtype=dose_grid_dose.dtype)
+
+    for c in numba.prange(n_chunks):
+
+        step = np.empty(3, dtype=np.int32)
+        t = np.empty(3, dtype=np.float64)
+        delta_t = np.empty(3, dtype=np.float64)
+        current_voxel = np.empty(3, dtype=np.int32)
+        direction = np.empty(3, dtype=np.float64)
+
+        for n in range(c, len(active_voxels), n_chunks):
+            x = active_voxels[n, 0]
+            y = active_voxels[n, 1]
+            z = active_voxels[n, 2]
+            b = voxel_bins[n if len(voxel_bins) > 1 else 0]
+
+            for k in range(cone_directions.shape[1]):
+
+                current_voxel[0] = x
+                current_voxel[1] = y
+                current_voxel[2] = z
+                direction[0] = cone_directions[b, k, 0]
+                direction[1] = cone_directions[b, k, 1]
+                direction[2] = cone_directions[b, k, 2]
+                j = cone_rows[k]
+
+                # Step along the cone line, depositing the difference in
+                # cumulative kernel across the traverse of each voxel.
+                # Past the cone's cutoff (see truncated_kernel) nothing
+                # more is deposited. With radiological scaling the kernel
+                # is looked up at the density weighted distance, summed
+                # on the way.
+                last_index = kernel_cutoffs[j]
+                cpu_dda_init(direction, dose_grid_spacing, step, t, delta_t)
+                index2 = -1
+                r = 0.0
+                t_previous = 0.0
+                while cpu_dda_inside(current_voxel, dose_grid_size):
+                    a = cpu_dda_axis(t)
+                    if radiological:
+                        r += dose_grid_densities[current_voxel[0], current_voxel[1], current_voxel[2]] * (t[a] - t_previous)
+                        t_previous = t[a]
+                    else:
+                        r = t[a]
+                    index1 = abs(math.floor(r * 100.0 - 5.0))
+                    if index1 > last_index:
+                        index1 = last_index
+                    for ch in range(num_channels):
+                        T = dose_grid_terma[ch if dose_grid_terma.shape[0] > 1 else 0, x, y, z]
+                        k1 = kernel[ch, j, index1]
+                        if index2 >= 0:
+                            k1 -= kernel[ch, j, index2]
+                        partial[c, ch, current_voxel[0], current_voxel[1], current_voxel[2]] += T * k1
+                    if index1 == last_index:
+                        break
+                    index2 = index1
+                    t[a] += delta_t[a]
+                    current_voxel[a] += step[a]
+
+    for x in numba.prange(dose_grid_size[0]):
+        for c in range(n_chunks):
+            dose_grid_dose[:, x, :, :] += partial[c, :, x, :, :]
+
+
+# Gather dose engine.
+#
+# cpu_dose and cuda_dose scatter from each TERMA voxel into every voxel its
+# cone lines cross, which needs per-thread dose grids on the CPU and atomics
+# on the GPU, and sums in an order that varies between runs. The same dose
+# can be gathered instead: the DDA from a voxel centre along -d crosses
+# exactly the voxels that the DDA along d crosses, negated, at the same
+# t-values. So each receiving voxel traces the reversed cone lines and picks
+# up the TERMA of every voxel it crosses times the kernel increment it would
+# have scattered back. Every thread owns its output voxel, so the result is
+# reproducible to the bit, whatever the number of threads. The cone lines are
+# those of a single, untilted cone table (see tilting.py), negated.
+
+@numba.njit(parallel=True)
+def cpu_gather_dose(dose_grid_dose, dose_grid_spacing, dose_grid_size, dose_grid_terma, cone_directions, cone_rows, kernel, kernel_cutoffs):
+
+    for x in numba.prange(dose_grid_size[0]):
+
+        step = np.empty(3, dtype=np.int32)
+        t = np.empty(3, dtype=np.float64)
+        delta_t = np.empty(3, dtype=np.float64)
+        current_voxel = np.empty(3, dtype=np.int32)
+        direction = np.empty(3, dtype=np.float64)
+
+        for y in range(dose_grid_size[1]):
+            for z in range(dose_grid_size[2]):
+                dose_grid_dose[x, y, z] += cpu_gather_voxel(
+                    x, y, z, dose_grid_spacing, dose_grid_size,
+                    dose_grid_terma, cone_directions, cone_rows, kernel,
+                    kernel_cutoffs, step, t, delta_t, current_voxel, direction
+                )
+
+
+@numba.njit(inline='always')
+def cpu_gather_voxel(x, y, z, dose_grid_spacing, dose_grid_size, dose_grid_terma, cone_directions, cone_rows, kernel, kernel_cutoffs, step, t, delta_t, current_voxel, direction):
+
+    dose = 0.0
+    for k in range(len(cone_rows)):
+
+        current_voxel[0] = x
+        current_voxel[1] = y
+        current_voxel[2] = z
+
+        # Reversed direction vector
+        direction[0] = -cone_directions[k, 0]
+        direction[1] = -cone_directions[k, 1]
+        direction[2] = -cone_directions[k, 2]
+        j = cone_rows[k]
+
+        # Step back along the cone line, picking up the kernel increment
+        # each crossed voxel deposits here
+        last_index = kernel_cutoffs[j]
+        cpu_dda_init(direction, dose_grid_spacing, step, t, delta_t)
+        k2 = 0.0
+        while cpu_dda_inside(current_voxel, dose_grid_size):
+            a = cpu_dda_axis(t)
+            index1 = abs(math.floor(t[a] * 100.0 - 5.0))
+            if index1 > last_index:
+                index1 = last_index
+            k1 = kernel[j, index1]
+            dose += dose_grid_terma[current_voxel[0], current_voxel[1], current_voxel[2]] * (k1 - k2)
+            if index1 == last_index:
+                break
+            k2 = k1
+            t[a] += delta_t[a]
+            current_voxel[a] += step[a]
+
+    return dose
@@ -0,0 +1,151 @@
+import numpy as np
+import scipy.fft
+import scipy.ndimage
+from .cache import LRUCache
+
+
+# Collimated extra-focal sources.
+#
+# The annular (primary collimator) and exponential (flattening filter)
+# sources lie zAnn and zExp below the target. In the fluence model their
+# fluence is a radial function of off-axis distance, multiplied by the block
+# transmission at the point like the primary fluence. Here it is multiplied
+# instead by the fraction of each source's intensity profile that the point
+# can see through the block, so an open field gives the radial model
+# unchanged and sAnn and sExp keep their meaning. The block is taken to sit
+# in an effective collimating plane zCol below the target, and its
+# transmission map is defined in the block plane, at distance d from the
+# target, as seen from the target. A ray from a point r of a source plane at
+# distance z to x then crosses the block at a x + b r in the block plane,
+# with
+#
+#     a = (zCol - z) d / ((d - z) zCol)
+#     b = (d - zCol) d / ((d - z) zCol)
+#
+# so the visible intensity is the transmission map convolved with the source
+# profile magnified by b, sampled at a x, and the visible fraction is that
+# over the intensity of the whole (magnified) profile. The convolution is
+# done with zero-padded FFTs, and the FFT of each magnified profile only
+# depends on the map shape and spacing and the source geometry, so the FFTs
+# of the last few geometries are cached.
+
+_source_fft_cache = LRUCache(maxsize=8)
+
+
+def visible_fractions(transmission, map_origin, map_spacing, iso_distance, zAnn, rInner, rOuter, zExp, kExp, zCol):
+    """ Fraction of each extra-focal source seen through the block.
+
+    Parameters
+    ----------
+    transmission : ndarray
+        Block transmission of each map cell, shape (num_u, num_v)
+    map_origin : ndarray
+        Block plane position of the first map sample, in cm
+    map_spacing : ndarray
+        Spacing of the map along u and v, in cm
+    iso_distance : float
+        Distance from the source to the block plane, in cm
+    zAnn, rInner, rOuter : float
+        Annular source settings
+    zExp, kExp : float
+        Exponential source settings
+    zCol : float
+        Distance from the target to the effective collimating plane, in cm
+
+    Returns
+    -------
+    tuple of ndarray
+        Visible fraction of the annular and of the exponential source at
+        each map sample, 1 for an open field
+    """
+    transmission = np.asarray(transmission, dtype=np.float64)
+    u, v = np.meshgrid(
+        map_origin[0] + np.arange(transmission.shape[0]) * map_spacing[0],
+        map_origin[1] + np.arange(transmission.shape[1]) * map_spacing[1],
+        indexing='ij'
+    )
+    shape = _padded_shape(transmission.shape)
+    transmission_fft = scipy.fft.rfftn(transmission, shape, workers=-1)
+    fractions = []
+    for profile, z in (
+        (('annular', 1.0, rInner, rOuter), zAnn),
+        (('exponential', 1.0, kExp), zExp),
+    ):
+        a = (zCol - z) * iso_distance / ((iso_distance - z) * zCol)
+        b = (iso_distance - zCol) * iso_distance / ((iso_distance - z) * zCol)
+        kernel_fft = _source_kernel_fft(
+            transmission.shape, float(map_spacing[0]), profile, b
+        )
+
+        # The zero frequency term is the intensity of the whole profile
+        visible = scipy.fft.irfftn(
+            transmission_fft * kernel_fft, shape, workers=-1
+        )[:transmission.shape[0], :transmission.shape[1]] / kernel_fft[0, 0].real
+
+        # Where the rays to each map sample cross the block, clamped to the
+        # map
+        fractions.append(scipy.ndimage.map_coordinates(
+            visible,
+            ((a * u - map_origin[0]) / map_spacing[0],
+             (a * v - map_origin[1]) / map_spacing[1]),
+            order=1,
+            mode='nearest'
+        ).clip(0, 1).astype(np.float32))  # Without the round-off of the FFTs
+    return tuple(fractions)
+
+
+def source_profile(profile, r):
+    """ Intensity of an extra-focal source in its own plane.
+
+    Parameters
+    ----------
+    profile : tuple
+        ('annular', sAnn, rInner, rOuter) or ('exponential', sExp, kExp)
+    r : ndarray
+        Distance from the central axis in the source plane, in cm
+
+    Returns
+    -------
+    ndarray
+        Intensity per unit area
+    """
+    if profile[0] == 'annular':
+        _, s, r_inner, r_outer = profile
+        return np.where((r >= r_inner) & (r <= r_outer), s, 0.0)
+    _, s, k = profile
+    return s / r * np.exp(-k * r)
+
+
+def _source_kernel_fft(map_shape, map_spacing, profile, magnification, samples=4):
+    key = (tuple(int(s) for s in map_shape), map_spacing, profile, magnification)
+
+    def build():
+        shape = _padded_shape(map_shape)
+
+        # Magnified profile at map offsets of -(N - 1) to N - 1 samples,
+        # averaged over an even number of points per cell so the singular
+        # centre of the exponential source is never sampled
+        offsets_u = np.arange(1 - map_shape[0], map_shape[0])[:, None] * map_spacing
+        offsets_v = np.arange(1 - map_shape[1], map_shape[1])[None, :] * map_spacing
+        kernel = np.zeros((2 * map_shape[0] - 1, 2 * map_shape[1] - 1))
+        sub = ((np.arange(samples) + 0.5) / samples - 0.5) * map_spacing
+        for du in sub:
+            for dv in sub:
+                r = np.hypot(offsets_u + du, offsets_v + dv) / magnification
+                kernel += source_profile(profile, r)
+        kernel *= (map_spacing / magnification) ** 2 / samples ** 2
+
+        # Place the kernel so that offset d sits at index d modulo the
+        # padded shape
+        padded = np.zeros(shape, dtype=np.float64)
+        padded[:kernel.shape[0], :kernel.shape[1]] = kernel
+        padded = np.roll(padded, (1 - map_shape[0], 1 - map_shape[1]), axis=(0, 1))
+        return scipy.fft.rfftn(padded, workers=-1)
+
+    return _source_fft_cache.get(key, build)
+
+
+def _padded_shape(map_shape):
+    return tuple(
+        scipy.fft.next_fast_len(int(2 * s - 1), real=True) for s in map_shape
+    )
@@ -0,0 +1,209 @@
+import numpy as np
+import numba
+import math
+import scipy.fft
+from .cache import LRUCache
+
+
+# FFT convolution dose engine for homogeneous phantoms.
+#
+# In a medium of uniform density the kernel is spatially invariant, so the
+# dose is the linear convolution of the TERMA grid with a Cartesian
+# resampling of the differential kernel. Both are zero padded to at least
+# 2N - 1 voxels along each axis so the circular convolution of the FFT does
+# not wrap dose around the grid edges. The kernel FFT only depends on the
+# grid shape and spacing (and the kernel itself), so it is cached. A padded
+# FFT of a large grid takes hundreds of MB, so only the last two are kept.
+
+_kernel_fft_cache = LRUCache(maxsize=2)
+
+
+def cartesian_kernel(dose_grid_spacing, dose_grid_size, kernel_angles, kernel_radii, kernel_diff, samples=5):
+    """ Resample the differential kernel onto voxel offsets.
+
+    The kernel is treated as a constant energy density within each of its
+    angular and radial bins, with the primary photon direction along +y (as
+    for the cone directions of the raycast engine). Voxels close to the
+    interaction point, where the density changes quickly, are supersampled,
+    and shells lying wholly inside the interaction voxel are deposited there.
+
+    Parameters
+    ----------
+    dose_grid_spacing : ndarray
+        Voxel dimensions, in form [dim_x, dim_y, dim_z]
+    dose_grid_size : ndarray
+        Shape of the dose grid, N. Offsets of -(N - 1) to N - 1 voxels along
+        each axis are resampled.
+    kernel_angles : ndarray
+        Upper edges of the kernel angular bins, in degrees
+    kernel_radii : ndarray
+        Upper edges of the kernel radial bins, in cm
+    kernel_diff : ndarray
+        Fraction of energy deposited in each bin, shape
+        (len(kernel_angles), len(kernel_radii))
+    samples : int
+        Supersampling of voxels near the interaction point, per axis
+
+    Returns
+    -------
+    ndarray
+        Fraction of energy deposited at each voxel offset, shape 2N - 1,
+        with zero offset at index N - 1
+    """
+    angles = np.asarray(kernel_angles, dtype=np.float64)
+    radii = np.asarray(kernel_radii, dtype=np.float64)
+
+    # Energy density of each bin
+    cos_edges = np.cos(np.radians(np.concatenate(([0.0], angles))))
+    r_edges = np.concatenate(([0.0], radii))
+    volumes = np.outer(
+        2 * math.pi * (cos_edges[:-1] - cos_edges[1:]),
+        (r_edges[1:] ** 3 - r_edges[:-1] ** 3) / 3
+    )
+    density = np.asarray(kernel_diff, dtype=np.float64) / volumes
+
+    # Shells lying wholly inside the interaction voxel are deposited there
+    # directly, rather than sampled
+    core = r_edges[1:] <= 0.5 * np.min(dose_grid_spacing)
+    core_energy = np.asarray(kernel_diff, dtype=np.float64)[:, core].sum()
+    density[:, core] = 0
+
+    size = np.asarray(dose_grid_size, dtype=np.int64)
+    spacing = np.asarray(dose_grid_spacing, dtype=np.float64)
+
+    # The kernel is symmetric about the y axis, so only resample
+    # non-negative x and z offsets and mirror them
+    quarter = np.zeros((size[0], 2 * size[1] - 1, size[2]), dtype=np.float32)
+    _resample_quarter(quarter, spacing, size, angles, radii, density, samples)
+    quarter[0, size[1] - 1, 0] += core_energy
+    half = np.concatenate((quarter[:0:-1], quarter), axis=0)
+    return np.concatenate((half[:, :, :0:-1], half), axis=2)
+
+
+@numba.njit(parallel=True)
+def _resample_quarter(kernel, dose_grid_spacing, dose_grid_size, kernel_angles, kernel_radii, density, samples):
+
+    voxel_volume = dose_grid_spacing[0] * dose_grid_spacing[1] * dose_grid_spacing[2]
+    near = samples * max(dose_grid_spacing[0], max(dose_grid_spacing[1], dose_grid_spacing[2]))
+    max_radius = kernel_radii[-1]
+
+    for i in numba.prange(dose_grid_size[0]):
+        for j in range(2 * dose_grid_size[1] - 1):
+            for k in range(dose_grid_size[2]):
+                cx = i * dose_grid_spacing[0]
+                cy = (j - (dose_grid_size[1] - 1)) * dose_grid_spacing[1]
+                cz = k * dose_grid_spacing[2]
+                if math.sqrt(cx * cx + cy * cy + cz * cz) < near:
+                    n = samples
+                else:
+                    n = 1
+
+                energy = 0.0
+                for a in range(n):
+                    px = cx + ((a + 0.5) / n - 0.5) * dose_grid_spacing[0]
+                    for b in range(n):
+                        py = cy + ((b + 0.5) / n - 0.5) * dose_grid_spacing[1]
+                        for c in range(n):
+                            pz = cz + ((c + 0.5) / n - 0.5) * dose_grid_spacing[2]
+                            r = math.sqrt(px * px + py * py + pz * pz)
+                            if r > max_radius:
+                                continue
+                            if r > 0:
+                                angle = math.degrees(math.acos(min(1.0, max(-1.0, py / r))))
+                            else:
+                                angle = 0.0
+                            angle_index = min(np.searchsorted(kernel_angles, angle), len(kernel_angles) - 1)
+                            radius_index = np.searchsorted(kernel_radii, r)
+                            energy += density[angle_index, radius_index]
+                kernel[i, j, k] = energy * voxel_volume / (n * n * n)
+
+
+def kernel_fft(dose_grid_spacing, dose_grid_size, kernel_angles, kernel_radii, kernel_diff):
+    """ Build (or fetch from cache) the padded kernel FFT of a grid.
+
+    Parameters
+    ----------
+    dose_grid_spacing : ndarray
+        Voxel dimensions, in form [dim_x, dim_y, dim_z]
+    dose_grid_size : ndarray
+        Shape of the dose grid
+    kernel_angles : ndarray
+        Upper edges of the kernel angular bins, in degrees
+    kernel_radii : ndarray
+        Upper edges of the kernel radial bins, in cm
+    kernel_diff : ndarray
+        Fraction of energy deposited in each bin
+
+    Returns
+    -------
+    ndarray
+        Real FFT of the kernel, wrapped so zero offset is at the origin, on
+        the padded grid
+    """
+    key = (
+        tuple(np.asarray(dose_grid_spacing, dtype=np.float64)),
+        tuple(int(s) for s in dose_grid_size),
+        np.asarray(kernel_angles).tobytes(),
+        np.asarray(kernel_radii).tobytes(),
+        np.shape(kernel_diff),
+        np.asarray(kernel_diff, dtype=np.float64).tobytes(),
+    )
+
+    def build():
+        size = np.asarray(dose_grid_size, dtype=np.int64)
+        shape = _padded_shape(size)
+        kernel = cartesian_kernel(
+            dose_grid_spacing, size, kernel_angles, kernel_radii, kernel_diff
+        )
+
+        # Place the kernel so that offset d sits at index d modulo the
+        # padded shape
+        padded = np.zeros(shape, dtype=np.float32)
+        padded[:kernel.shape[0], :kernel.shape[1], :kernel.shape[2]] = kernel
+        padded = np.roll(padded, tuple(1 - size), axis=(0, 1, 2))
+        return scipy.fft.rfftn(padded, workers=-1)
+
+    return _kernel_fft_cache.get(key, build)
+
+
+def _padded_shape(dose_grid_size):
+    return tuple(
+        scipy.fft.next_fast_len(int(2 * s - 1), real=True)
+        for s in dose_grid_size
+    )
+
+
+def fft_dose(dose_grid_terma, dose_grid_spacing, kernel_angles, kernel_radii, kernel_diff):
+    """ Convolve the TERMA grid with the kernel using FFTs.
+
+    Parameters
+    ----------
+    dose_grid_terma : ndarray
+        TERMA of each voxel
+    dose_grid_spacing : ndarray
+        Voxel dimensions, in form [dim_x, dim_y, dim_z]. For a uniform
+        non-water medium pass the radiological (density scaled) spacing.
+    kernel_angles : ndarray
+        Upper edges of the kernel angular bins, in degrees
+    kernel_radii : ndarray
+        Upper edges of the kernel radial bins, in cm
+    kernel_diff : ndarray
+        Fraction of energy deposited in each bin
+
+    Returns
+    -------
+    ndarray
+        Dose of each voxel
+    """
+    size = dose_grid_terma.shape
+    shape = _padded_shape(size)
+    kernel_ft = kernel_fft(
+        dose_grid_spacing, size, kernel_angles, kernel_radii, kernel_diff
+    )
+    terma_ft = scipy.fft.rfftn(
+        dose_grid_terma.astype(np.float32), s=shape, workers=-1
+    )
+    dose = scipy.fft.irfftn(terma_ft * kernel_ft, s=shape, workers=-1)
+    return np.ascontiguousarray(
+        dose[:size[0], :size[1], :size[2]], dtype=np.float32
+    )
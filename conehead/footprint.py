@@ -0,0 +1,245 @@
+import hashlib
+import numpy as np
+import numba
+from numba import cuda
+from .cache import LRUCache
+from .cpu import cpu_dot, cpu_line_block_plane_collision
+
+
+# Footprint-averaged hit test.
+#
+# Instead of looking up the block transmission at supersampled points of a
+# voxel, the voxel is projected from the source onto the block plane and the
+# transmission is averaged over its rectangular footprint using a summed-area
+# table. The table only depends on the block, so it is cached (keyed on a
+# digest of the transmission raster), and the mean over any footprint costs
+# a fixed number of table reads. Only voxels whose footprint straddles a
+# field edge are split into sub-voxels, each again averaged over its own
+# footprint, to account for the change in magnification across the voxel. A
+# footprint whose mean is the lowest or highest transmission of the block
+# must lie entirely at that transmission, so only voxels with a mean strictly
+# between the two are refined. This is exact at the edges of a two-level
+# block and at worst refines a few uniform voxels of intermediate
+# transmission, without a second table of the squared transmission.
+
+EDGE_TOLERANCE = 1e-6
+
+_table_cache = LRUCache(maxsize=2)
+
+
+def summed_area_table(block_values):
+    """ Build (or fetch from cache) the summed-area table of the block
+    transmission. The returned table is shared between callers and must not
+    be modified.
+
+    Parameters
+    ----------
+    block_values : ndarray
+        Block transmission at 0.1 mm resolution
+
+    Returns
+    -------
+    ndarray
+        Summed-area table, shape (block_values.shape[0] + 1,
+        block_values.shape[1] + 1). Entry [i, j] is the sum over
+        block_values[:i, :j].
+    """
+    block_values = np.ascontiguousarray(block_values)
+    key = (
+        block_values.shape,
+        block_values.dtype.str,
+        hashlib.sha256(block_values).hexdigest()
+    )
+
+    def build():
+        table = np.zeros(
+            (block_values.shape[0] + 1, block_values.shape[1] + 1),
+            dtype=np.float64
+        )
+        sums = table[1:, 1:]
+        sums[...] = block_values
+        np.cumsum(sums, axis=0, out=sums)  # In place, without a float64 copy
+        np.cumsum(sums, axis=1, out=sums)
+        return table
+
+    return _table_cache.get(key, build)
+
+
+@numba.njit(inline='always')
+def cpu_table_integral(table, u, v):
+
+    # Position in pixels. A pixel p covers positions from (p - 1999) / 100
+    # to (p - 1998) / 100 cm, as in cpu_block_transmission.
+    u = min(max(u * 100 + 1999, 0.0), table.shape[0] - 1.0)
+    v = min(max(v * 100 + 1999, 0.0), table.shape[1] - 1.0)
+    i = min(int(u), table.shape[0] - 2)
+    j = min(int(v), table.shape[1] - 2)
+    fu = u - i
+    fv = v - j
+
+    # The integral of a piecewise constant image is bilinear within a pixel
+    return (
+        table[i, j] * (1 - fu) * (1 - fv) +
+        table[i + 1, j] * fu * (1 - fv) +
+        table[i, j + 1] * (1 - fu) * fv +
+        table[i + 1, j + 1] * fu * fv
+    )
+
+
+@numba.njit(inline='always')
+def cpu_footprint_mean(table, u0, u1, v0, v1):
+    integral = (
+        cpu_table_integral(table, u1, v1) -
+        cpu_table_integral(table, u0, v1) -
+        cpu_table_integral(table, u1, v0) +
+        cpu_table_integral(table, u0, v0)
+    )
+    return integral / ((u1 - u0) * (v1 - v0) * 10000)
+
+
+@numba.njit
+def cpu_footprint(table, position, half_size, source_position, source_v_y, source_transform, ray_direction, pos_plane):
+
+    # Project the centre onto the block plane
+    ray_direction[0] = source_position[0] - position[0]
+    ray_direction[1] = source_position[1] - position[1]
+    ray_direction[2] = source_position[2] - position[2]
+    cpu_line_block_plane_collision(pos_plane, source_position, ray_direction, source_v_y, 1e-6)
+    u = cpu_dot(source_transform[0, :], pos_plane)
+    v = cpu_dot(source_transform[2, :], pos_plane)
+
+    # Extent of the voxel across the block axes, magnified onto the plane
+    magnification = abs(cpu_dot(source_v_y, source_position) / cpu_dot(source_v_y, ray_direction))
+    half_u = 0.0
+    half_v = 0.0
+    for a in range(3):
+        half_u += abs(source_transform[0, a]) * half_size[a]
+        half_v += abs(source_transform[2, a]) * half_size[a]
+    half_u *= magnification
+    half_v *= magnification
+
+    return cpu_footprint_mean(table, u - half_u, u + half_u, v - half_v, v + half_v)
+
+
+@numba.njit(parallel=True)
+def cpu_footprint_hit_test(dose_grid_blocked, dose_grid_size, dose_grid_origin, dose_grid_spacing, source_position, source_v_y, source_transform, table, transmission_min, transmission_max, samples):
+
+    for x in numba.prange(dose_grid_size[0]):
+
+        ray_direction = np.empty(3, dtype=np.float64)
+        pos_plane = np.empty(3, dtype=np.float64)
+        position = np.empty(3, dtype=np.float64)
+        half_size = np.empty(3, dtype=np.float64)
+        sub_position = np.empty(3, dtype=np.float64)
+        sub_half_size = np.empty(3, dtype=np.float64)
+        for a in range(3):
+            half_size[a] = dose_grid_spacing[a] / 2
+            sub_half_size[a] = dose_grid_spacing[a] / samples / 2
+
+        for y in range(dose_grid_size[1]):
+            for z in range(dose_grid_size[2]):
+
+                position[0] = dose_grid_origin[0] + dose_grid_spacing[0] * x
+                position[1] = dose_grid_origin[1] + dose_grid_spacing[1] * y
+                position[2] = dose_grid_origin[2] + dose_grid_spacing[2] * z
+
+                mean = cpu_footprint(table, position, half_size, source_position, source_v_y, source_transform, ray_direction, pos_plane)
+
+                # Refine only voxels at a field edge
+                if transmission_min + EDGE_TOLERANCE < mean < transmission_max - EDGE_TOLERANCE:
+                    mean = 0.0
+                    for ix in range(samples):
+                        for iy in range(samples):
+                            for iz in range(samples):
+                                sub_position[0] = position[0] - half_size[0] + sub_half_size[0] * (2 * ix + 1)
+                                sub_position[1] = position[1] - half_size[1] + sub_half_size[1] * (2 * iy + 1)
+                                sub_position[2] = position[2] - half_size[2] + sub_half_size[2] * (2 * iz + 1)
+                                mean += cpu_footprint(table, sub_position, sub_half_size, source_position, source_v_y, source_transform, ray_direction, pos_plane)
+                    mean /= samples**3
+
+                dose_grid_blocked[x, y, z] = mean
+
+
+@cuda.jit(device=True)
+def cuda_table_integral(table, u, v):
+
+    u = min(max(u * 100 + 1999, 0.0), table.shape[0] - 1.0)
+    v = min(max(v * 100 + 1999, 0.0), table.shape[1] - 1.0)
+    i = min(int(u), table.shape[0] - 2)
+    j = min(int(v), table.shape[1] - 2)
+    fu = u - i
+    fv = v - j
+
+    return (
+        table[i, j] * (1 - fu) * (1 - fv) +
+        table[i + 1, j] * fu * (1 - fv) +
+        table[i, j + 1] * (1 - fu) * fv +
+        table[i + 1, j + 1] * fu * fv
+    )
+
+
+@cuda.jit(device=True)
+def cuda_footprint(table, p0, p1, p2, h0, h1, h2, source_position, source_v_y, source_transform):
+
+    # Project the centre onto the block plane
+    d0 = source_position[0] - p0
+    d1 = source_position[1] - p1
+    d2 = source_position[2] - p2
+    ndotu = source_v_y[0] * d0 + source_v_y[1] * d1 + source_v_y[2] * d2
+    si = -(source_v_y[0] * source_position[0] + source_v_y[1] * source_position[1] + source_v_y[2] * source_position[2]) / ndotu
+    q0 = source_position[0] + si * d0
+    q1 = source_position[1] + si * d1
+    q2 = source_position[2] + si * d2
+    u = source_transform[0, 0] * q0 + source_transform[0, 1] * q1 + source_transform[0, 2] * q2
+    v = source_transform[2, 0] * q0 + source_transform[2, 1] * q1 + source_transform[2, 2] * q2
+
+    # Extent of the voxel across the block axes, magnified onto the plane
+    magnification = abs(si)
+    half_u = magnification * (abs(source_transform[0, 0]) * h0 + abs(source_transform[0, 1]) * h1 + abs(source_transform[0, 2]) * h2)
+    half_v = magnification * (abs(source_transform[2, 0]) * h0 + abs(source_transform[2, 1]) * h1 + abs(source_transform[2, 2]) * h2)
+
+    integral = (
+        cuda_table_integral(table, u + half_u, v + half_v) -
+        cuda_table_integral(table, u - half_u, v + half_v) -
+        cuda_table_integral(table, u + half_u, v - half_v) +
+        cuda_table_integral(table, u - half_u, v - half_v)
+    )
+    return integral / (4 * half_u * half_v * 10000)
+
+
+@cuda.jit
+def cuda_footprint_hit_test(dose_grid_blocked, dose_grid_size, dose_grid_origin, dose_grid_spacing, source_position, source_v_y, source_transform, table, transmission_min, transmission_max, samples):
+
+    x, y, z = cuda.grid(3)
+    if x < dose_grid_size[0] and y < dose_grid_size[1] and z < dose_grid_size[2]:
+
+        p0 = dose_grid_origin[0] + dose_grid_spacing[0] * x
+        p1 = dose_grid_origin[1] + dose_grid_spacing[1] * y
+        p2 = dose_grid_origin[2] + dose_grid_spacing[2] * z
+        h0 = dose_grid_spacing[0] / 2
+        h1 = dose_grid_spacing[1] / 2
+        h2 = dose_grid_spacing[2] / 2
+
+        mean = cuda_footprint(table, p0, p1, p2, h0, h1, h2, source_position, source_v_y, source_transform)
+
+        # Refine only voxels at a field edge
+        if transmission_min + EDGE_TOLERANCE < mean < transmission_max - EDGE_TOLERANCE:
+            mean = 0.0
+            for ix in range(samples):
+                for iy in range(samples):
+                    for iz in range(samples):
+                        mean += cuda_footprint(
+                            table,
+                            p0 - h0 + h0 / samples * (2 * ix + 1),
+                            p1 - h1 + h1 / samples * (2 * iy + 1),
+                            p2 - h2 + h2 / samples * (2 * iz + 1),
+                            h0 / samples,
+                            h1 / samples,
+                            h2 / samples,
+                            source_position,
+                            source_v_y,
+                            source_transform
+                        )
+            mean /= samples**3
+
+        dose_grid_blocked[x, y, z] = mean
@@ -12,13 +12,22 @@
 # ECUT - 0.521
 # PCUT - 0.010
 #
+import functools
+import glob
+import json
+import os
 import numpy as np
 
 
+# First and last radius (cm) and number of samples of the resampled
+# cumulative kernels (0.1 mm)
+KERNEL_SAMPLING = (0.05, 60.0, 5996)
+
 
 class KernelMono:
 
-    def __init__(self, egslst_path=None) -> None:
+    def __init__(self, egslst_path=None, sampling=KERNEL_SAMPLING) -> None:
+        self.sampling = sampling
         if egslst_path is not None:
             self._from_egslst(egslst_path)
         else:
@@ -35,41 +44,351 @@ class KernelMono:
                 if "END OF RUN" in line:
                     end = i - 1
 
+            # Columns are angle, radius, total [uncert], primary [uncert]
             data_raw = np.array(
-                [l.split()[:3] for l in lines[start:end]], dtype=np.float32
+                [[l.split()[k] for k in (0, 1, 2, 6)] for l in lines[start:end]],
+                dtype=np.float32
             )
             self.angles = np.unique(data_raw[:, 0])
             self.radii = np.unique(data_raw[:, 1])
             self.kernel_diff = data_raw[:, 2].reshape((48, 24))
-            self.kernel_diff = self.kernel_diff / self.kernel_diff.sum()  # normalise
-            self.kernel_cum = self.kernel_diff.cumsum(axis=1)
-            kernel_cum_interp = np.zeros((48, 5996))
-            for i in range(self.kernel_cum.shape[0]):
-                kernel_cum_interp[i, :] = np.interp(  # Resample to 0.1 mm
-                    np.linspace(0.05, 60.0, 5996),
-                    self.radii,
-                    self.kernel_cum[i, :]
-                )
-            self.kernel_cum = kernel_cum_interp
+            total = self.kernel_diff.sum()
+            self.kernel_diff = self.kernel_diff / total  # normalise
+            self.kernel_cum = _resample_cumulative(self.kernel_diff, self.radii, self.sampling)
+
+            # Primary part, normalised with the total so the scatter is the
+            # difference
+            self.kernel_diff_primary = data_raw[:, 3].reshape((48, 24)) / total
+            self.kernel_cum_primary = _resample_cumulative(self.kernel_diff_primary, self.radii, self.sampling)
 
 
 
 class KernelPoly:
 
-    def __init__(self, angles, radii, kernel_diff) -> None:
+    def __init__(self, angles, radii, kernel_diff, sampling=KERNEL_SAMPLING, kernel_cum=None, kernel_diff_primary=None, kernel_cum_primary=None) -> None:
+        self.sampling = sampling
         self.angles = angles
         self.radii = radii
         self.kernel_diff = kernel_diff
-        self.kernel_diff = self.kernel_diff / self.kernel_diff.sum()  # normalise
-        self.kernel_cum = kernel_diff.cumsum(axis=1)
-        kernel_cum_interp = np.zeros((48, 5996))
-        for i in range(self.kernel_cum.shape[0]):
-            kernel_cum_interp[i, :] = np.interp(  # Resample to 0.1 mm
-                np.linspace(0.05, 60.0, 5996),
-                self.radii,
-                self.kernel_cum[i, :]
+        total = self.kernel_diff.sum()
+        self.kernel_diff = self.kernel_diff / total  # normalise
+        self.kernel_diff_primary = None
+        self.kernel_cum_primary = None
+        if kernel_diff_primary is not None:
+            self.kernel_diff_primary = kernel_diff_primary / total
+        if kernel_cum is not None:  # Already resampled
+            self.kernel_cum = kernel_cum
+            self.kernel_cum_primary = kernel_cum_primary
+            return
+        self.kernel_cum = _resample_cumulative(kernel_diff, self.radii, self.sampling)
+        if self.kernel_diff_primary is not None:
+            self.kernel_cum_primary = _resample_cumulative(kernel_diff_primary, self.radii, self.sampling)
+
+
+def _resample_cumulative(kernel_diff, radii, sampling):
+    kernel_cum = kernel_diff.cumsum(axis=1)
+    kernel_cum_interp = np.zeros((kernel_cum.shape[0], sampling[2]))
+    for i in range(kernel_cum.shape[0]):
+        kernel_cum_interp[i, :] = np.interp(  # Resample to 0.1 mm
+            np.linspace(*sampling),
+            radii,
+            kernel_cum[i, :]
+        )
+    return kernel_cum_interp
+
+
+
+def polyenergetic_kernel(energy_weights, sampling=KERNEL_SAMPLING, kernel_dir="kernels"):
+    """ Build (or fetch from cache) the polyenergetic kernel of a spectrum.
+
+    Kernels are cached process-wide with least recently used eviction,
+    keyed on the spectrum, the sampling and the kernel directory (which
+    fixes the cone angles). Only energies with a non-zero weight are loaded,
+    from the binary kernel library if the directory holds one (see
+    build_kernel_library) or else from the egslst files. The returned
+    kernel is shared between callers and must not be modified.
+
+    Parameters
+    ----------
+    energy_weights : dict
+        Weight of each energy bin, keyed by energy in MeV (e.g. "1.5")
+    sampling : tuple
+        First and last radius (cm) and number of samples of the resampled
+        cumulative kernel
+    kernel_dir : str
+        Directory holding the monoenergetic kernels, as <E>MeV/<E>MeV.egslst
+
+    Returns
+    -------
+    KernelPoly
+        The polyenergetic kernel
+    """
+    spectrum = tuple(sorted(
+        (float(e), float(w)) for e, w in energy_weights.items() if float(w)
+    ))
+    if not spectrum:
+        raise ValueError("At least one energy weight must be non-zero.")
+    return _polyenergetic_kernel(spectrum, tuple(sampling), kernel_dir)
+
+
+@functools.lru_cache(maxsize=8)
+def _polyenergetic_kernel(spectrum, sampling, kernel_dir):
+    library = open_kernel_library(kernel_dir)
+    if library is not None and library.sampling == sampling:
+        return library.polyenergetic_kernel(spectrum)
+
+    paths = _egslst_paths(kernel_dir)
+    energies = np.array(list(paths))
+    kernels = []
+    for e, w in spectrum:
+        matches = np.flatnonzero(np.isclose(energies, e))
+        if not len(matches):
+            raise ValueError(f"There is no {e} MeV kernel in {kernel_dir}.")
+        kernels.append((_monoenergetic_kernel(paths[energies[matches[0]]], sampling), w))
+    kernel_diff = sum(kernel.kernel_diff * w for kernel, w in kernels)
+    kernel_diff_primary = sum(kernel.kernel_diff_primary * w for kernel, w in kernels)
+    total = kernel_diff.sum()
+    return KernelPoly(
+        kernels[0][0].angles, kernels[0][0].radii, kernel_diff / total,  # normalise
+        sampling, kernel_diff_primary=kernel_diff_primary / total
+    )
+
+
+def _egslst_paths(kernel_dir):
+    # Map the energy of each <E>MeV/<E>MeV.egslst kernel to its path
+    paths = {}
+    for path in glob.glob(os.path.join(kernel_dir, "*MeV", "*MeV.egslst")):
+        folder = os.path.basename(os.path.dirname(path))
+        try:
+            paths[float(folder[:-len("MeV")])] = path
+        except ValueError:
+            continue
+    return paths
+
+
+@functools.lru_cache(maxsize=32)
+def _monoenergetic_kernel(egslst_path, sampling):
+    return KernelMono(egslst_path, sampling)
+
+
+# Kernel range truncation
+#
+# The cumulative kernel of most cones has all but saturated within a few cm,
+# yet cone lines are followed to the last sample (60 cm) or the edge of the
+# grid. Each cone is instead cut off at the first radius where its
+# cumulative kernel reaches a chosen fraction of its total, and held
+# constant beyond, so the ray engines can stop there. The energy left out is
+# reported, so the error stays visible.
+
+def truncated_kernel(kernel_cum, energy_fraction):
+    """ Truncate each cone of a cumulative kernel at a fraction of its
+    deposited energy.
+
+    Parameters
+    ----------
+    kernel_cum : ndarray
+        Cumulative kernel of each cone, shape (num_angles, num_samples)
+    energy_fraction : float
+        Fraction of each cone's energy to keep, in (0, 1]. 1 keeps the whole
+        kernel.
+
+    Returns
+    -------
+    tuple
+        Truncated cumulative kernel, the last sample index of each cone
+        (int32) and the fraction of the kernel energy left out
+    """
+    if not 0 < energy_fraction <= 1:
+        raise ValueError("The kernel energy fraction must be in (0, 1].")
+    kernel_cum = np.asarray(kernel_cum)
+    last_index = kernel_cum.shape[1] - 1
+    totals = kernel_cum[:, -1]
+    cutoffs = np.full(len(kernel_cum), last_index, dtype=np.int32)
+    if energy_fraction < 1:
+        for j, total in enumerate(totals):
+            if total > 0:
+                cutoffs[j] = np.argmax(kernel_cum[j] >= energy_fraction * total)
+    kept = kernel_cum[np.arange(len(kernel_cum)), cutoffs]
+    truncated = kernel_cum.copy()
+    truncated[np.arange(truncated.shape[1]) > cutoffs[:, None]] = np.repeat(
+        kept, last_index - cutoffs
+    )
+    return truncated, cutoffs, float(np.sum(totals - kept) / np.sum(totals))
+
+
+def primary_scatter_kernel(kernel_cum, kernel_cum_primary, kernel_cutoffs):
+    """ Split a truncated cumulative kernel into primary and scatter
+    channels.
+
+    Parameters
+    ----------
+    kernel_cum : ndarray
+        Truncated cumulative kernel of each cone (see truncated_kernel)
+    kernel_cum_primary : ndarray
+        Cumulative primary kernel of each cone, normalised with the total
+    kernel_cutoffs : ndarray
+        Last sample index of each cone
+
+    Returns
+    -------
+    ndarray
+        Stacked primary and scatter kernels, shape (2, num_angles,
+        num_samples), both held constant past the cutoffs of the total
+    """
+    if kernel_cum_primary is None:
+        raise ValueError("The kernel has no primary part. Rebuild the kernel"
+                         " library to add it.")
+    samples = np.minimum(
+        np.arange(kernel_cum.shape[1]), np.asarray(kernel_cutoffs)[:, None]
+    )
+    primary = np.take_along_axis(np.asarray(kernel_cum_primary), samples, axis=1)
+    return np.stack([primary, kernel_cum - primary])
+
+
+# Binary kernel library
+#
+# The monoenergetic kernels of a directory are compiled into a single raw
+# binary file (library.bin) of float64 arrays, described by a JSON index
+# (library.json) giving the dtype, shape and byte offset of each. The arrays
+# are opened with np.memmap, so worker processes share one page-cached copy
+# and nothing is parsed at load time.
+
+LIBRARY_INDEX = "library.json"
+LIBRARY_DATA = "library.bin"
+
+
+class KernelLibrary:
+
+    def __init__(self, kernel_dir) -> None:
+        with open(os.path.join(kernel_dir, LIBRARY_INDEX)) as f:
+            index = json.load(f)
+        self.sampling = tuple(index["sampling"])
+        data_path = os.path.join(kernel_dir, LIBRARY_DATA)
+        arrays = {
+            name: np.memmap(
+                data_path,
+                dtype=entry["dtype"],
+                mode="r",
+                offset=entry["offset"],
+                shape=tuple(entry["shape"])
             )
-        self.kernel_cum = kernel_cum_interp
+            for name, entry in index["arrays"].items()
+        }
+        self.energies = arrays["energies"]  # (num_energies,) MeV
+        self.angles = arrays["angles"]  # (num_angles,) degrees
+        self.radii = arrays["radii"]  # (num_radii,) cm
+        self.kernel_diff = arrays["kernel_diff"]  # (num_energies, num_angles, num_radii)
+        self.kernel_cum = arrays["kernel_cum"]  # (num_energies, num_angles, sampling[2])
+        # Primary parts, missing from libraries built before they were added
+        self.kernel_diff_primary = arrays.get("kernel_diff_primary")
+        self.kernel_cum_primary = arrays.get("kernel_cum_primary")
+
+    def polyenergetic_kernel(self, spectrum):
+        """ Combine the tabulated kernels of a spectrum.
+
+        The kernels of each energy are normalised and resampling is linear,
+        so the polyenergetic cumulative kernel is the weighted mean of the
+        precomputed cumulative tables.
+
+        Parameters
+        ----------
+        spectrum : tuple
+            Pairs of energy (MeV) and weight
+
+        Returns
+        -------
+        KernelPoly
+            The polyenergetic kernel
+        """
+        indices = []
+        for e, _ in spectrum:
+            matches = np.flatnonzero(np.isclose(self.energies, e))
+            if not len(matches):
+                raise ValueError(f"There is no {e} MeV kernel in the kernel"
+                                 " library.")
+            indices.append(matches[0])
+        weights = np.array([w for _, w in spectrum]) / sum(w for _, w in spectrum)
+        kernel_diff = np.tensordot(weights, self.kernel_diff[indices], axes=1)
+        kernel_cum = np.tensordot(weights, self.kernel_cum[indices], axes=1)
+        kernel_diff_primary = None
+        kernel_cum_primary = None
+        if self.kernel_diff_primary is not None:
+            kernel_diff_primary = np.tensordot(weights, self.kernel_diff_primary[indices], axes=1)
+            kernel_cum_primary = np.tensordot(weights, self.kernel_cum_primary[indices], axes=1)
+        return KernelPoly(
+            np.array(self.angles), np.array(self.radii), kernel_diff,
+            self.sampling, kernel_cum, kernel_diff_primary, kernel_cum_primary
+        )
+
+
+@functools.lru_cache(maxsize=None)
+def open_kernel_library(kernel_dir="kernels"):
+    """ Open the binary kernel library of a directory, if it has one.
+
+    Parameters
+    ----------
+    kernel_dir : str
+        Directory holding the kernel library
+
+    Returns
+    -------
+    KernelLibrary or None
+        The memory-mapped library, or None if it has not been built
+    """
+    if not os.path.exists(os.path.join(kernel_dir, LIBRARY_INDEX)):
+        return None
+    return KernelLibrary(kernel_dir)
+
+
+def build_kernel_library(kernel_dir="kernels", sampling=KERNEL_SAMPLING):
+    """ Compile the egslst kernels of a directory into a binary library.
+
+    Parameters
+    ----------
+    kernel_dir : str
+        Directory holding the monoenergetic kernels, as <E>MeV/<E>MeV.egslst
+    sampling : tuple
+        First and last radius (cm) and number of samples of the precomputed
+        cumulative kernels
+    """
+    paths = glob.glob(os.path.join(kernel_dir, "*MeV", "*MeV.egslst"))
+    kernels = sorted(
+        (KernelMono(path, tuple(sampling)) for path in paths),
+        key=lambda kernel: kernel.energy
+    )
+    if not kernels:
+        raise FileNotFoundError(f"No egslst kernels found in {kernel_dir}.")
+    arrays = {
+        "energies": np.array([kernel.energy for kernel in kernels]),
+        "angles": kernels[0].angles,
+        "radii": kernels[0].radii,
+        "kernel_diff": np.array([kernel.kernel_diff for kernel in kernels]),
+        "kernel_cum": np.array([kernel.kernel_cum for kernel in kernels]),
+        "kernel_diff_primary": np.array([kernel.kernel_diff_primary for kernel in kernels]),
+        "kernel_cum_primary": np.array([kernel.kernel_cum_primary for kernel in kernels]),
+    }
+
+    index = {"sampling": list(sampling), "arrays": {}}
+    offset = 0
+    with open(os.path.join(kernel_dir, LIBRARY_DATA), "wb") as f:
+        for name, array in arrays.items():
+            array = np.ascontiguousarray(array, dtype=np.float64)
+            index["arrays"][name] = {
+                "dtype": array.dtype.str,
+                "shape": list(array.shape),
+                "offset": offset
+            }
+            f.write(array.tobytes())
+            offset += array.nbytes
+    with open(os.path.join(kernel_dir, LIBRARY_INDEX), "w") as f:
+        json.dump(index, f, indent=4)
+    open_kernel_library.cache_clear()
+    _polyenergetic_kernel.cache_clear()
+
+
+if __name__ == "__main__":
+    import sys
+    build_kernel_library(*sys.argv[1:2])
 
 
 
@@ -0,0 +1,226 @@
+import numpy as np
+import numpy.typing as npt
+import numba
+import math
+from .cpu import (
+    cpu_dot, cpu_dda_init, cpu_dda_axis, cpu_dda_inside,
+    cpu_voxel_transmission, cpu_voxel_d_eff, cpu_voxel_terma, cpu_gather_voxel
+)
+
+
+# Point doses.
+#
+# For second checks and profiles only the dose at a few points is wanted.
+# The gather formulation (see cpu_gather_dose) gives the dose of one voxel
+# from the TERMA of the voxels its reversed cone lines cross, so the dose at
+# a point is interpolated trilinearly between the voxels around it, and only
+# the voxels crossed by their cone lines need a hit test, an effective depth
+# and a TERMA. Those voxels are marked by tracing the lines once. Each stage
+# then runs over packed lists of voxels rather than the whole grid, and
+# gives the same values as the full calculation at the voxels it visits.
+
+
+class PointReceivers:
+    """ Voxels whose doses are interpolated to the calculation points.
+
+    Parameters
+    ----------
+    voxels : ndarray
+        Index of each receiving voxel, shape (num_voxels, 3)
+    point_indices : ndarray
+        Point each interpolation weight belongs to
+    voxel_indices : ndarray
+        Receiving voxel each interpolation weight belongs to
+    weights : ndarray
+        Trilinear interpolation weights
+    """
+
+    def __init__(self, voxels, point_indices, voxel_indices, weights):
+        self.voxels = voxels
+        self.point_indices = point_indices
+        self.voxel_indices = voxel_indices
+        self.weights = weights
+
+    def interpolate(self, voxel_doses: npt.NDArray[np.float64], num_points) -> npt.NDArray[np.float64]:
+        """ Interpolate the doses of the receiving voxels to the points.
+
+        Parameters
+        ----------
+        voxel_doses : ndarray
+            Dose of each receiving voxel
+        num_points : int
+            Number of points
+
+        Returns
+        -------
+        ndarray
+            Dose at each point
+        """
+        return np.bincount(
+            self.point_indices,
+            weights=self.weights * voxel_doses[self.voxel_indices],
+            minlength=num_points
+        )
+
+
+def point_receivers(points: npt.NDArray[np.float64], dose_grid_size, dose_grid_origin, dose_grid_spacing) -> PointReceivers:
+    """ Find the voxels around each point and their interpolation weights.
+
+    Parameters
+    ----------
+    points : ndarray
+        Positions of the points, in cm, shape (num_points, 3)
+    dose_grid_size : ndarray
+        Shape of the dose grid
+    dose_grid_origin : ndarray
+        Position of the first dose grid voxel centre, in cm
+    dose_grid_spacing : ndarray
+        Voxel dimensions, in form [dim_x, dim_y, dim_z]
+
+    Returns
+    -------
+    PointReceivers
+        The receiving voxels, with zero weights left out
+    """
+    size = np.asarray(dose_grid_size, dtype=np.int64)
+    position = (
+        (np.asarray(points, dtype=np.float64).reshape((-1, 3)) -
+         np.asarray(dose_grid_origin, dtype=np.float64)) /
+        np.asarray(dose_grid_spacing, dtype=np.float64)
+    )
+    if np.any(position < -1e-6) or np.any(position > size - 1 + 1e-6):
+        raise ValueError("Every point must lie between the dose grid voxel"
+                         " centres.")
+    position = np.clip(position, 0, size - 1)
+    lower = np.minimum(np.floor(position), np.maximum(size - 2, 0)).astype(np.int64)
+    fraction = position - lower
+
+    # The eight corners of each point's cell, with their weights
+    corners = np.array([[i, j, k] for i in (0, 1) for j in (0, 1) for k in (0, 1)])
+    voxels = np.minimum(lower[:, None, :] + corners, size - 1)
+    weights = np.prod(np.where(corners, fraction[:, None, :], 1 - fraction[:, None, :]), axis=2)
+    point_indices = np.repeat(np.arange(len(position)), len(corners))
+    voxels = voxels.reshape((-1, 3))
+    weights = weights.ravel()
+    keep = weights > 0
+    unique, voxel_indices = np.unique(
+        np.ravel_multi_index(voxels[keep].T, size), return_inverse=True
+    )
+    return PointReceivers(
+        np.ascontiguousarray(np.array(np.unravel_index(unique, size)).T, dtype=np.int32),
+        point_indices[keep],
+        voxel_indices.ravel(),
+        weights[keep]
+    )
+
+
+@numba.njit(parallel=True)
+def cpu_mark_cone_lines(dose_grid_marked, receivers, dose_grid_spacing, dose_grid_size, kernel_thetas, kernel_phis, kernel_cutoffs):
+
+    # Mark every voxel that a receiver's reversed cone lines cross before
+    # their cutoffs. Threads only ever write 1, so they can share the grid.
+    for n in numba.prange(len(receivers)):
+
+        step = np.empty(3, dtype=np.int32)
+        t = np.empty(3, dtype=np.float64)
+        delta_t = np.empty(3, dtype=np.float64)
+        current_voxel = np.empty(3, dtype=np.int32)
+        direction = np.empty(3, dtype=np.float64)
+
+        for i in range(len(kernel_thetas)):
+            for j in range(len(kernel_phis)):
+
+                current_voxel[0] = receivers[n, 0]
+                current_voxel[1] = receivers[n, 1]
+                current_voxel[2] = receivers[n, 2]
+
+                theta_rad = kernel_thetas[i] * math.pi / 180.0
+                phi_rad = kernel_phis[j] * math.pi / 180.0
+                direction[0] = -math.cos(theta_rad) * math.sin(phi_rad)
+                direction[1] = -math.cos(phi_rad)
+                direction[2] = -math.sin(theta_rad) * math.sin(phi_rad)
+                N = math.sqrt(cpu_dot(direction, direction))
+                direction[0] /= N
+                direction[1] /= N
+                direction[2] /= N
+
+                last_index = kernel_cutoffs[j]
+                cpu_dda_init(direction, dose_grid_spacing, step, t, delta_t)
+                while cpu_dda_inside(current_voxel, dose_grid_size):
+                    a = cpu_dda_axis(t)
+                    dose_grid_marked[current_voxel[0], current_voxel[1], current_voxel[2]] = 1
+                    if abs(math.floor(t[a] * 100.0 - 5.0)) >= last_index:
+                        break
+                    t[a] += delta_t[a]
+                    current_voxel[a] += step[a]
+
+
+@numba.njit(parallel=True)
+def cpu_voxels_blocked_d_eff(blocked, d_eff, voxels, dose_grid_size, dose_grid_origin, dose_grid_spacing, dose_grid_densities, source_position, source_v_y, source_transform, block_values, samples):
+
+    # cpu_hit_test and cpu_d_eff at a list of voxels. The effective depth
+    # is only traced where the voxel is in the beam.
+    offset = dose_grid_spacing / samples
+
+    for n in numba.prange(len(voxels)):
+
+        step = np.empty(3, dtype=np.int32)
+        t = np.empty(3, dtype=np.float64)
+        delta_t = np.empty(3, dtype=np.float64)
+        current_voxel = np.empty(3, dtype=np.int32)
+        ray_direction = np.empty(3, dtype=np.float64)
+        pos_plane = np.empty(3, dtype=np.float64)
+
+        x = voxels[n, 0]
+        y = voxels[n, 1]
+        z = voxels[n, 2]
+        blocked[n] = cpu_voxel_transmission(
+            x, y, z, dose_grid_origin, dose_grid_spacing, offset,
+            source_position, source_v_y, source_transform, block_values,
+            samples, ray_direction, pos_plane
+        )
+        if blocked[n] != 0:
+            d_eff[n] = cpu_voxel_d_eff(
+                x, y, z, dose_grid_size, dose_grid_origin, dose_grid_spacing,
+                dose_grid_densities, source_position, step, t, delta_t,
+                current_voxel, ray_direction
+            )
+
+
+@numba.njit(parallel=True)
+def cpu_voxels_terma(dose_grid_terma, voxels, blocked, d_eff, dose_grid_origin, dose_grid_spacing, source_position, source_sad, source_transform, source_v_y, sPri, zAnn, sAnn, rInner, rOuter, zExp, sExp, kExp, softRatio, softLimit, hornRatio, attenuation, attenuation_step):
+
+    # cpu_fused_terma at a list of voxels, written into the TERMA grid
+    for n in numba.prange(len(voxels)):
+
+        distance = np.empty(3, dtype=np.float64)
+        pos_plane = np.empty(3, dtype=np.float64)
+
+        if blocked[n] != 0:
+            dose_grid_terma[voxels[n, 0], voxels[n, 1], voxels[n, 2]] = cpu_voxel_terma(
+                voxels[n, 0], voxels[n, 1], voxels[n, 2], blocked[n],
+                d_eff[n], dose_grid_origin, dose_grid_spacing,
+                source_position, source_sad, source_transform, source_v_y,
+                sPri, zAnn, sAnn, rInner, rOuter, zExp, sExp, kExp,
+                softRatio, softLimit, hornRatio, attenuation,
+                attenuation_step, distance, pos_plane
+            )
+
+
+@numba.njit(parallel=True)
+def cpu_voxels_gather_dose(doses, voxels, dose_grid_spacing, dose_grid_size, dose_grid_terma, cone_directions, cone_rows, kernel, kernel_cutoffs):
+
+    # cpu_gather_dose at a list of voxels
+    for n in numba.prange(len(voxels)):
+
+        step = np.empty(3, dtype=np.int32)
+        t = np.empty(3, dtype=np.float64)
+        delta_t = np.empty(3, dtype=np.float64)
+        current_voxel = np.empty(3, dtype=np.int32)
+        direction = np.empty(3, dtype=np.float64)
+
+        doses[n] = cpu_gather_voxel(
+            voxels[n, 0], voxels[n, 1], voxels[n, 2], dose_grid_spacing,
+            dose_grid_size, dose_grid_terma, cone_directions, cone_rows,
+            kernel, kernel_cutoffs, step, t, delta_t, current_voxel, direction
+        )
@@ -0,0 +1,226 @@
+import numpy as np
+import numpy.typing as npt
+import numba
+from .cpu import cpu_dda_init, cpu_dda_axis, cpu_dda_inside
+
+
+# Batched voxel traversal.
+#
+# dda_3d traces a single ray in Python and the compiled DDAs are only
+# callable from inside the calculation kernels. Here many rays are traced in
+# one compiled, parallel call. As in cpu_dda_3d, each ray starts at the
+# centre of a voxel and t-values are the distances at which it leaves each
+# voxel it crosses. Rays cross different numbers of voxels, so results are
+# packed CSR-style: the voxels and t-values of ray i are entries
+# offsets[i]:offsets[i + 1] of the packed arrays. The rays are traversed once
+# to count their voxels, so the packed arrays can be allocated exactly, and
+# again to fill them.
+
+
+class RayTraces:
+    """ Voxels and t-values of a batch of traced rays.
+
+    Parameters
+    ----------
+    offsets : ndarray
+        Start of each ray in the packed arrays, plus the total number of
+        entries, shape (num_rays + 1,)
+    voxels : ndarray
+        Index of each traversed voxel, shape (offsets[-1], 3)
+    t_values : ndarray
+        Distance at which each ray leaves each traversed voxel, in cm
+    path_lengths : ndarray, optional
+        Radiological path length of each ray through the grid, when
+        densities were given
+    """
+
+    def __init__(self, offsets, voxels, t_values, path_lengths=None):
+        self.offsets = offsets
+        self.voxels = voxels
+        self.t_values = t_values
+        self.path_lengths = path_lengths
+
+    def __len__(self):
+        return len(self.offsets) - 1
+
+    def ray(self, index):
+        """ Voxels and t-values of a single ray.
+
+        Parameters
+        ----------
+        index : int
+            Index of the ray
+
+        Returns
+        -------
+        tuple of ndarray
+            Views of the traversed voxels and their t-values
+        """
+        start, end = self.offsets[index], self.offsets[index + 1]
+        return self.voxels[start:end], self.t_values[start:end]
+
+
+def raytrace(start_voxels: npt.NDArray[np.int32], directions: npt.NDArray[np.float64], dose_grid_spacing, dose_grid_size, densities=None) -> RayTraces:
+    """ Trace a batch of rays through a voxel grid.
+
+    Parameters
+    ----------
+    start_voxels : ndarray
+        Index of the voxel each ray starts from (at its centre), shape
+        (num_rays, 3)
+    directions : ndarray
+        Direction of each ray, shape (num_rays, 3). Need not be normalised.
+    dose_grid_spacing : ndarray
+        Voxel dimensions, in form [dim_x, dim_y, dim_z]
+    dose_grid_size : ndarray
+        Shape of the grid
+    densities : ndarray, optional
+        Density of each voxel. When given, the radiological path length of
+        each ray is accumulated while it is traced.
+
+    Returns
+    -------
+    RayTraces
+        Packed voxels and t-values of the rays
+    """
+    start_voxels, directions, spacing, size = _prepare(
+        start_voxels, directions, dose_grid_spacing, dose_grid_size
+    )
+    num_rays = len(start_voxels)
+
+    counts = np.zeros(num_rays, dtype=np.int64)
+    cpu_ray_counts(counts, start_voxels, directions, spacing, size)
+    offsets = np.zeros(num_rays + 1, dtype=np.int64)
+    np.cumsum(counts, out=offsets[1:])
+
+    voxels = np.empty((offsets[-1], 3), dtype=np.int32)
+    t_values = np.empty(offsets[-1], dtype=np.float64)
+    path_lengths = np.zeros(num_rays, dtype=np.float64)
+    use_densities = densities is not None
+    if not use_densities:
+        densities = np.zeros((1, 1, 1), dtype=np.float32)
+    cpu_raytrace(
+        offsets, voxels, t_values, path_lengths, start_voxels, directions,
+        spacing, size, densities, use_densities
+    )
+    return RayTraces(
+        offsets, voxels, t_values, path_lengths if use_densities else None
+    )
+
+
+def radiological_path_length(start_voxels: npt.NDArray[np.int32], directions: npt.NDArray[np.float64], dose_grid_spacing, densities) -> npt.NDArray[np.float64]:
+    """ Radiological path length of a batch of rays, from the centre of
+    their start voxels to the edge of the grid.
+
+    The traversed voxels are not stored, so this is cheaper than raytrace
+    when only the path lengths are needed.
+
+    Parameters
+    ----------
+    start_voxels : ndarray
+        Index of the voxel each ray starts from, shape (num_rays, 3)
+    directions : ndarray
+        Direction of each ray, shape (num_rays, 3). Need not be normalised.
+    dose_grid_spacing : ndarray
+        Voxel dimensions, in form [dim_x, dim_y, dim_z]
+    densities : ndarray
+        Density of each voxel
+
+    Returns
+    -------
+    ndarray
+        Sum of density times length over the voxels each ray crosses
+    """
+    start_voxels, directions, spacing, size = _prepare(
+        start_voxels, directions, dose_grid_spacing, densities.shape
+    )
+    path_lengths = np.zeros(len(start_voxels), dtype=np.float64)
+    cpu_path_lengths(
+        path_lengths, start_voxels, directions, spacing, size, densities
+    )
+    return path_lengths
+
+
+def _prepare(start_voxels, directions, dose_grid_spacing, dose_grid_size):
+    start_voxels = np.ascontiguousarray(start_voxels, dtype=np.int32).reshape((-1, 3))
+    directions = np.array(directions, dtype=np.float64).reshape((-1, 3))
+    if len(directions) != len(start_voxels):
+        raise ValueError("Every ray needs one start voxel and one direction.")
+    directions /= np.linalg.norm(directions, axis=1)[:, None]
+    spacing = np.asarray(dose_grid_spacing, dtype=np.float64)
+    size = np.asarray(dose_grid_size, dtype=np.int64)
+    return start_voxels, directions, spacing, size
+
+
+@numba.njit(parallel=True)
+def cpu_ray_counts(counts, start_voxels, directions, dose_grid_spacing, dose_grid_size):
+
+    for r in numba.prange(len(start_voxels)):
+        step = np.empty(3, dtype=np.int64)
+        voxel = np.empty(3, dtype=np.int64)
+        t = np.empty(3, dtype=np.float64)
+        delta_t = np.empty(3, dtype=np.float64)
+        cpu_dda_init(directions[r], dose_grid_spacing, step, t, delta_t)
+        for a in range(3):
+            voxel[a] = start_voxels[r, a]
+
+        count = 0
+        while cpu_dda_inside(voxel, dose_grid_size):
+            a = cpu_dda_axis(t)
+            t[a] += delta_t[a]
+            voxel[a] += step[a]
+            count += 1
+        counts[r] = count
+
+
+@numba.njit(parallel=True)
+def cpu_raytrace(offsets, voxels, t_values, path_lengths, start_voxels, directions, dose_grid_spacing, dose_grid_size, densities, use_densities):
+
+    for r in numba.prange(len(start_voxels)):
+        step = np.empty(3, dtype=np.int64)
+        voxel = np.empty(3, dtype=np.int64)
+        t = np.empty(3, dtype=np.float64)
+        delta_t = np.empty(3, dtype=np.float64)
+        cpu_dda_init(directions[r], dose_grid_spacing, step, t, delta_t)
+        for a in range(3):
+            voxel[a] = start_voxels[r, a]
+
+        n = offsets[r]
+        t_previous = 0.0
+        path = 0.0
+        while cpu_dda_inside(voxel, dose_grid_size):
+            a = cpu_dda_axis(t)
+            voxels[n, 0] = voxel[0]
+            voxels[n, 1] = voxel[1]
+            voxels[n, 2] = voxel[2]
+            t_values[n] = t[a]
+            if use_densities:
+                path += densities[voxel[0], voxel[1], voxel[2]] * (t[a] - t_previous)
+            t_previous = t[a]
+            t[a] += delta_t[a]
+            voxel[a] += step[a]
+            n += 1
+        path_lengths[r] = path
+
+
+@numba.njit(parallel=True)
+def cpu_path_lengths(path_lengths, start_voxels, directions, dose_grid_spacing, dose_grid_size, densities):
+
+    for r in numba.prange(len(start_voxels)):
+        step = np.empty(3, dtype=np.int64)
+        voxel = np.empty(3, dtype=np.int64)
+        t = np.empty(3, dtype=np.float64)
+        delta_t = np.empty(3, dtype=np.float64)
+        cpu_dda_init(directions[r], dose_grid_spacing, step, t, delta_t)
+        for a in range(3):
+            voxel[a] = start_voxels[r, a]
+
+        t_previous = 0.0
+        path = 0.0
+        while cpu_dda_inside(voxel, dose_grid_size):
+            a = cpu_dda_axis(t)
+            path += densities[voxel[0], voxel[1], voxel[2]] * (t[a] - t_previous)
+            t_previous = t[a]
+            t[a] += delta_t[a]
+            voxel[a] += step[a]
+        path_lengths[r] = path
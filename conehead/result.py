@@ -0,0 +1,165 @@
+import numpy as np
+
+
+INTERMEDIATES = (
+    'blocked', 'densities', 'd_eff', 'oad', 'fluence', 'fluence_map',
+    'f_soften', 'f_horn', 'terma', 'dose_primary', 'dose_scatter'
+)
+
+
+class CalculationResult:
+    """ Dose grid of a calculation, plus any intermediate grids kept.
+
+    Parameters
+    ----------
+    dose_grid : DoseGrid
+        Dose grid holding the calculated dose
+    intermediates : dict, optional
+        Intermediate grids kept from the calculation, keyed by name (see
+        INTERMEDIATES)
+    metadata : dict, optional
+        Details of how the dose was calculated, e.g. the kernel cutoff radii
+        and the energy left out by truncating the kernel
+    """
+
+    def __init__(self, dose_grid, intermediates=None, metadata=None):
+        self.dose_grid = dose_grid
+        self.intermediates = dict(intermediates or {})
+        self.metadata = dict(metadata or {})
+
+    @property
+    def dose(self):
+        return self.dose_grid.dose
+
+    def grid(self, name='dose'):
+        """ Get the dose grid or a kept intermediate grid.
+
+        Parameters
+        ----------
+        name : str
+            'dose' or the name of an intermediate grid
+
+        Returns
+        -------
+        ndarray
+            The requested grid
+        """
+        if name == 'dose':
+            return self.dose
+        if name not in self.intermediates:
+            raise KeyError(
+                f"The '{name}' grid was not kept. Add it to the"
+                " 'keepIntermediates' setting to keep it."
+            )
+        return self.intermediates[name]
+
+    def coordinates(self, axis):
+        """ Positions of the voxel centres along an axis of the grid.
+
+        Parameters
+        ----------
+        axis : int
+            Axis of the grid, 0 (x), 1 (y) or 2 (z)
+
+        Returns
+        -------
+        ndarray
+            Positions, in cm
+        """
+        return (
+            self.dose_grid.origin[axis] +
+            np.arange(self.dose_grid.size[axis]) * self.dose_grid.spacing[axis]
+        )
+
+    def slice(self, axis, index, name='dose'):
+        """ Extract a plane of a grid.
+
+        Parameters
+        ----------
+        axis : int
+            Axis normal to the plane, 0 (x), 1 (y) or 2 (z)
+        index : int
+            Index of the plane along the axis
+        name : str
+            'dose' or the name of an intermediate grid
+
+        Returns
+        -------
+        ndarray
+            Copy of the plane
+        """
+        return np.take(self.grid(name), index, axis=axis).copy()
+
+    def profile(self, axis, indices, name='dose'):
+        """ Extract a line of a grid.
+
+        Parameters
+        ----------
+        axis : int
+            Axis the line runs along, 0 (x), 1 (y) or 2 (z)
+        indices : tuple of int
+            Indices of the line along the other two axes, in axis order
+        name : str
+            'dose' or the name of an intermediate grid
+
+        Returns
+        -------
+        ndarray
+            Copy of the line
+        """
+        index = list(indices)
+        index.insert(axis, slice(None))
+        return self.grid(name)[tuple(index)].copy()
+
+    def plot(self, index=None, show=True):
+        """ Plot x planes of the dose and kept intermediate grids.
+
+        Parameters
+        ----------
+        index : int, optional
+            Index of the planes along x. Defaults to the centre of the grid.
+        show : bool
+            Whether to call plt.show() once the figure is built
+
+        Returns
+        -------
+        matplotlib.figure.Figure
+            The figure
+        """
+        import matplotlib.pyplot as plt
+
+        size = self.dose_grid.size
+        if index is None:
+            index = size[0] // 2
+        names = [n for n in INTERMEDIATES if n in self.intermediates] + ['dose']
+        num_axes = len(names) + 1
+        num_cols = int(np.ceil(np.sqrt(num_axes)))
+        num_rows = int(np.ceil(num_axes / num_cols))
+        fig, ax = plt.subplots(
+            num_rows, num_cols, figsize=[4 * num_cols, 4 * num_rows],
+            squeeze=False
+        )
+        ax = ax.ravel()
+        for a, name in zip(ax, names):
+            if self.grid(name).ndim == 2:  # Maps in the block plane
+                a.imshow(self.grid(name))
+            else:
+                a.imshow(self.slice(0, index, name))
+            a.set_title(name)
+
+        # Normalised depth profiles along the centre of the plane
+        y = self.coordinates(1)
+        for name in ('fluence', 'terma', 'dose'):
+            if name in names:
+                profile = self.profile(1, (index, size[2] // 2), name)
+                if np.max(profile) > 0:  # Fully blocked profiles stay at 0
+                    profile = profile / np.max(profile) * 100
+                ax[len(names)].plot(y, profile, label=name)
+        ax[len(names)].set_title("Central axis")
+        ax[len(names)].legend()
+        for a in ax[num_axes:]:
+            a.axis('off')
+        plt.tight_layout()
+        if show:
+            plt.show()
+        return fig
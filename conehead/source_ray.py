@@ -0,0 +1,217 @@
+import numpy as np
+import numba
+import math
+from .cpu import cpu_dda_init, cpu_dda_axis, cpu_dda_inside
+
+
+# Source-ray effective depth engine.
+#
+# cpu_d_eff traces a ray from every voxel back to the source, so neighbouring
+# voxels repeat almost the same traversal. Here rays are instead cast from the
+# source through a lattice of points (samples per voxel along each axis) on
+# the faces of the grid the rays leave by, and each is traversed once from
+# where it enters the grid to where it leaves (Siddon-style), accumulating
+# density times path length. Every voxel a ray crosses takes its depth from
+# the ray that passes closest to its centre. The ray does not go through the
+# centre, and near the faces the beam enters by it may have crossed much
+# more or less of the grid than the centre's own ray, so only the ray's
+# departure from unit density is taken from it: the voxel's depth is the
+# geometric path of its own ray inside the grid (a box intersection, no
+# traversal), plus the difference between the radiological and geometric
+# path of the nearest ray up to the point nearest the centre. In unit
+# density this is exact. Rays diverge from the source, so inside the grid
+# they are never further apart than on the exit faces and nearly every
+# voxel is crossed; the few that are not are traced back to the source
+# individually.
+#
+# Rows of rays far enough apart on the exit face never cross the same voxel
+# (their separation shrinks towards the source by no more than the ratio of
+# the distances to the near and exit faces), so the rows are traced in
+# phases of rows that many apart, each phase in parallel.
+
+
+@numba.njit(parallel=True)
+def cpu_source_ray_d_eff(dose_grid_size, dose_grid_origin, dose_grid_spacing, dose_grid_densities, source_position, d_eff, samples):
+
+    # Squared distance from each voxel centre to the nearest ray so far
+    closest = np.full((dose_grid_size[0], dose_grid_size[1], dose_grid_size[2]), np.inf)
+
+    for face in range(6):
+        a = face // 2
+        b = (a + 1) % 3
+        c = (a + 2) % 3
+        index_a = 0 if face % 2 == 0 else dose_grid_size[a] - 1
+
+        # Rays only need to be cast through the faces they leave the grid by
+        low = dose_grid_origin[a] - dose_grid_spacing[a] / 2
+        high = low + dose_grid_spacing[a] * dose_grid_size[a]
+        if face % 2 == 0 and source_position[a] <= low:
+            continue
+        if face % 2 == 1 and source_position[a] >= high:
+            continue
+
+        # Rows of rays that can share a voxel: two rays in one voxel are
+        # less than a voxel apart along b, plus the b their rays drift over a
+        # voxel along a, and at least the smallest fraction of their
+        # separation on the exit face is left inside the grid
+        num_rows = dose_grid_size[b] * samples
+        target_a = dose_grid_origin[a] + dose_grid_spacing[a] * index_a
+        near = low if face % 2 == 1 else high
+        fraction = (near - source_position[a]) / (target_a - source_position[a])
+        low_b = dose_grid_origin[b] - dose_grid_spacing[b] / 2
+        high_b = low_b + dose_grid_spacing[b] * dose_grid_size[b]
+        slope = max(abs(low_b - source_position[b]), abs(high_b - source_position[b])) / abs(target_a - source_position[a])
+        stride = num_rows
+        if fraction > 0:
+            separation = (dose_grid_spacing[b] + slope * dose_grid_spacing[a]) / fraction
+            stride = min(int(separation * samples / dose_grid_spacing[b]) + 1, num_rows)
+
+        for phase in range(stride):
+            for k in numba.prange((num_rows - phase + stride - 1) // stride):
+                index_b = phase + k * stride
+                target = np.empty(3, dtype=np.float64)
+                for index_c in range(dose_grid_size[c] * samples):
+                    target[a] = target_a
+                    target[b] = dose_grid_origin[b] + dose_grid_spacing[b] * ((index_b + 0.5) / samples - 0.5)
+                    target[c] = dose_grid_origin[c] + dose_grid_spacing[c] * ((index_c + 0.5) / samples - 0.5)
+                    _trace_source_ray(dose_grid_size, dose_grid_origin, dose_grid_spacing, dose_grid_densities, source_position, target, d_eff, closest)
+
+    # Trace any voxel no ray crossed back to the source
+    for x in numba.prange(dose_grid_size[0]):
+        step = np.empty(3, dtype=np.int32)
+        t = np.empty(3, dtype=np.float64)
+        delta_t = np.empty(3, dtype=np.float64)
+        current_voxel = np.empty(3, dtype=np.int32)
+        ray_direction = np.empty(3, dtype=np.float64)
+        for y in range(dose_grid_size[1]):
+            for z in range(dose_grid_size[2]):
+                if closest[x, y, z] < np.inf:
+                    continue
+                current_voxel[0] = x
+                current_voxel[1] = y
+                current_voxel[2] = z
+                ray_direction[0] = source_position[0] - (dose_grid_origin[0] + dose_grid_spacing[0] * x)
+                ray_direction[1] = source_position[1] - (dose_grid_origin[1] + dose_grid_spacing[1] * y)
+                ray_direction[2] = source_position[2] - (dose_grid_origin[2] + dose_grid_spacing[2] * z)
+                mag = math.sqrt(ray_direction[0] ** 2 + ray_direction[1] ** 2 + ray_direction[2] ** 2)
+                ray_direction[0] /= mag
+                ray_direction[1] /= mag
+                ray_direction[2] /= mag
+                cpu_dda_init(ray_direction, dose_grid_spacing, step, t, delta_t)
+                depth = 0.0
+                t_previous = 0.0
+                while cpu_dda_inside(current_voxel, dose_grid_size):
+                    a = cpu_dda_axis(t)
+                    depth += dose_grid_densities[current_voxel[0], current_voxel[1], current_voxel[2]] * (t[a] - t_previous)
+                    t_previous = t[a]
+                    t[a] += delta_t[a]
+                    current_voxel[a] += step[a]
+                d_eff[x, y, z] = depth
+
+
+@numba.njit
+def _trace_source_ray(dose_grid_size, dose_grid_origin, dose_grid_spacing, dose_grid_densities, source_position, target, d_eff, closest):
+
+    direction = np.empty(3, dtype=np.float64)
+    for a in range(3):
+        direction[a] = target[a] - source_position[a]
+    mag = math.sqrt(direction[0] ** 2 + direction[1] ** 2 + direction[2] ** 2)
+    for a in range(3):
+        direction[a] /= mag
+
+    # Where the ray enters and leaves the grid
+    t_enter = 0.0
+    t_leave = np.inf
+    for a in range(3):
+        low = dose_grid_origin[a] - dose_grid_spacing[a] / 2
+        high = low + dose_grid_spacing[a] * dose_grid_size[a]
+        if direction[a] == 0:
+            if source_position[a] < low or source_position[a] > high:
+                return
+            continue
+        t0 = (low - source_position[a]) / direction[a]
+        t1 = (high - source_position[a]) / direction[a]
+        t_enter = max(t_enter, min(t0, t1))
+        t_leave = min(t_leave, max(t0, t1))
+    if t_enter >= t_leave:
+        return
+
+    # First voxel and parametric distances to the next boundary on each axis
+    voxel = np.empty(3, dtype=np.int64)
+    step = np.empty(3, dtype=np.int64)
+    t_next = np.empty(3, dtype=np.float64)
+    t_delta = np.empty(3, dtype=np.float64)
+    t_mid = 0.5 * (t_enter + t_leave)
+    for a in range(3):
+        low = dose_grid_origin[a] - dose_grid_spacing[a] / 2
+        position = source_position[a] + direction[a] * min(t_enter + 1e-9 * t_mid, t_leave)
+        voxel[a] = min(max(int(math.floor((position - low) / dose_grid_spacing[a])), 0), dose_grid_size[a] - 1)
+        if direction[a] > 0:
+            step[a] = 1
+            t_next[a] = (low + (voxel[a] + 1) * dose_grid_spacing[a] - source_position[a]) / direction[a]
+            t_delta[a] = dose_grid_spacing[a] / direction[a]
+        elif direction[a] < 0:
+            step[a] = -1
+            t_next[a] = (low + voxel[a] * dose_grid_spacing[a] - source_position[a]) / direction[a]
+            t_delta[a] = -dose_grid_spacing[a] / direction[a]
+        else:
+            step[a] = 0
+            t_next[a] = np.inf
+            t_delta[a] = np.inf
+
+    depth = 0.0
+    t = t_enter
+    while True:
+        x = voxel[0]
+        y = voxel[1]
+        z = voxel[2]
+        density = dose_grid_densities[x, y, z]
+        t_exit = min(t_next[0], min(t_next[1], t_next[2]), t_leave)
+
+        # Point on the ray nearest the voxel centre
+        cx = dose_grid_origin[0] + dose_grid_spacing[0] * x - source_position[0]
+        cy = dose_grid_origin[1] + dose_grid_spacing[1] * y - source_position[1]
+        cz = dose_grid_origin[2] + dose_grid_spacing[2] * z - source_position[2]
+        t_centre = cx * direction[0] + cy * direction[1] + cz * direction[2]
+        distance = cx * cx + cy * cy + cz * cz - t_centre * t_centre
+        if distance < closest[x, y, z]:
+            closest[x, y, z] = distance
+            t_nearest = min(max(t_centre, t), t_exit)
+            excess = depth + density * (t_nearest - t) - (t_nearest - t_enter)
+            d_eff[x, y, z] = max(_path_in_grid(dose_grid_size, dose_grid_origin, dose_grid_spacing, cx, cy, cz, source_position) + excess, 0.0)
+
+        depth += density * (t_exit - t)
+        t = t_exit
+        if t >= t_leave:
+            return
+
+        # Step into the next voxel
+        if t_next[0] <= t_next[1] and t_next[0] <= t_next[2]:
+            a = 0
+        elif t_next[1] <= t_next[2]:
+            a = 1
+        else:
+            a = 2
+        voxel[a] += step[a]
+        if voxel[a] < 0 or voxel[a] >= dose_grid_size[a]:
+            return
+        t_next[a] += t_delta[a]
+
+
+@numba.njit
+def _path_in_grid(dose_grid_size, dose_grid_origin, dose_grid_spacing, cx, cy, cz, source_position):
+
+    # Length of the ray from the source to the voxel centre (cx, cy, cz,
+    # relative to the source) that lies inside the grid
+    t_centre = math.sqrt(cx * cx + cy * cy + cz * cz)
+    t_enter = 0.0
+    for a in range(3):
+        d = (cx, cy, cz)[a] / t_centre
+        if d == 0:
+            continue
+        low = dose_grid_origin[a] - dose_grid_spacing[a] / 2
+        high = low + dose_grid_spacing[a] * dose_grid_size[a]
+        t0 = (low - source_position[a]) / d
+        t1 = (high - source_position[a]) / d
+        t_enter = max(t_enter, min(t0, t1))
+    return t_centre - t_enter
@@ -0,0 +1,191 @@
+import numpy as np
+import numba
+from numba import cuda
+import math
+from .cache import LRUCache
+from .cpu import cpu_dda_3d, cpu_scatter_chunks
+
+
+# Ray-template ("stencil") dose engine.
+#
+# On a uniform grid the DDA traversal of a cone line leaving a voxel centre is
+# the same for every voxel apart from a shift, as are the kernel indices of
+# its boundary crossings. The traversal is therefore done once per cone, the
+# resulting voxel offsets and cumulative kernel increments of all cones are
+# merged into a single sparse stencil, and the dose calculation reduces to
+# scattering each TERMA voxel through that stencil. The stencils of the last
+# few grids and cone sets are cached.
+
+_stencil_cache = LRUCache(maxsize=8)
+
+
+def ray_template_stencil(dose_grid_spacing, dose_grid_size, kernel_thetas, kernel_phis, kernel):
+    """ Build (or fetch from cache) the dose deposition stencil of a cone set.
+
+    Parameters
+    ----------
+    dose_grid_spacing : ndarray
+        Voxel dimensions, in form [dim_x, dim_y, dim_z]
+    dose_grid_size : ndarray
+        Shape of the dose grid. Offsets that cannot land inside a grid of this
+        size are not kept.
+    kernel_thetas : ndarray
+        Azimuthal kernel cone angles, in degrees
+    kernel_phis : ndarray
+        Altitudinal kernel cone angles, in degrees
+    kernel : ndarray
+        Cumulative kernel resampled to 0.1 mm, shape (len(kernel_phis), n),
+        held at its last sample beyond 0.1 (n - 1) mm
+
+    Returns
+    -------
+    tuple of ndarray
+        Voxel offsets (n, 3) and the matching fraction of TERMA deposited at
+        each offset (n,)
+    """
+    key = (
+        tuple(np.asarray(dose_grid_spacing, dtype=np.float64)),
+        tuple(int(s) for s in dose_grid_size),
+        np.asarray(kernel_thetas).tobytes(),
+        np.asarray(kernel_phis).tobytes(),
+        np.shape(kernel),
+        np.asarray(kernel, dtype=np.float64).tobytes(),
+    )
+
+    def build():
+        offsets, values = _trace_templates(
+            np.asarray(dose_grid_spacing, dtype=np.float64),
+            np.asarray(dose_grid_size, dtype=np.int64),
+            np.asarray(kernel_thetas, dtype=np.float64),
+            np.asarray(kernel_phis, dtype=np.float64),
+            np.asarray(kernel, dtype=np.float64)
+        )
+
+        # Merge the entries of all cones landing on the same voxel offset
+        extent = 2 * np.asarray(dose_grid_size, dtype=np.int64) - 1
+        shifted = offsets + (np.asarray(dose_grid_size, dtype=np.int64) - 1)
+        linear = np.ravel_multi_index(shifted.T, extent)
+        unique, inverse = np.unique(linear, return_inverse=True)
+        merged = np.bincount(inverse.ravel(), weights=values)
+        keep = merged != 0
+        offsets = np.array(np.unravel_index(unique[keep], extent)).T
+        offsets = offsets - (np.asarray(dose_grid_size, dtype=np.int64) - 1)
+        return (
+            np.ascontiguousarray(offsets, dtype=np.int32),
+            merged[keep]
+        )
+
+    return _stencil_cache.get(key, build)
+
+
+@numba.njit
+def _trace_templates(dose_grid_spacing, dose_grid_size, kernel_thetas, kernel_phis, kernel):
+
+    # Trace every cone from the centre voxel of a grid just large enough to
+    # hold any in-grid offset
+    template_size = 2 * dose_grid_size - 1
+    max_array_length = template_size[0] + template_size[1] + template_size[2]
+    num_rays = len(kernel_thetas) * len(kernel_phis)
+    offsets = np.empty((num_rays * max_array_length, 3), dtype=np.int64)
+    values = np.empty(num_rays * max_array_length, dtype=np.float64)
+
+    intersection_t_values = np.empty(max_array_length, dtype=np.float64)
+    voxels_traversed = np.empty((max_array_length, 3), dtype=np.int32)
+    current_voxel = np.empty(3, dtype=np.int32)
+    direction = np.empty(3, dtype=np.float64)
+
+    last_index = kernel.shape[1] - 1
+    count = 0
+    for i in range(len(kernel_thetas)):
+        for j in range(len(kernel_phis)):
+
+            current_voxel[0] = dose_grid_size[0] - 1
+            current_voxel[1] = dose_grid_size[1] - 1
+            current_voxel[2] = dose_grid_size[2] - 1
+
+            theta_rad = kernel_thetas[i] * math.pi / 180.0
+            phi_rad = kernel_phis[j] * math.pi / 180.0
+            direction[0] = math.cos(theta_rad) * math.sin(phi_rad)
+            direction[1] = math.cos(phi_rad)
+            direction[2] = math.sin(theta_rad) * math.sin(phi_rad)
+            N = math.sqrt(direction[0] * direction[0] + direction[1] * direction[1] + direction[2] * direction[2])
+            direction[0] /= N
+            direction[1] /= N
+            direction[2] /= N
+
+            voxels_traversed_count, _ = cpu_dda_3d(
+                current_voxel,
+                direction,
+                dose_grid_spacing,
+                template_size,
+                voxels_traversed,
+                intersection_t_values
+            )
+
+            index2 = 0
+            for m in range(voxels_traversed_count):
+                index1 = abs(math.floor(intersection_t_values[m] * 100.0 - 5.0))
+                if index1 > last_index:
+                    index1 = last_index
+                if m == 0:
+                    k3 = kernel[j, index1]
+                else:
+                    k3 = kernel[j, index1] - kernel[j, index2]
+                index2 = index1
+                if k3 != 0:
+                    offsets[count, 0] = voxels_traversed[m, 0] - (dose_grid_size[0] - 1)
+                    offsets[count, 1] = voxels_traversed[m, 1] - (dose_grid_size[1] - 1)
+                    offsets[count, 2] = voxels_traversed[m, 2] - (dose_grid_size[2] - 1)
+                    values[count] = k3
+                    count += 1
+
+    return offsets[:count], values[:count]
+
+
+@numba.njit(parallel=True)
+def cpu_stencil_dose(dose_grid_dose, dose_grid_size, dose_grid_terma, active_voxels, stencil_offsets, stencil_values):
+
+    # Per-thread dose grids and active voxels, as in cpu_dose
+    n_chunks = cpu_scatter_chunks(dose_grid_size[0] * dose_grid_size[1] * dose_grid_size[2] * dose_grid_dose.itemsize)
+    partial = np.zeros((n_chunks, dose_grid_size[0], dose_grid_size[1], dose_grid_size[2]), dtype=dose_grid_dose.dtype)
+
+    for c in numba.prange(n_chunks):
+        for n in range(c, len(active_voxels), n_chunks):
+            x = active_voxels[n, 0]
+            y = active_voxels[n, 1]
+            z = active_voxels[n, 2]
+            T = dose_grid_terma[x, y, z]
+            for s in range(len(stencil_values)):
+                tx = x + stencil_offsets[s, 0]
+                ty = y + stencil_offsets[s, 1]
+                tz = z + stencil_offsets[s, 2]
+                if (tx >= 0 and tx < dose_grid_size[0] and
+                        ty >= 0 and ty < dose_grid_size[1] and
+                        tz >= 0 and tz < dose_grid_size[2]):
+                    partial[c, tx, ty, tz] += T * stencil_values[s]
+
+    for x in numba.prange(dose_grid_size[0]):
+        for c in range(n_chunks):
+            dose_grid_dose[x, :, :] += partial[c, x, :, :]
+
+
+@cuda.jit
+def cuda_stencil_dose(dose_grid_dose, dose_grid_size, dose_grid_terma, active_voxels, stencil_offsets, stencil_values):
+
+    # One thread per active voxel
+    n = cuda.grid(1)
+
+    if n < active_voxels.shape[0]:
+
+        x = active_voxels[n, 0]
+        y = active_voxels[n, 1]
+        z = active_voxels[n, 2]
+        T = dose_grid_terma[x, y, z]
+        for s in range(len(stencil_values)):
+            tx = x + stencil_offsets[s, 0]
+            ty = y + stencil_offsets[s, 1]
+            tz = z + stencil_offsets[s, 2]
+            if (tx >= 0 and tx < dose_grid_size[0] and
+                    ty >= 0 and ty < dose_grid_size[1] and
+                    tz >= 0 and tz < dose_grid_size[2]):
+                cuda.atomic.add(dose_grid_dose, (tx, ty, tz), T * stencil_values[s])
@@ -0,0 +1,52 @@
+import numpy as np
+from .nist import mu_water
+
+
+# Spectrum-weighted attenuation table.
+#
+# The TERMA of a voxel is its fluence and horn factor times
+#
+#     sum_i w_i E_i mu_i exp(-mu_i f_soften d_eff)
+#
+# over the energy bins of the spectrum. The sum only depends on the softened
+# effective depth f_soften * d_eff, so it is tabulated once per spectrum on a
+# uniform grid of depths and the TERMA kernels interpolate it linearly. Each
+# voxel then costs one lookup however many energy bins the spectrum has. The
+# sum is smooth on the scale of the attenuation lengths (> 10 cm), so at the
+# default 0.1 mm step the interpolation error is below one part in 10^6.
+
+# Depth step of the attenuation table (cm)
+ATTENUATION_TABLE_STEP = 0.01
+
+
+def attenuation_table(energy, energy_weights, max_depth, step=ATTENUATION_TABLE_STEP):
+    """ Tabulate the spectrum-weighted attenuation against softened
+    effective depth.
+
+    Parameters
+    ----------
+    energy : ndarray
+        Energy of each spectrum bin (units of MV)
+    energy_weights : ndarray
+        Weight of each spectrum bin
+    max_depth : float
+        Largest softened effective depth to tabulate, in cm. Lookups beyond
+        the end of the table are clamped to its last entry.
+    step : float
+        Depth step of the table, in cm
+
+    Returns
+    -------
+    ndarray
+        Sum over the bins of weight x energy x mu x exp(-mu x depth) at
+        depths 0, step, 2 step, ...
+    """
+    energy = np.asarray(energy, dtype=np.float64)
+    energy_weights = np.asarray(energy_weights, dtype=np.float64)
+    mu_w = np.asarray(mu_water(energy), dtype=np.float64)
+    depths = np.arange(int(np.ceil(max_depth / step)) + 2) * step
+    table = np.zeros_like(depths)
+    for w, e, mu in zip(energy_weights, energy, mu_w):
+        if w != 0:
+            table += w * e * mu * np.exp(-mu * depths)
+    return table.astype(np.float32)
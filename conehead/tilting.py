@@ -0,0 +1,114 @@
+import numpy as np
+import numpy.typing as npt
+
+
+# Kernel tilting.
+#
+# The kernels are scored about the direction of the incident photons, which
+# diverge from the source, so each voxel's cone set should be turned to
+# point along the ray from the source through it. Rotating the cone
+# directions of every voxel in the dose engine would add trig to the hot
+# loop, so the tilt is binned instead. The direction of the ray through each
+# active voxel is described by its divergence from the beam axis along the
+# beam's x and z axes, which is rounded to a multiple of the bin angle. For
+# every bin in use the cone set is rotated, once, so that the kernel axis
+# lies along the bin's ray, and the engines just look up the directions of
+# their voxel's bin. The rotation is rigid, so each cone keeps its kernel
+# row. Without tilting there is a single bin, holding the cone set fixed in
+# the world frame.
+
+
+def cone_table(kernel_thetas: npt.NDArray[np.float32], kernel_phis: npt.NDArray[np.float32], axes=None):
+    """ Tabulate the cone directions of each tilt bin and their kernel rows.
+
+    Parameters
+    ----------
+    kernel_thetas : ndarray
+        Azimuthal angles of the cone lines, in degrees
+    kernel_phis : ndarray
+        Polar angles of the cones from the kernel axis, in degrees
+    axes : ndarray, optional
+        Direction of the kernel axis of each bin, shape (num_bins, 3).
+        Defaults to a single bin with the kernel axis along +y, the world
+        frame directions.
+
+    Returns
+    -------
+    tuple
+        Unit direction of each cone line of each bin, shape (num_bins,
+        num_thetas * num_phis, 3), and the kernel row (phi index) of each
+        cone line (int32)
+    """
+    theta = np.radians(np.asarray(kernel_thetas, dtype=np.float64))[:, None]
+    phi = np.radians(np.asarray(kernel_phis, dtype=np.float64))[None, :]
+    directions = np.stack(np.broadcast_arrays(
+        np.cos(theta) * np.sin(phi),
+        np.cos(phi),
+        np.sin(theta) * np.sin(phi)
+    ), axis=-1).reshape((-1, 3))
+    directions /= np.linalg.norm(directions, axis=1)[:, None]
+    rows = np.tile(np.arange(len(kernel_phis), dtype=np.int32), len(kernel_thetas))
+    if axes is None:
+        axes = np.array([[0.0, 1.0, 0.0]])
+    rotations = np.array([_rotation_from_y(axis) for axis in np.asarray(axes, dtype=np.float64)])
+    return np.ascontiguousarray(np.einsum('bij,cj->bci', rotations, directions)), rows
+
+
+def divergence_bins(active_voxels: npt.NDArray[np.int32], dose_grid_origin, dose_grid_spacing, source_position, source_transform, bin_angle):
+    """ Bin the divergence of the ray through each active voxel.
+
+    Parameters
+    ----------
+    active_voxels : ndarray
+        Index of each active voxel, shape (num_active, 3)
+    dose_grid_origin : ndarray
+        Position of the first dose grid voxel centre, in cm
+    dose_grid_spacing : ndarray
+        Voxel dimensions, in form [dim_x, dim_y, dim_z]
+    source_position : ndarray
+        Position of the source, in cm
+    source_transform : ndarray
+        Rotation from world to source coordinates
+    bin_angle : float
+        Width of the bins of divergence along each beam axis, in degrees
+
+    Returns
+    -------
+    tuple
+        Bin of each active voxel (int32) and the ray direction of each bin
+        in world coordinates, shape (num_bins, 3)
+    """
+    if not bin_angle > 0:
+        raise ValueError("The tilt bin angle must be positive.")
+    transform = np.asarray(source_transform, dtype=np.float64)
+    positions = (
+        np.asarray(dose_grid_origin, dtype=np.float64) +
+        active_voxels * np.asarray(dose_grid_spacing, dtype=np.float64)
+    )
+    rays = (positions - np.asarray(source_position, dtype=np.float64)) @ transform.T
+    divergence = np.degrees(np.arctan2(rays[:, [0, 2]], rays[:, [1]]))
+    bins, voxel_bins = np.unique(
+        np.round(divergence / bin_angle).astype(np.int64), axis=0,
+        return_inverse=True
+    )
+    tangents = np.tan(np.radians(bins * bin_angle))
+    axes = np.stack(
+        [tangents[:, 0], np.ones(len(bins)), tangents[:, 1]], axis=1
+    )
+    axes /= np.linalg.norm(axes, axis=1)[:, None]
+    return voxel_bins.ravel().astype(np.int32), axes @ transform
+
+
+def _rotation_from_y(axis):
+    # Rotation taking +y onto the unit axis (Rodrigues' formula)
+    axis = axis / np.linalg.norm(axis)
+    c = axis[1]
+    if c < -1 + 1e-12:  # Opposite to +y, half a turn about x
+        return np.diag([1.0, -1.0, -1.0])
+    v = np.array([axis[2], 0.0, -axis[0]])  # y cross axis
+    skew = np.array([
+        [0.0, -v[2], v[1]],
+        [v[2], 0.0, -v[0]],
+        [-v[1], v[0], 0.0]
+    ])
+    return np.eye(3) + skew + skew @ skew / (1 + c)
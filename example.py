@@ -1,5 +1,6 @@
 from conehead.source import Source
 from conehead.block import Block
+from conehead.aperture import Aperture
 from conehead.phantom import SimplePhantom
 from conehead.conehead import Conehead
 
@@ -19,6 +20,9 @@ source.collimator = 0
 # block = Block(source.rotation, plan=plan)
 block = Block()
 block.set_square(10)
+# Or use an analytic aperture, which is not rasterised
+# block = Aperture.from_plan(plan)
+# block = Aperture.square(10)
 
 # Use a simple cubic phantom
 phantom = SimplePhantom()
@@ -41,6 +45,23 @@ settings = {
     # 'eHigh': 7.0,  # MeV
     # 'eNum': 500,  # Spectrum samples
     'fluenceResampling': 3,  # Split voxels for fluence calculation
+    'hitTest': 'supersample',  # 'supersample' or 'footprint' (summed-area table)
+    'depthEngine': 'voxelRay',  # 'voxelRay' or 'sourceRay' (rays cast once from the source)
+    'calculationFrame': 'doseGrid',  # 'doseGrid' or 'beam' (divergent beam's-eye-view grid)
+    'termaStage': 'separate',  # 'separate' or 'fused' (one pass, only the TERMA grid is written)
+    'fluenceEngine': 'voxel',  # 'voxel' or 'map' (2D beam's-eye-view map, projected onto the dose grid)
+    # 'fluenceMapSpacing': 0.1,  # cm, in the block plane (default half a voxel)
+    'extraFocal': 'radial',  # 'radial' or 'collimated' (seen through the block, needs the fluence map)
+    # 'zCol': 40.0,  # cm, effective collimating plane for collimated extra-focal sources
+    'backend': 'auto',  # 'cuda', 'cpu' or 'auto' (CUDA when available)
+    'doseEngine': 'raycast',  # 'raycast', 'stencil', 'collapsedCone', 'fft', 'cython' or 'gather'
+    'termaThreshold': 0.0,  # Skip voxels with TERMA at or below this fraction of the maximum
+    'kernelEnergyFraction': 1.0,  # Stop cone lines where this fraction of each cone's energy is deposited
+    'kernelScaling': 'geometric',  # 'geometric' or 'radiological' (density scaled) kernel lookup
+    'doseChannels': 'total',  # 'total' or 'primaryScatter' (deposited together, keep 'dose_primary'/'dose_scatter' to see them)
+    'kernelTilting': 'none',  # 'none' or 'divergent' (cones follow the ray from the source, binned every 'tiltBinAngle' degrees)
+    # 'tiltBinAngle': 1.0,  # degrees of divergence per tilt bin
+    'keepIntermediates': ['blocked', 'd_eff', 'oad', 'fluence', 'terma'],  # Grids kept for plotting
     'energy_weights': {  # Varian Clinac iX 6MV
         "0.5": 0.08196,
         "1.0": 0.12385,
@@ -58,8 +79,12 @@ settings = {
 }
 
 conehead = Conehead()
-conehead.calculate(source, block, phantom, settings)
-# conehead.plot()
+result = conehead.calculate(source, block, phantom, settings)
+result.plot()
+
+# Depth dose on the central axis, without the full grid
+# depths = np.stack((np.zeros(101), np.linspace(0, 20, 101), np.zeros(101)), axis=1)
+# pdd = conehead.calculate_points(source, block, phantom, depths, settings)
 
 # import cProfile
 # cProfile.run('conehead.calculate(source, block, phantom, settings)')
\ No newline at end of file
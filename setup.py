@@ -4,11 +4,11 @@ from Cython.Build import cythonize
 import numpy as np
 import os
 
-os.environ["CFLAGS"] = "-O0"
+os.environ["CFLAGS"] = "-O3"
 
 ext_modules = [
     Extension(
-        "conehead",
+        "conehead.*",
         ["conehead/*.pyx"],
         extra_compile_args=['-fopenmp'],
         extra_link_args=['-fopenmp'],
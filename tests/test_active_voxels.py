@@ -0,0 +1,40 @@
+import pytest
+import numpy as np
+from conehead.active_voxels import active_voxels
+from conehead.tilting import cone_table
+from conehead.cpu import cpu_dose
+
+
+class TestActiveVoxels:
+
+    def test_packed_indices(self):
+        terma = np.zeros((4, 5, 6), dtype=np.float32)
+        terma[1, 2, 3] = 1.0
+        terma[0, 4, 5] = 0.5
+        terma[3, 0, 0] = 0.001
+        active = active_voxels(terma)
+        assert active.dtype == np.int32
+        assert active.flags['C_CONTIGUOUS']
+        np.testing.assert_array_equal(active, [[0, 4, 5], [1, 2, 3], [3, 0, 0]])
+        np.testing.assert_array_equal(active_voxels(terma, 0.01), [[0, 4, 5], [1, 2, 3]])
+        assert active_voxels(np.zeros((2, 2, 2))).shape == (0, 3)
+        with pytest.raises(ValueError):
+            active_voxels(terma, 1.0)
+
+    def test_threshold_dose(self):
+        # Convolving the thresholded list matches convolving the TERMA with
+        # the small values zeroed
+        size = np.array([6, 7, 5])
+        spacing = np.array([0.5, 0.5, 0.5], dtype=np.float32)
+        rng = np.random.default_rng(0)
+        terma = rng.random(size).astype(np.float32)
+        thetas = np.array([0, 120, 240], dtype=np.float32)
+        phis = np.array([30, 90, 150], dtype=np.float32)
+        kernel = np.tile(np.linspace(0, 1, 5996), (3, 1))
+
+        dose = np.zeros(size, dtype=np.float32)
+        cpu_dose(dose[None], spacing, size, terma[None], active_voxels(terma, 0.5), np.zeros(1, dtype=np.int32), *cone_table(thetas, phis), kernel[None], np.full(len(phis), 5995), np.zeros((1, 1, 1)), False)
+        thresholded = np.where(terma > 0.5 * terma.max(), terma, 0).astype(np.float32)
+        correct = np.zeros(size, dtype=np.float32)
+        cpu_dose(correct[None], spacing, size, thresholded[None], active_voxels(thresholded), np.zeros(1, dtype=np.int32), *cone_table(thetas, phis), kernel[None], np.full(len(phis), 5995), np.zeros((1, 1, 1)), False)
+        np.testing.assert_allclose(dose, correct, rtol=1e-6)
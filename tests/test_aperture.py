@@ -0,0 +1,45 @@
+import numpy as np
+import pydicom
+from conehead.aperture import Aperture, cpu_aperture_hit_test
+from conehead.block import Block
+from conehead.cpu import cpu_hit_test
+from conehead.source import Source
+
+
+class TestAperture:
+
+    def _compare_to_raster(self, aperture, block):
+        # Block rasterises each position into the pixel 0.1 mm beyond it
+        rng = np.random.default_rng(0)
+        pixels = rng.integers(0, 4000, (20000, 2))
+        positions = (pixels - 1999 + 0.5) / 100 - 0.01
+        result = [aperture.transmission(p) for p in positions]
+        correct = block.block_values[pixels[:, 0], pixels[:, 1]]
+        np.testing.assert_array_almost_equal(result, correct)
+
+    def test_square(self):
+        block = Block()
+        block.set_square(10)
+        self._compare_to_raster(Aperture.square(10), block)
+
+    def test_plan(self):
+        plan = pydicom.dcmread("tests/RP.3DCRT.dcm", force=True)
+        aperture = Aperture.from_plan(plan)
+        assert aperture.leaf_ends.shape == (2, 60)
+        self._compare_to_raster(aperture, Block(plan=plan))
+
+    def test_aperture_hit_test(self):
+        source = Source("varian_clinac_6MV")
+        source.collimator = 20
+        block = Block()
+        block.set_square(10)
+        aperture = Aperture.square(10)
+        size = np.array([11, 5, 11])
+        origin = np.array([-10, 0, -10], dtype=np.float32)
+        spacing = np.array([2, 2, 2], dtype=np.float32)
+
+        correct = np.zeros(size)
+        cpu_hit_test(correct, size, origin, spacing, source.position, source.v_y, source.transform, block.block_values, 3)
+        blocked = np.zeros(size)
+        cpu_aperture_hit_test(blocked, size, origin, spacing, source.position, source.v_y, source.transform, aperture.jaws, aperture.leaf_boundaries, aperture.leaf_ends, 3)
+        np.testing.assert_allclose(blocked, correct, atol=0.04)
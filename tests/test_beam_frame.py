@@ -0,0 +1,62 @@
+import pytest
+import numpy as np
+from conehead.beam_frame import BeamFrame
+from conehead.block import Block
+from conehead.conehead import Conehead
+from conehead.cpu import cpu_d_eff, cpu_hit_test, cpu_oad
+from conehead.source import Source
+
+
+class TestBeamFrame:
+
+    def setup_method(self):
+        self.source = Source("varian_clinac_6MV")
+        self.source.gantry = 30
+        self.source.collimator = 20
+        self.size = np.array([21, 21, 21])
+        self.origin = np.array([-10, 0, -10], dtype=np.float32)
+        self.spacing = np.array([1, 1, 1], dtype=np.float32)
+        self.frame = BeamFrame(self.source, self.size, self.origin, self.spacing)
+
+    def test_select_calculation_frame(self):
+        conehead = Conehead()
+        assert conehead._select_calculation_frame({}) == 'doseGrid'
+        assert conehead._select_calculation_frame({'calculationFrame': 'beam'}) == 'beam'
+        with pytest.raises(NotImplementedError):
+            conehead._select_calculation_frame({'calculationFrame': 'polar'})
+
+    def test_source_inside_grid(self):
+        source = Source("varian_clinac_6MV")
+        with pytest.raises(NotImplementedError):
+            BeamFrame(source, np.array([3, 3, 3]), np.array([-1, -101, -1]), np.array([1, 1, 1]))
+
+    def test_d_eff(self):
+        densities = np.ones(self.size, dtype=np.float32)
+        densities[5:10, 7:10, :] = 0.3
+        densities[:, 14:, 10:] = 1.8
+        correct = np.zeros(self.size, dtype=np.float32)
+        cpu_d_eff(self.size, self.origin, self.spacing, densities, self.source.position, correct)
+        d_eff = self.frame.to_dose_grid(self.frame.d_eff(self.frame.densities(densities)))
+
+        # Away from the edges of the grid, where neighbouring columns may
+        # leave through different faces
+        error = np.abs(d_eff - correct)[2:-2, 2:-2, 2:-2]
+        assert np.mean(error / correct[2:-2, 2:-2, 2:-2]) < 0.01
+        assert np.max(error) < 1.0
+
+    def test_oad(self):
+        correct = np.zeros(self.size, dtype=np.float32)
+        cpu_oad(correct, self.size, self.origin, self.spacing, self.source.position, self.source.sad, self.source.transform, self.source.v_y)
+        oad = self.frame.to_dose_grid(self.frame.oad())
+
+        # Interpolation only rounds off the apex of the distance on the axis
+        assert np.abs(oad - correct).max() < 0.5 * self.frame.spacing[0]
+        assert np.abs(oad - correct).mean() < 0.01
+
+    def test_transmission(self):
+        block = Block()
+        block.set_square(10)
+        correct = np.zeros(self.size)
+        cpu_hit_test(correct, self.size, self.origin, self.spacing, self.source.position, self.source.v_y, self.source.transform, block.block_values, 12)
+        blocked = self.frame.to_dose_grid(self.frame.transmission(block, 3))
+        assert np.abs(blocked - correct).mean() < 0.01
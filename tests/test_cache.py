@@ -0,0 +1,25 @@
+import pytest
+from conehead.cache import LRUCache
+
+
+class TestLRUCache:
+
+    def test_evicts_least_recently_used(self):
+        cache = LRUCache(maxsize=2)
+        builds = []
+
+        def build(value):
+            return lambda: builds.append(value) or value
+
+        assert cache.get('a', build(1)) == 1
+        assert cache.get('b', build(2)) == 2
+        assert cache.get('a', build(3)) == 1
+        cache.get('c', build(4))
+        assert len(cache) == 2
+        assert 'a' in cache and 'b' not in cache
+        assert builds == [1, 2, 4]
+
+        cache.clear()
+        assert len(cache) == 0
+        with pytest.raises(ValueError):
+            LRUCache(maxsize=0)
@@ -0,0 +1,41 @@
+import numpy as np
+from conehead.active_voxels import active_voxels
+from conehead.tilting import cone_table
+from conehead.cpu import cpu_dose
+from conehead.collapsed_cone import (
+    cpu_collapsed_cone, exponential_kernel_fit, DECAY_COEFFICIENTS
+)
+
+
+class TestCollapsedCone:
+
+    def setup_method(self):
+        radii = np.linspace(0.05, 60.0, 5996)
+        basis = 1 - np.exp(-np.outer(radii, DECAY_COEFFICIENTS))
+        self.amplitudes = np.array([
+            [0.0, 0.0, 0.1, 0.0, 0.2, 0.0, 0.3, 0.0],
+            [0.0, 0.05, 0.0, 0.0, 0.0, 0.1, 0.0, 0.0],
+        ])
+        self.kernel = self.amplitudes @ basis.T
+
+    def test_exponential_kernel_fit(self):
+        amplitudes = exponential_kernel_fit(self.kernel)
+        np.testing.assert_array_almost_equal(self.amplitudes, amplitudes)
+
+    def test_axis_aligned_cones_match_raycast(self):
+        # Along the grid axes the transport lines coincide with the cast
+        # rays, so both engines must agree for an exponential kernel
+        size = np.array([6, 7, 5])
+        spacing = np.array([0.5, 0.5, 0.5], dtype=np.float32)
+        thetas = np.array([0, 90], dtype=np.float32)
+        phis = np.array([90, 180], dtype=np.float32)
+        rng = np.random.default_rng(1)
+        terma = rng.random(size).astype(np.float32)
+        densities = np.ones(size, dtype=np.float32)
+
+        correct = np.zeros(size, dtype=np.float32)
+        cpu_dose(correct[None], spacing, size, terma[None], active_voxels(terma), np.zeros(1, dtype=np.int32), *cone_table(thetas, phis), self.kernel[None], np.full(len(phis), 5995), np.zeros((1, 1, 1)), False)
+
+        dose = np.zeros(size, dtype=np.float32)
+        cpu_collapsed_cone(dose, spacing, size, terma, densities, thetas, phis, self.amplitudes, DECAY_COEFFICIENTS)
+        np.testing.assert_allclose(dose, correct, rtol=1e-3)
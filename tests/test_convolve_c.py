@@ -0,0 +1,61 @@
+import pytest
+import numpy as np
+from conehead.active_voxels import active_voxels
+from conehead.tilting import cone_table
+from conehead.cpu import cpu_dose
+from conehead.kernel import truncated_kernel
+
+convolve_c = pytest.importorskip("conehead.convolve_c").convolve_c
+
+
+class TestConvolveC:
+
+    def test_matches_cpu_dose(self):
+        size = np.array([9, 11, 9])
+        spacing = np.array([0.5, 0.5, 0.5], dtype=np.float32)
+        rng = np.random.default_rng(0)
+        terma = np.zeros(size, dtype=np.float32)
+        terma[2:7, :, 2:7] = rng.random((5, 11, 5))
+        thetas = np.linspace(0, 330, 12, dtype=np.float32)
+        phis = np.array([15, 45, 90, 135], dtype=np.float32)
+        kernel = np.cumsum(rng.random((4, 5996)), axis=1) / 5996
+
+        correct = np.zeros(size, dtype=np.float32)
+        cpu_dose(correct[None], spacing, size, terma[None], active_voxels(terma), np.zeros(1, dtype=np.int32), *cone_table(thetas, phis), kernel[None], np.full(len(phis), 5995), np.zeros((1, 1, 1)), False)
+        dose = np.zeros(size, dtype=np.float32)
+        convolve_c(terma, dose, spacing, thetas, phis, kernel)
+        np.testing.assert_allclose(dose, correct, rtol=1e-4, atol=1e-6)
+
+    def test_kernel_cutoffs(self):
+        size = np.array([9, 11, 9])
+        spacing = np.array([0.25, 0.25, 0.25], dtype=np.float32)
+        rng = np.random.default_rng(1)
+        terma = rng.random(size).astype(np.float32)
+        thetas = np.linspace(0, 270, 4, dtype=np.float32)
+        phis = np.array([30, 90, 150], dtype=np.float32)
+        radii = np.linspace(0.05, 60.0, 5996)
+        kernel, cutoffs, _ = truncated_kernel(
+            np.stack([1 - np.exp(-radii / s) for s in (0.2, 0.4, 0.8)]), 0.9
+        )
+
+        correct = np.zeros(size, dtype=np.float32)
+        cpu_dose(correct[None], spacing, size, terma[None], active_voxels(terma), np.zeros(1, dtype=np.int32), *cone_table(thetas, phis), kernel[None], cutoffs, np.zeros((1, 1, 1)), False)
+        dose = np.zeros(size, dtype=np.float32)
+        convolve_c(terma, dose, spacing, thetas, phis, kernel, kernel_cutoffs=cutoffs)
+        np.testing.assert_allclose(dose, correct, rtol=1e-4, atol=1e-6)
+
+    def test_radiological(self):
+        size = np.array([9, 11, 9])
+        spacing = np.array([0.5, 0.5, 0.5], dtype=np.float32)
+        rng = np.random.default_rng(2)
+        terma = rng.random(size).astype(np.float32)
+        densities = (0.2 + rng.random(size)).astype(np.float32)
+        thetas = np.linspace(0, 300, 6, dtype=np.float32)
+        phis = np.array([30, 90, 150], dtype=np.float32)
+        kernel = np.cumsum(rng.random((3, 5996)), axis=1) / 5996
+
+        correct = np.zeros(size, dtype=np.float32)
+        cpu_dose(correct[None], spacing, size, terma[None], active_voxels(terma), np.zeros(1, dtype=np.int32), *cone_table(thetas, phis), kernel[None], np.full(len(phis), 5995), densities, True)
+        dose = np.zeros(size, dtype=np.float32)
+        convolve_c(terma, dose, spacing, thetas, phis, kernel, dose_grid_densities=densities)
+        np.testing.assert_allclose(dose, correct, rtol=1e-4, atol=1e-6)
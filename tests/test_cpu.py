@@ -0,0 +1,273 @@
+import os
+import subprocess
+import sys
+import pytest
+import numpy as np
+import numba
+from numba import cuda
+from conehead.active_voxels import active_voxels
+from conehead.tilting import cone_table
+from conehead.conehead import Conehead
+from conehead.cpu import (
+    cpu_d_eff, cpu_dose, cpu_oad, cpu_fluence, cpu_terma, cpu_fused_terma,
+    cpu_gather_dose, cpu_scatter_chunks, SCATTER_GRID_MEMORY
+)
+from conehead.terma import attenuation_table
+from conehead.kernel import truncated_kernel
+from conehead.dda_3d import dda_3d
+from conehead.source import Source
+
+
+class TestCpu:
+
+    def test_select_backend(self):
+        conehead = Conehead()
+        assert conehead._select_backend({'backend': 'cpu'}) == 'cpu'
+        if not cuda.is_available():
+            assert conehead._select_backend({}) == 'cpu'
+            assert conehead._select_backend({'backend': 'cuda'}) == 'cpu'
+        with pytest.raises(NotImplementedError):
+            conehead._select_backend({'backend': 'opencl'})
+
+    def test_d_eff_central_axis(self):
+        source = Source("varian_clinac_6MV")
+        size = np.array([5, 9, 5])
+        origin = np.array([-2, 0, -2], dtype=np.float32)
+        spacing = np.array([1, 1, 1], dtype=np.float32)
+        densities = np.ones(size, dtype=np.float32)
+        d_eff = np.zeros(size, dtype=np.float32)
+        cpu_d_eff(size, origin, spacing, densities, source.position, d_eff)
+        correct = np.arange(9) + 0.5
+        np.testing.assert_array_almost_equal(correct, d_eff[2, :, 2], decimal=5)
+
+    def test_dose_single_voxel(self):
+        size = np.array([5, 5, 5])
+        spacing = np.array([0.5, 0.5, 0.5], dtype=np.float32)
+        terma = np.zeros(size, dtype=np.float32)
+        terma[1, 1, 2] = 2.0
+        thetas = np.array([0, 45, 90], dtype=np.float32)
+        phis = np.array([30, 60, 90], dtype=np.float32)
+        kernel = np.tile(np.linspace(0, 1, 5996), (3, 1))
+        dose = np.zeros(size, dtype=np.float32)
+        cpu_dose(dose[None], spacing, size, terma[None], active_voxels(terma), np.zeros(1, dtype=np.int32), *cone_table(thetas, phis), kernel[None], np.full(len(phis), 5995), np.zeros((1, 1, 1)), False)
+
+        # Reference from the pure Python DDA, which only handles rays with
+        # non-negative direction components
+        correct = np.zeros(size)
+        for theta in np.radians(thetas.astype(np.float64)):
+            for j, phi in enumerate(np.radians(phis.astype(np.float64))):
+                direction = np.array([
+                    np.cos(theta) * np.sin(phi),
+                    np.cos(phi),
+                    np.sin(theta) * np.sin(phi)
+                ])
+                voxels, t_values = dda_3d(
+                    direction, terma, np.array([1, 1, 2]), spacing
+                )
+                indices = [
+                    min(abs(int(np.floor(t * 100 - 5))), 5995) for t in t_values
+                ]
+                previous = 0.0
+                for v, index in zip(voxels, indices):
+                    correct[tuple(v)] += 2.0 * (kernel[j, index] - previous)
+                    previous = kernel[j, index]
+        np.testing.assert_allclose(dose, correct, rtol=1e-5, atol=1e-6)
+
+    def test_dose_kernel_cutoff(self):
+        # Stopping each cone line at its cutoff deposits the same dose as
+        # following it through the flattened tail of the truncated kernel
+        size = np.array([9, 11, 9])
+        spacing = np.array([0.25, 0.25, 0.25], dtype=np.float32)
+        rng = np.random.default_rng(0)
+        terma = rng.random(size).astype(np.float32)
+        thetas = np.array([0, 90, 180, 270], dtype=np.float32)
+        phis = np.array([30, 90, 150], dtype=np.float32)
+        radii = np.linspace(0.05, 60.0, 5996)
+        kernel = np.stack([1 - np.exp(-radii / s) for s in (0.2, 0.4, 0.8)])
+        truncated, cutoffs, fraction = truncated_kernel(kernel, 0.9)
+        assert 0 < fraction < 0.1
+        assert np.all(cutoffs < 5995)
+
+        dose = np.zeros(size, dtype=np.float32)
+        cpu_dose(dose[None], spacing, size, terma[None], active_voxels(terma), np.zeros(1, dtype=np.int32), *cone_table(thetas, phis), truncated[None], cutoffs, np.zeros((1, 1, 1)), False)
+        correct = np.zeros(size, dtype=np.float32)
+        cpu_dose(correct[None], spacing, size, terma[None], active_voxels(terma), np.zeros(1, dtype=np.int32), *cone_table(thetas, phis), truncated[None], np.full(len(phis), 5995), np.zeros((1, 1, 1)), False)
+        np.testing.assert_allclose(dose, correct, rtol=1e-5)
+
+        conehead = Conehead()
+        assert conehead._select_kernel_energy_fraction({}, 'fft') == 1.0
+        assert conehead._select_kernel_energy_fraction({'kernelEnergyFraction': 0.999}, 'raycast') == 0.999
+        with pytest.raises(NotImplementedError):
+            conehead._select_kernel_energy_fraction({'kernelEnergyFraction': 0.999}, 'collapsedCone')
+        with pytest.raises(ValueError):
+            conehead._select_kernel_energy_fraction({'kernelEnergyFraction': 1.5}, 'raycast')
+
+    def test_dose_radiological(self):
+        # In a uniform density the radiological distance is the geometric
+        # distance scaled by the density, as if the voxels were smaller
+        size = np.array([7, 9, 7])
+        spacing = np.array([0.4, 0.3, 0.4], dtype=np.float32)
+        rng = np.random.default_rng(3)
+        terma = rng.random(size).astype(np.float32)
+        thetas = np.linspace(0, 300, 6, dtype=np.float32)
+        phis = np.array([30, 90, 150], dtype=np.float32)
+        kernel = np.tile(np.sqrt(np.linspace(0, 1, 5996)), (3, 1))
+        cutoffs = np.full(len(phis), 5995)
+        densities = np.full(size, 0.5, dtype=np.float32)
+
+        dose = np.zeros(size, dtype=np.float32)
+        cpu_dose(dose[None], spacing, size, terma[None], active_voxels(terma), np.zeros(1, dtype=np.int32), *cone_table(thetas, phis), kernel[None], cutoffs, densities, True)
+        correct = np.zeros(size, dtype=np.float32)
+        cpu_dose(correct[None], spacing * 0.5, size, terma[None], active_voxels(terma), np.zeros(1, dtype=np.int32), *cone_table(thetas, phis), kernel[None], cutoffs, np.zeros((1, 1, 1)), False)
+        np.testing.assert_allclose(dose, correct, rtol=1e-5, atol=1e-6)
+
+        conehead = Conehead()
+        assert conehead._select_kernel_scaling({}, 'raycast') == 'geometric'
+        assert conehead._select_kernel_scaling({'kernelScaling': 'radiological'}, 'cython') == 'radiological'
+        with pytest.raises(NotImplementedError):
+            conehead._select_kernel_scaling({'kernelScaling': 'radiological'}, 'gather')
+        with pytest.raises(NotImplementedError):
+            conehead._select_kernel_scaling({'kernelScaling': 'electron'}, 'raycast')
+
+    def test_dose_channels(self):
+        # Each channel of one traversal matches its own single channel run
+        size = np.array([7, 9, 7])
+        spacing = np.array([0.4, 0.3, 0.4], dtype=np.float32)
+        rng = np.random.default_rng(4)
+        terma = rng.random((2, *size)).astype(np.float32)
+        thetas = np.linspace(0, 300, 6, dtype=np.float32)
+        phis = np.array([30, 90, 150], dtype=np.float32)
+        kernel = np.stack([
+            np.tile(np.linspace(0, 1, 5996) ** p, (3, 1)) for p in (0.5, 2.0)
+        ])
+        cutoffs = np.array([5995, 300, 5995])
+        active = active_voxels(terma.sum(axis=0))
+
+        dose = np.zeros((2, *size), dtype=np.float32)
+        cpu_dose(dose, spacing, size, terma, active, np.zeros(1, dtype=np.int32), *cone_table(thetas, phis), kernel, cutoffs, np.zeros((1, 1, 1)), False)
+        shared = np.zeros((2, *size), dtype=np.float32)
+        cpu_dose(shared, spacing, size, terma[:1], active, np.zeros(1, dtype=np.int32), *cone_table(thetas, phis), kernel, cutoffs, np.zeros((1, 1, 1)), False)
+        for c in range(2):
+            correct = np.zeros(size, dtype=np.float32)
+            cpu_dose(correct[None], spacing, size, terma[c][None], active, np.zeros(1, dtype=np.int32), *cone_table(thetas, phis), kernel[c][None], cutoffs, np.zeros((1, 1, 1)), False)
+            np.testing.assert_allclose(dose[c], correct, rtol=1e-5, atol=1e-6)
+            correct = np.zeros(size, dtype=np.float32)
+            cpu_dose(correct[None], spacing, size, terma[0][None], active, np.zeros(1, dtype=np.int32), *cone_table(thetas, phis), kernel[c][None], cutoffs, np.zeros((1, 1, 1)), False)
+            np.testing.assert_allclose(shared[c], correct, rtol=1e-5, atol=1e-6)
+
+        conehead = Conehead()
+        assert conehead._select_dose_channels({}, 'gather', set()) == 'total'
+        assert conehead._select_dose_channels({'doseChannels': 'primaryScatter'}, 'raycast', {'dose_primary'}) == 'primaryScatter'
+        with pytest.raises(NotImplementedError):
+            conehead._select_dose_channels({'doseChannels': 'primaryScatter'}, 'cython', set())
+        with pytest.raises(NotImplementedError):
+            conehead._select_dose_channels({}, 'raycast', {'dose_scatter'})
+
+    def test_gather_dose(self):
+        size = np.array([7, 9, 6])
+        spacing = np.array([0.3, 0.25, 0.4], dtype=np.float32)
+        rng = np.random.default_rng(2)
+        terma = rng.random(size).astype(np.float32)
+        terma[terma < 0.3] = 0
+        thetas = np.linspace(0, 300, 6, dtype=np.float32)
+        phis = np.array([15, 60, 90, 135, 180], dtype=np.float32)
+        kernel = np.tile(np.sqrt(np.linspace(0, 1, 5996)), (5, 1))
+        cutoffs = np.array([5995, 100, 5995, 200, 5995])
+
+        correct = np.zeros(size, dtype=np.float32)
+        cpu_dose(correct[None], spacing, size, terma[None], active_voxels(terma), np.zeros(1, dtype=np.int32), *cone_table(thetas, phis), kernel[None], cutoffs, np.zeros((1, 1, 1)), False)
+        dose = np.zeros(size, dtype=np.float32)
+        directions, rows = cone_table(thetas, phis)
+        cpu_gather_dose(dose, spacing, size, terma, directions[0], rows, kernel, cutoffs)
+        np.testing.assert_allclose(dose, correct, rtol=1e-5, atol=1e-6)
+
+        # The same bits whatever the number of threads
+        threads = numba.get_num_threads()
+        try:
+            numba.set_num_threads(1)
+            serial = np.zeros(size, dtype=np.float32)
+            cpu_gather_dose(serial, spacing, size, terma, directions[0], rows, kernel, cutoffs)
+        finally:
+            numba.set_num_threads(threads)
+        np.testing.assert_array_equal(serial, dose)
+
+    def test_scatter_chunks(self):
+        assert cpu_scatter_chunks(4) == numba.get_num_threads()
+        assert cpu_scatter_chunks(SCATTER_GRID_MEMORY // 2) == min(2, numba.get_num_threads())
+        assert cpu_scatter_chunks(2 * SCATTER_GRID_MEMORY) == 1
+
+    def test_matches_cuda(self):
+        # The simulator must be enabled before numba is first imported, so
+        # the two backends are compared in a fresh interpreter
+        script = "\n".join([
+            "import numba",
+            "import numpy as np",
+            "from conehead.block import Block",
+            "from conehead.conehead import Conehead",
+            "from conehead.phantom import SimplePhantom",
+            "from conehead.source import Source",
+            "source = Source('varian_clinac_6MV')",
+            "source.gantry = 10",
+            "block = Block()",
+            "block.set_square(4)",
+            "phantom = SimplePhantom()",
+            "phantom.size = [3, 3, 3]",
+            "phantom.origin = np.array([-2, 0, -2], dtype=np.float32)",
+            "phantom.spacing = np.array([2, 2, 2], dtype=np.float32)",
+            "phantom.densities = np.ones(phantom.size, dtype=np.float32)",
+            "phantom.densities[:, 1, :] = 0.5",
+            "settings = {'sPri': 0.90924, 'sAnn': 2.887e-3, 'zAnn': 4.0, 'rInner': 0.2, 'rOuter': 1.4,",
+            "            'zExp': 12.5, 'sExp': 8.289e-3, 'kExp': 0.4816, 'softRatio': 0.0025,",
+            "            'softLimit': 20, 'hornRatio': 0.0065, 'fluenceResampling': 2,",
+            "            'energy_weights': {'1.0': 0.4, '2.0': 0.4, '4.0': 0.2}}",
+            "conehead = Conehead()",
+            "doses = [conehead.calculate(source, block, phantom, dict(settings, backend=b)).dose for b in ('cpu', 'cuda')]",
+            "assert conehead._select_backend({'backend': 'cuda'}) == 'cuda'",
+            "np.testing.assert_allclose(doses[1], doses[0], rtol=1e-4, atol=1e-6)",
+        ])
+        env = dict(os.environ, NUMBA_ENABLE_CUDASIM="1")
+        result = subprocess.run(
+            [sys.executable, "-c", script], env=env, capture_output=True,
+            text=True, cwd=os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+        )
+        assert result.returncode == 0, result.stderr
+
+    def test_select_terma_stage(self):
+        conehead = Conehead()
+        assert conehead._select_terma_stage({}, {'oad'}) == 'separate'
+        assert conehead._select_terma_stage({'termaStage': 'fused'}, {'terma'}) == 'fused'
+        with pytest.raises(NotImplementedError):
+            conehead._select_terma_stage({'termaStage': 'fused'}, {'fluence'})
+        with pytest.raises(NotImplementedError):
+            conehead._select_terma_stage({'termaStage': 'lazy'}, set())
+
+    def test_fused_terma(self):
+        source = Source("varian_clinac_6MV")
+        source.gantry = 20
+        rng = np.random.default_rng(0)
+        size = np.array([7, 9, 7])
+        origin = np.array([-6, 0, -6], dtype=np.float32)
+        spacing = np.array([2, 1, 2], dtype=np.float32)
+        blocked = rng.random(size).astype(np.float32)
+        blocked[0] = 0
+        d_eff = rng.random(size).astype(np.float32) * 10
+        fluence_settings = (0.9, 4.0, 3e-3, 0.2, 1.4, 12.5, 8e-3, 0.48)
+        attenuation = attenuation_table([0.5, 2.0, 6.0], [0.2, 0.5, 0.3], 20)
+
+        # Separate stages, with softening and horn factors as in calculate
+        oad = np.zeros(size, dtype=np.float32)
+        cpu_oad(oad, size, origin, spacing, source.position, source.sad, source.transform, source.v_y)
+        fluence = np.zeros(size, dtype=np.float32)
+        cpu_fluence(fluence, oad, blocked, size, origin, spacing, source.position, source.sad, *fluence_settings)
+        f_soften = np.where(oad < 5, 1 / (1 - 0.0025 * oad), 1).astype(np.float32)
+        f_horn = (1 + oad * 0.0065).astype(np.float32)
+        correct = np.zeros(size, dtype=np.float32)
+        cpu_terma(correct, blocked, fluence, d_eff, size, attenuation, 0.01, f_soften, f_horn)
+
+        terma = np.ones(size, dtype=np.float32)
+        cpu_fused_terma(
+            terma, blocked, d_eff, size, origin, spacing, source.position,
+            source.sad, source.transform, source.v_y, *fluence_settings,
+            0.0025, 5, 0.0065, attenuation, 0.01
+        )
+        np.testing.assert_allclose(terma, correct, rtol=1e-5, atol=1e-7)
@@ -0,0 +1,84 @@
+import pytest
+import numpy as np
+from conehead.conehead import Conehead
+from conehead.extra_focal import _source_fft_cache, _source_kernel_fft, visible_fractions
+from conehead.fluence_map import FluenceMap
+from conehead.source import Source
+
+
+class TestExtraFocal:
+
+    def setup_method(self):
+        self.num = 101
+        self.spacing = np.array([0.4, 0.4])
+        self.origin = -(self.num // 2) * self.spacing
+        self.positions = self.origin[0] + np.arange(self.num) * self.spacing[0]
+        self.settings = dict(zAnn=4.0, rInner=0.2, rOuter=1.4, zExp=12.5, kExp=0.4816)
+
+    def square_field(self, length):
+        inside = np.abs(self.positions) <= length / 2
+        return np.outer(inside, inside).astype(np.float32)
+
+    def test_select_extra_focal(self):
+        conehead = Conehead()
+        assert conehead._select_extra_focal({}, 'voxel') == 'radial'
+        assert conehead._select_extra_focal({'extraFocal': 'collimated'}, 'map') == 'collimated'
+        with pytest.raises(NotImplementedError):
+            conehead._select_extra_focal({'extraFocal': 'collimated'}, 'voxel')
+        with pytest.raises(NotImplementedError):
+            conehead._select_extra_focal({'extraFocal': 'scattered'}, 'map')
+
+    def test_open_field(self):
+        # Both sources are seen whole on the axis of a wide field
+        fractions = visible_fractions(
+            self.square_field(40), self.origin, self.spacing, 100,
+            **self.settings, zCol=40
+        )
+        centre = self.num // 2
+        for fraction in fractions:
+            assert fraction[centre, centre] == pytest.approx(1, abs=0.01)
+
+    def test_open_field_matches_radial(self):
+        # With nothing to collimate the sources, both models give the same
+        # fluence
+        source = Source("varian_clinac_6MV")
+        size = np.array([41, 3, 41])
+        fluence_map = FluenceMap(source, size, np.array([-20, 0, -20]), np.array([1, 1, 1]))
+        open_field = np.ones(fluence_map.shape, dtype=np.float32)
+        settings = (0.90924, 4.0, 2.887e-3, 0.2, 1.4, 12.5, 8.289e-3, 0.4816)
+        radial = fluence_map.fluence(open_field, *settings)
+        collimated = fluence_map.fluence(open_field, *settings, zCol=40)
+        inner = (slice(20, -20), slice(20, -20))
+        np.testing.assert_allclose(collimated[inner], radial[inner], rtol=1e-3)
+
+        # Less head scatter is seen through a small field
+        closed = np.zeros(fluence_map.shape, dtype=np.float32)
+        closed[fluence_map.shape[0] // 2 - 10:fluence_map.shape[0] // 2 + 10, fluence_map.shape[1] // 2 - 10:fluence_map.shape[1] // 2 + 10] = 1
+        centre = (fluence_map.shape[0] // 2, fluence_map.shape[1] // 2)
+        assert fluence_map.fluence(closed, *settings, zCol=40)[centre] < radial[centre]
+
+    def test_collimated(self):
+        # Less of the sources is seen through smaller fields, and less still
+        # from outside them
+        centre = self.num // 2
+        for source in range(2):
+            fractions = [
+                visible_fractions(
+                    self.square_field(length), self.origin, self.spacing, 100,
+                    **self.settings, zCol=40
+                )[source] for length in (20, 3, 1.2)
+            ]
+            assert 1 >= fractions[0][centre, centre] > fractions[1][centre, centre] > fractions[2][centre, centre]
+            for fraction in fractions:
+                assert fraction[0, centre] < 0.1 * fraction[centre, centre]
+
+    def test_source_fft_cached(self):
+        profile = ('exponential', 1.0, self.settings['kExp'])
+        first = _source_kernel_fft((9, 11), 0.4, profile, 2.0)
+        assert _source_kernel_fft((9, 11), 0.4, profile, 2.0) is first
+
+        # Only the last few source geometries are kept
+        for n in range(_source_fft_cache.maxsize):
+            _source_kernel_fft((9, 11), 0.4, profile, 2.0 + n + 1)
+        assert len(_source_fft_cache) == _source_fft_cache.maxsize
+        assert _source_kernel_fft((9, 11), 0.4, profile, 2.0) is not first
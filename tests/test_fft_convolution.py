@@ -0,0 +1,43 @@
+import numpy as np
+from conehead.fft_convolution import _kernel_fft_cache, cartesian_kernel, fft_dose, kernel_fft
+
+
+class TestFftConvolution:
+
+    def setup_method(self):
+        self.angles = np.arange(1, 49) * 3.75
+        self.radii = np.arange(1, 25) * 0.05
+        rng = np.random.default_rng(0)
+        self.kernel_diff = rng.random((48, 24))
+        self.kernel_diff /= self.kernel_diff.sum()
+
+    def test_kernel_energy_conserved(self):
+        # Grid large enough to hold every bin of the kernel
+        spacing = np.array([0.1, 0.1, 0.1])
+        size = np.array([15, 15, 15])
+        kernel = cartesian_kernel(spacing, size, self.angles, self.radii, self.kernel_diff)
+        assert kernel.shape == (29, 29, 29)
+        np.testing.assert_allclose(kernel.sum(), 1.0, rtol=0.02)
+
+    def test_kernel_fft_cached(self):
+        spacing = np.array([0.1, 0.2, 0.1])
+        size = np.array([5, 6, 7])
+        first = kernel_fft(spacing, size, self.angles, self.radii, self.kernel_diff)
+        second = kernel_fft(spacing, size, self.angles, self.radii, self.kernel_diff)
+        assert first is second
+        assert kernel_fft(spacing, size, self.angles, self.radii, self.kernel_diff * 0.5) is not first
+
+        # Only the last few grids are kept
+        for n in range(_kernel_fft_cache.maxsize):
+            kernel_fft(spacing, size + n + 1, self.angles, self.radii, self.kernel_diff)
+        assert len(_kernel_fft_cache) == _kernel_fft_cache.maxsize
+        assert kernel_fft(spacing, size, self.angles, self.radii, self.kernel_diff) is not first
+
+    def test_no_wrap_around(self):
+        spacing = np.array([0.1, 0.1, 0.1])
+        size = np.array([8, 9, 10])
+        terma = np.zeros(size, dtype=np.float32)
+        terma[0, 0, 0] = 1
+        dose = fft_dose(terma, spacing, self.angles, self.radii, self.kernel_diff)
+        kernel = cartesian_kernel(spacing, size, self.angles, self.radii, self.kernel_diff)
+        np.testing.assert_allclose(dose, kernel[7:, 8:, 9:], atol=1e-6)
@@ -0,0 +1,63 @@
+import pytest
+import numpy as np
+from conehead.beam_frame import BeamFrame
+from conehead.block import Block
+from conehead.conehead import Conehead
+from conehead.cpu import cpu_fluence, cpu_hit_test, cpu_oad
+from conehead.fluence_map import FluenceMap
+from conehead.source import Source
+
+
+class TestFluenceMap:
+
+    def setup_method(self):
+        self.source = Source("varian_clinac_6MV")
+        self.source.gantry = 30
+        self.source.collimator = 20
+        self.size = np.array([21, 21, 21])
+        self.origin = np.array([-10, 0, -10], dtype=np.float32)
+        self.spacing = np.array([1, 1, 1], dtype=np.float32)
+        self.fluence_map = FluenceMap(self.source, self.size, self.origin, self.spacing)
+        self.fluence_settings = (0.90924, 4.0, 2.887e-3, 0.2, 1.4, 12.5, 8.289e-3, 0.4816)
+
+    def test_select_fluence_engine(self):
+        conehead = Conehead()
+        assert conehead._select_fluence_engine({}, 'doseGrid', 'separate', set()) == 'voxel'
+        assert conehead._select_fluence_engine({'fluenceEngine': 'map'}, 'doseGrid', 'separate', {'fluence_map'}) == 'map'
+        with pytest.raises(NotImplementedError):
+            conehead._select_fluence_engine({'fluenceEngine': 'map'}, 'beam', 'separate', set())
+        with pytest.raises(NotImplementedError):
+            conehead._select_fluence_engine({}, 'doseGrid', 'separate', {'fluence_map'})
+        with pytest.raises(NotImplementedError):
+            conehead._select_fluence_engine({'fluenceEngine': 'fourier'}, 'doseGrid', 'separate', set())
+
+    def test_matches_beam_frame(self):
+        # Both fit the same block plane frame and project the same way
+        beam_frame = BeamFrame(self.source, self.size, self.origin, self.spacing)
+        assert beam_frame.shape[:2] == self.fluence_map.shape
+        np.testing.assert_allclose(beam_frame.origin[:2], self.fluence_map.origin)
+        columns = np.random.default_rng(0).random(self.fluence_map.shape).astype(np.float32)
+        np.testing.assert_array_equal(
+            self.fluence_map.project(columns),
+            beam_frame.to_dose_grid(columns[..., None])
+        )
+
+    def test_transmission(self):
+        block = Block()
+        block.set_square(10)
+        correct = np.zeros(self.size)
+        cpu_hit_test(correct, self.size, self.origin, self.spacing, self.source.position, self.source.v_y, self.source.transform, block.block_values, 3)
+        blocked = self.fluence_map.project(self.fluence_map.transmission(block, 3))
+        assert np.abs(blocked - correct).mean() < 0.01
+
+    def test_fluence(self):
+        oad = np.zeros(self.size, dtype=np.float32)
+        cpu_oad(oad, self.size, self.origin, self.spacing, self.source.position, self.source.sad, self.source.transform, self.source.v_y)
+        correct = np.zeros(self.size, dtype=np.float32)
+        cpu_fluence(correct, oad, np.ones(self.size), self.size, self.origin, self.spacing, self.source.position, self.source.sad, *self.fluence_settings)
+        open_field = np.ones(self.fluence_map.shape, dtype=np.float32)
+        fluence = self.fluence_map.project(
+            self.fluence_map.fluence(open_field, *self.fluence_settings),
+            inverse_square=True
+        )
+        np.testing.assert_allclose(fluence, correct, rtol=0.005)
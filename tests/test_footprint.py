@@ -0,0 +1,43 @@
+import numpy as np
+from conehead.block import Block
+from conehead.cpu import cpu_hit_test
+from conehead.footprint import summed_area_table, cpu_footprint_hit_test
+from conehead.source import Source
+
+
+class TestFootprint:
+
+    def test_summed_area_table(self):
+        rng = np.random.default_rng(0)
+        values = rng.random((6, 7)).astype(np.float32)
+        table = summed_area_table(values)
+        assert table.shape == (7, 8)
+        assert table.dtype == np.float64
+        np.testing.assert_allclose(table[3, 4], values[:3, :4].sum(), rtol=1e-6)
+        np.testing.assert_allclose(table[-1, -1], values.sum(), rtol=1e-6)
+        np.testing.assert_array_equal(table[0], 0)
+
+        # Cached against the transmission values
+        assert summed_area_table(values.copy()) is table
+        values[2, 3] = 0
+        assert summed_area_table(values) is not table
+
+    def test_footprint_hit_test(self):
+        source = Source("varian_clinac_6MV")
+        source.gantry = 30
+        source.collimator = 20
+        block = Block()
+        block.set_square(10)
+        size = np.array([21, 21, 21])
+        origin = np.array([-10, 0, -10], dtype=np.float32)
+        spacing = np.array([1, 1, 1], dtype=np.float32)
+
+        # Reference from heavily supersampled point lookups
+        correct = np.zeros(size)
+        cpu_hit_test(correct, size, origin, spacing, source.position, source.v_y, source.transform, block.block_values, 12)
+
+        blocked = np.zeros(size)
+        table = summed_area_table(block.block_values)
+        cpu_footprint_hit_test(blocked, size, origin, spacing, source.position, source.v_y, source.transform, table, 0.0, 1.0, 3)
+        assert np.abs(blocked - correct).max() < 0.05
+        assert np.abs(blocked - correct).mean() < 0.002
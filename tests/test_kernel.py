@@ -0,0 +1,89 @@
+import pytest
+import shutil
+import numpy as np
+from conehead.kernel import (
+    KernelMono, KernelPoly, polyenergetic_kernel, build_kernel_library,
+    open_kernel_library, truncated_kernel, primary_scatter_kernel
+)
+
+
+class TestKernel:
+
+    def test_polyenergetic_kernel_cached(self):
+        first = polyenergetic_kernel({"1.0": 0.5, "2.0": 0.5})
+        second = polyenergetic_kernel({"2.0": 0.5, "1.0": 0.5})
+        assert first is second
+
+    def test_polyenergetic_kernel_skips_zero_weights(self):
+        # There is no 9.0 MeV kernel to load
+        kernel = polyenergetic_kernel({"1.0": 0.2, "9.0": 0.0})
+        mono = KernelMono("kernels/1.0MeV/1.0MeV.egslst")
+        np.testing.assert_allclose(kernel.kernel_cum, mono.kernel_cum, rtol=1e-5)
+
+    def test_energy_bins_load_their_own_kernel(self):
+        # Regression: the 1.0 MeV bin used to load the 1.5 MeV kernel
+        one = KernelMono("kernels/1.0MeV/1.0MeV.egslst")
+        one_and_half = KernelMono("kernels/1.5MeV/1.5MeV.egslst")
+        assert not np.allclose(one.kernel_diff, one_and_half.kernel_diff)
+        kernel = polyenergetic_kernel({"1.0": 0.25, "1.5": 0.75})
+        correct = 0.25 * one.kernel_diff + 0.75 * one_and_half.kernel_diff
+        np.testing.assert_allclose(kernel.kernel_diff, correct / correct.sum(), rtol=1e-6)
+
+    def test_energy_keys_match_kernel_folders(self):
+        one = polyenergetic_kernel({"1": 1.0})
+        np.testing.assert_array_equal(one.kernel_diff, polyenergetic_kernel({"1.0": 1.0}).kernel_diff)
+        # 0.25 MeV must not be rounded onto a neighbouring kernel
+        with pytest.raises(ValueError):
+            polyenergetic_kernel({"0.25": 1.0})
+        with pytest.raises(ValueError):
+            polyenergetic_kernel({"9.0": 1.0})
+
+    def test_sampling(self):
+        mono = KernelMono("kernels/1.0MeV/1.0MeV.egslst")
+        kernel = KernelPoly(mono.angles, mono.radii, mono.kernel_diff, (0.05, 60.0, 600))
+        assert kernel.kernel_cum.shape == (48, 600)
+        np.testing.assert_allclose(kernel.kernel_cum[:, -1], mono.kernel_cum[:, -1], rtol=1e-5)
+
+    def test_kernel_library(self, tmp_path):
+        for e in ("1.0", "2.0"):
+            (tmp_path / f"{e}MeV").mkdir()
+            shutil.copy(f"kernels/{e}MeV/{e}MeV.egslst", tmp_path / f"{e}MeV")
+        build_kernel_library(str(tmp_path))
+        library = open_kernel_library(str(tmp_path))
+        assert isinstance(library.kernel_cum, np.memmap)
+        np.testing.assert_array_equal(library.energies, [1.0, 2.0])
+
+        weights = {"1.0": 0.3, "2.0": 0.7}
+        kernel = polyenergetic_kernel(weights, kernel_dir=str(tmp_path))
+        correct = polyenergetic_kernel(weights)
+        np.testing.assert_allclose(kernel.kernel_cum, correct.kernel_cum, atol=1e-6)
+        np.testing.assert_allclose(kernel.kernel_cum_primary, correct.kernel_cum_primary, atol=1e-6)
+
+    def test_truncated_kernel(self):
+        kernel_cum = np.array([
+            [0.0, 0.5, 0.9, 0.99, 1.0, 1.0],
+            [0.1, 0.2, 0.3, 0.4, 0.5, 1.0],
+        ])
+        truncated, cutoffs, fraction = truncated_kernel(kernel_cum, 0.9)
+        np.testing.assert_array_equal(cutoffs, [2, 5])
+        np.testing.assert_allclose(truncated[0], [0.0, 0.5, 0.9, 0.9, 0.9, 0.9])
+        np.testing.assert_allclose(truncated[1], kernel_cum[1])
+        assert fraction == pytest.approx(0.1 / 2)
+
+        truncated, cutoffs, fraction = truncated_kernel(kernel_cum, 1.0)
+        np.testing.assert_array_equal(truncated, kernel_cum)
+        np.testing.assert_array_equal(cutoffs, [5, 5])
+        assert fraction == 0
+        with pytest.raises(ValueError):
+            truncated_kernel(kernel_cum, 0)
+
+    def test_primary_scatter_kernel(self):
+        kernel = polyenergetic_kernel({"1.0": 0.5, "2.0": 0.5})
+        assert np.all(kernel.kernel_cum_primary <= kernel.kernel_cum + 1e-9)
+        truncated, cutoffs, _ = truncated_kernel(kernel.kernel_cum, 0.9)
+        channels = primary_scatter_kernel(truncated, kernel.kernel_cum_primary, cutoffs)
+        assert channels.shape == (2,) + truncated.shape
+        np.testing.assert_allclose(channels.sum(axis=0), truncated)
+        np.testing.assert_array_equal(channels[:, 0, -1], channels[:, 0, cutoffs[0]])
+        with pytest.raises(ValueError):
+            primary_scatter_kernel(truncated, None, cutoffs)
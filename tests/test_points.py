@@ -0,0 +1,69 @@
+import pytest
+import numpy as np
+from conehead.block import Block
+from conehead.conehead import Conehead
+from conehead.phantom import SimplePhantom
+from conehead.points import point_receivers
+from conehead.source import Source
+
+
+class TestPoints:
+
+    def setup_method(self):
+        self.source = Source("varian_clinac_6MV")
+        self.source.gantry = 10
+        self.block = Block()
+        self.block.set_square(6)
+        self.phantom = SimplePhantom()
+        self.phantom.size = [9, 9, 9]
+        self.phantom.origin = np.array([-4, 0, -4], dtype=np.float32)
+        self.phantom.spacing = np.array([1, 1, 1], dtype=np.float32)
+        self.phantom.densities = np.ones(self.phantom.size, dtype=np.float32)
+        self.phantom.densities[:, 3:5, :] = 0.3
+        self.settings = {
+            'sPri': 0.90924, 'sAnn': 2.887e-3, 'zAnn': 4.0, 'rInner': 0.2,
+            'rOuter': 1.4, 'zExp': 12.5, 'sExp': 8.289e-3, 'kExp': 0.4816,
+            'softRatio': 0.0025, 'softLimit': 20, 'hornRatio': 0.0065,
+            'fluenceResampling': 2, 'backend': 'cpu',
+            'energy_weights': {"1.0": 0.4, "2.0": 0.4, "4.0": 0.2},
+        }
+
+    def test_point_receivers(self):
+        size = np.array([3, 4, 5])
+        origin = np.array([-1, 0, -2])
+        spacing = np.array([1, 0.5, 1])
+        receivers = point_receivers([[0, 1, 0]], size, origin, spacing)
+        np.testing.assert_array_equal(receivers.voxels, [[1, 2, 2]])
+        np.testing.assert_array_equal(receivers.weights, [1])
+
+        receivers = point_receivers([[0.5, 1, 2], [-0.75, 0.25, -2]], size, origin, spacing)
+        np.testing.assert_array_equal(
+            receivers.voxels,
+            [[0, 0, 0], [0, 1, 0], [1, 0, 0], [1, 1, 0], [1, 2, 4], [2, 2, 4]]
+        )
+        doses = receivers.interpolate(np.arange(1.0, 7.0), 2)
+        np.testing.assert_allclose(doses, [5.5, 2.0])
+        with pytest.raises(ValueError):
+            point_receivers([[0, 5, 0]], size, origin, spacing)
+
+    def test_matches_calculate(self):
+        conehead = Conehead()
+        dose = conehead.calculate(self.source, self.block, self.phantom, self.settings).dose
+        x = np.arange(9) - 4.0
+        line = np.stack((np.zeros(9), np.arange(9.0), np.zeros(9)), axis=1)
+        np.testing.assert_allclose(
+            conehead.calculate_points(self.source, self.block, self.phantom, line, self.settings),
+            dose[4, :, 4], rtol=1e-4, atol=1e-7
+        )
+        plane = np.stack(np.meshgrid(x, [6.0], x, indexing='ij'), axis=-1)[:, 0]
+        np.testing.assert_allclose(
+            conehead.calculate_points(self.source, self.block, self.phantom, plane, self.settings),
+            dose[:, 6, :], rtol=1e-4, atol=1e-7
+        )
+
+    def test_unsupported_settings(self):
+        with pytest.raises(NotImplementedError):
+            Conehead().calculate_points(
+                self.source, self.block, self.phantom, [0, 1, 0],
+                dict(self.settings, hitTest='footprint')
+            )
@@ -0,0 +1,50 @@
+import pytest
+import numpy as np
+from conehead.cpu import cpu_d_eff
+from conehead.dda_3d import dda_3d
+from conehead.raytrace import raytrace, radiological_path_length
+from conehead.source import Source
+
+
+class TestRaytrace:
+
+    def test_matches_dda_3d(self):
+        rng = np.random.default_rng(0)
+        size = np.array([6, 7, 8])
+        spacing = np.array([0.5, 0.4, 0.3])
+        starts = np.stack([rng.integers(0, s, 50) for s in size], axis=1)
+
+        # The pure Python DDA only handles non-negative directions
+        directions = np.abs(rng.normal(size=(50, 3)))
+        directions /= np.linalg.norm(directions, axis=1)[:, None]
+        traces = raytrace(starts, directions, spacing, size)
+        assert len(traces) == 50
+        assert traces.path_lengths is None
+        assert traces.offsets[-1] == len(traces.voxels) == len(traces.t_values)
+        for i in range(50):
+            voxels, t_values = dda_3d(directions[i], np.zeros(size), starts[i].copy(), spacing)
+            traced_voxels, traced_t_values = traces.ray(i)
+            np.testing.assert_array_equal(traced_voxels, voxels)
+            np.testing.assert_allclose(traced_t_values, t_values)
+
+    def test_path_lengths(self):
+        rng = np.random.default_rng(1)
+        source = Source("varian_clinac_6MV")
+        size = np.array([7, 9, 5])
+        origin = np.array([-3, 0, -2], dtype=np.float32)
+        spacing = np.array([1, 0.5, 1], dtype=np.float32)
+        densities = rng.random(size).astype(np.float32)
+        correct = np.zeros(size, dtype=np.float32)
+        cpu_d_eff(size, origin, spacing, densities, source.position, correct)
+
+        # Trace every voxel back towards the source
+        starts = np.argwhere(np.ones(size, dtype=bool))
+        directions = source.position - (origin + starts * spacing)
+        path_lengths = radiological_path_length(starts, directions, spacing, densities)
+        np.testing.assert_allclose(path_lengths.reshape(size), correct, rtol=1e-5)
+        traces = raytrace(starts, directions, spacing, size, densities)
+        np.testing.assert_allclose(traces.path_lengths, path_lengths)
+
+    def test_mismatched_rays(self):
+        with pytest.raises(ValueError):
+            raytrace(np.zeros((2, 3)), np.ones((3, 3)), np.ones(3), np.array([2, 2, 2]))
@@ -0,0 +1,55 @@
+import warnings
+import pytest
+import numpy as np
+from conehead.conehead import Conehead
+from conehead.dosegrid import DoseGrid
+from conehead.result import CalculationResult
+
+
+class TestCalculationResult:
+
+    def setup_method(self):
+        dose_grid = DoseGrid(
+            [3, 4, 5],
+            np.array([-1, 0, -2], dtype=np.float32),
+            np.array([1, 0.5, 1], dtype=np.float32)
+        )
+        dose_grid.dose = np.arange(60, dtype=np.float32).reshape((3, 4, 5))
+        self.terma = np.ones((3, 4, 5), dtype=np.float32)
+        self.result = CalculationResult(dose_grid, {'terma': self.terma})
+
+    def test_grid(self):
+        assert self.result.grid('terma') is self.terma
+        with pytest.raises(KeyError):
+            self.result.grid('fluence')
+
+    def test_coordinates(self):
+        np.testing.assert_array_equal(self.result.coordinates(1), [0, 0.5, 1, 1.5])
+
+    def test_slice(self):
+        correct = self.result.dose[:, 2, :]
+        np.testing.assert_array_equal(self.result.slice(1, 2), correct)
+
+    def test_profile(self):
+        correct = self.result.dose[1, :, 3]
+        np.testing.assert_array_equal(self.result.profile(1, (1, 3)), correct)
+
+    def test_plot_blocked(self):
+        # An all-zero profile, as in a fully blocked field, is plotted as is
+        matplotlib = pytest.importorskip("matplotlib")
+        matplotlib.use("Agg")
+        self.result.dose_grid.dose = np.zeros((3, 4, 5), dtype=np.float32)
+        with warnings.catch_warnings():
+            warnings.simplefilter("error")
+            fig = self.result.plot(show=False)
+        lines = fig.axes[2].get_lines()  # Central axis, after terma and dose
+        assert len(lines) == 2
+        assert not any(np.isnan(line.get_ydata()).any() for line in lines)
+        matplotlib.pyplot.close(fig)
+
+    def test_select_intermediates(self):
+        conehead = Conehead()
+        assert conehead._select_intermediates({}) == set()
+        assert conehead._select_intermediates({'keepIntermediates': ['terma']}) == {'terma'}
+        with pytest.raises(NotImplementedError):
+            conehead._select_intermediates({'keepIntermediates': ['kernel']})
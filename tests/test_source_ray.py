@@ -0,0 +1,65 @@
+import pytest
+import numpy as np
+from conehead.conehead import Conehead
+from conehead.cpu import cpu_d_eff
+from conehead.source import Source
+from conehead.source_ray import cpu_source_ray_d_eff
+
+
+class TestSourceRay:
+
+    def test_select_depth_engine(self):
+        conehead = Conehead()
+        assert conehead._select_depth_engine({}) == 'voxelRay'
+        assert conehead._select_depth_engine({'depthEngine': 'sourceRay'}) == 'sourceRay'
+        with pytest.raises(NotImplementedError):
+            conehead._select_depth_engine({'depthEngine': 'montecarlo'})
+
+    def test_d_eff_central_axis(self):
+        source = Source("varian_clinac_6MV")
+        size = np.array([5, 9, 5])
+        origin = np.array([-2, 0, -2], dtype=np.float32)
+        spacing = np.array([1, 1, 1], dtype=np.float32)
+        densities = np.ones(size, dtype=np.float32)
+        d_eff = np.zeros(size, dtype=np.float32)
+        cpu_source_ray_d_eff(size, origin, spacing, densities, source.position, d_eff, 1)
+        correct = np.arange(9) + 0.5
+        np.testing.assert_array_almost_equal(correct, d_eff[2, :, 2], decimal=5)
+
+    def test_matches_voxel_rays(self):
+        source = Source("varian_clinac_6MV")
+        source.gantry = 30
+        size = np.array([21, 21, 21])
+        origin = np.array([-10, 0, -10], dtype=np.float32)
+        spacing = np.array([1, 1, 1], dtype=np.float32)
+        densities = np.ones(size, dtype=np.float32)
+        densities[5:10, 7:10, :] = 0.3
+        densities[:, 14:, 10:] = 1.8
+        correct = np.zeros(size, dtype=np.float32)
+        cpu_d_eff(size, origin, spacing, densities, source.position, correct)
+        d_eff = np.zeros(size, dtype=np.float32)
+        cpu_source_ray_d_eff(size, origin, spacing, densities, source.position, d_eff, 2)
+
+        # Every voxel is given a depth within a fraction of a voxel of that
+        # of its own ray; the difference is the density its nearest ray
+        # crosses and its own does not
+        assert np.all(d_eff > 0)
+        error = np.abs(d_eff - correct)
+        assert np.max(error) < 0.6
+        assert np.mean(error / correct) < 0.005
+
+    def test_entry_faces(self):
+        # Voxels where the beam enters are given the depth of their own ray,
+        # not that of a neighbouring ray entering the grid elsewhere
+        source = Source("varian_clinac_6MV")
+        source.gantry = 30
+        size = np.array([21, 21, 21])
+        origin = np.array([-19, 0, -19], dtype=np.float32)
+        spacing = np.array([1.9, 1.9, 1.9], dtype=np.float32)
+        densities = np.ones(size, dtype=np.float32)
+        correct = np.zeros(size, dtype=np.float32)
+        cpu_d_eff(size, origin, spacing, densities, source.position, correct)
+        for samples in (1, 2):
+            d_eff = np.zeros(size, dtype=np.float32)
+            cpu_source_ray_d_eff(size, origin, spacing, densities, source.position, d_eff, samples)
+            np.testing.assert_allclose(d_eff, correct, rtol=1e-5, atol=1e-4)
@@ -0,0 +1,59 @@
+import numpy as np
+from conehead.active_voxels import active_voxels
+from conehead.tilting import cone_table
+from conehead.cpu import cpu_dose
+from conehead.stencil import _stencil_cache, ray_template_stencil, cpu_stencil_dose
+
+
+class TestStencil:
+
+    def setup_method(self):
+        self.size = np.array([6, 7, 5])
+        self.spacing = np.array([0.3, 0.25, 0.4], dtype=np.float32)
+        self.thetas = np.linspace(0, 300, 6, dtype=np.float32)
+        self.phis = np.array([15, 60, 90, 135, 180], dtype=np.float32)
+        self.kernel = np.tile(np.sqrt(np.linspace(0, 1, 5996)), (5, 1))
+
+    def test_stencil_cached(self):
+        first = ray_template_stencil(self.spacing, self.size, self.thetas, self.phis, self.kernel)
+        second = ray_template_stencil(self.spacing, self.size, self.thetas, self.phis, self.kernel)
+        assert first is second
+
+        # Keyed on the kernel values themselves
+        other = ray_template_stencil(self.spacing, self.size, self.thetas, self.phis, self.kernel * 0.5)
+        assert other is not first
+        np.testing.assert_allclose(other[1], first[1] * 0.5)
+
+        # Only the last few stencils are kept
+        for n in range(_stencil_cache.maxsize):
+            ray_template_stencil(self.spacing, self.size + n + 1, self.thetas, self.phis, self.kernel)
+        assert len(_stencil_cache) == _stencil_cache.maxsize
+        assert ray_template_stencil(self.spacing, self.size, self.thetas, self.phis, self.kernel) is not first
+
+    def test_stencil_matches_raycast(self):
+        rng = np.random.default_rng(0)
+        terma = rng.random(self.size).astype(np.float32)
+        terma[terma < 0.5] = 0
+
+        correct = np.zeros(self.size, dtype=np.float32)
+        cpu_dose(correct[None], self.spacing, self.size, terma[None], active_voxels(terma), np.zeros(1, dtype=np.int32), *cone_table(self.thetas, self.phis), self.kernel[None], np.full(len(self.phis), 5995), np.zeros((1, 1, 1)), False)
+
+        offsets, values = ray_template_stencil(self.spacing, self.size, self.thetas, self.phis, self.kernel)
+        dose = np.zeros(self.size, dtype=np.float32)
+        cpu_stencil_dose(dose, self.size, terma, active_voxels(terma), offsets, values)
+        np.testing.assert_allclose(dose, correct, rtol=1e-5, atol=1e-5)
+
+    def test_short_kernel(self):
+        # A kernel sampled to less than the grid diagonal is held at its last
+        # sample, as in the ray-cast engine with the cutoff at its end
+        kernel = np.ascontiguousarray(self.kernel[:, :150])
+        terma = np.zeros(self.size, dtype=np.float32)
+        terma[2, 3, 1] = 1.0
+
+        correct = np.zeros(self.size, dtype=np.float32)
+        cpu_dose(correct[None], self.spacing, self.size, terma[None], active_voxels(terma), np.zeros(1, dtype=np.int32), *cone_table(self.thetas, self.phis), kernel[None], np.full(len(self.phis), 149), np.zeros((1, 1, 1)), False)
+
+        offsets, values = ray_template_stencil(self.spacing, self.size, self.thetas, self.phis, kernel)
+        dose = np.zeros(self.size, dtype=np.float32)
+        cpu_stencil_dose(dose, self.size, terma, active_voxels(terma), offsets, values)
+        np.testing.assert_allclose(dose, correct, rtol=1e-5, atol=1e-6)
@@ -0,0 +1,44 @@
+import numpy as np
+from conehead.cpu import cpu_terma
+from conehead.nist import mu_water
+from conehead.terma import attenuation_table, ATTENUATION_TABLE_STEP
+from conehead.varian_clinac_6MV import weights_cho
+
+
+class TestTerma:
+
+    def test_attenuation_table(self):
+        energy = np.array([1.0, 4.0])
+        energy_weights = np.array([0.75, 0.25])
+        table = attenuation_table(energy, energy_weights, 10)
+        mu = mu_water(energy)
+        depths = np.arange(len(table)) * ATTENUATION_TABLE_STEP
+        correct = (
+            0.75 * 1.0 * mu[0] * np.exp(-mu[0] * depths) +
+            0.25 * 4.0 * mu[1] * np.exp(-mu[1] * depths)
+        )
+        assert depths[-1] >= 10
+        np.testing.assert_allclose(table, correct, rtol=1e-6)
+
+    def test_terma_fine_spectrum(self):
+        # 500-bin spectrum, with the TERMA of each voxel summed over the
+        # bins directly
+        energy = np.linspace(0.01, 7.0, 500)
+        energy_weights = weights_cho(energy) / weights_cho(energy).sum()
+        mu = mu_water(energy)
+        size = np.array([4, 5, 6])
+        rng = np.random.default_rng(0)
+        d_eff = rng.random(size).astype(np.float32) * 30
+        f_soften = (1 + rng.random(size) * 0.05).astype(np.float32)
+        f_horn = (1 + rng.random(size) * 0.1).astype(np.float32)
+        fluence = rng.random(size).astype(np.float32)
+        blocked = np.ones(size, dtype=np.float32)
+        correct = np.sum(
+            energy_weights * energy * mu *
+            np.exp(-mu * (f_soften * d_eff)[..., None]), axis=-1
+        ) * fluence * f_horn
+
+        table = attenuation_table(energy, energy_weights, 30 * 1.05)
+        terma = np.zeros(size, dtype=np.float32)
+        cpu_terma(terma, blocked, fluence, d_eff, size, table, ATTENUATION_TABLE_STEP, f_soften, f_horn)
+        np.testing.assert_allclose(terma, correct, rtol=1e-5)
@@ -0,0 +1,80 @@
+import pytest
+import numpy as np
+from conehead.active_voxels import active_voxels
+from conehead.conehead import Conehead
+from conehead.cpu import cpu_dose
+from conehead.source import Source
+from conehead.tilting import cone_table, divergence_bins
+
+
+class TestTilting:
+
+    thetas = np.array([0, 60, 120, 180, 240, 300], dtype=np.float32)
+    phis = np.array([30, 90, 150], dtype=np.float32)
+
+    def test_cone_table(self):
+        directions, rows = cone_table(self.thetas, self.phis)
+        assert directions.shape == (1, 18, 3)
+        np.testing.assert_array_equal(rows, np.tile([0, 1, 2], 6))
+        np.testing.assert_allclose(directions[0, :, 1], np.cos(np.radians(self.phis[rows].astype(np.float64))), atol=1e-12)
+
+        # Each cone keeps its angle to the tilted kernel axis
+        axes = np.array([[0.0, 1.0, 0.0], [0.3, 0.9, -0.2], [0.0, -1.0, 0.0]])
+        axes /= np.linalg.norm(axes, axis=1)[:, None]
+        directions, rows = cone_table(self.thetas, self.phis, axes)
+        np.testing.assert_allclose(np.linalg.norm(directions, axis=2), 1)
+        for b, axis in enumerate(axes):
+            np.testing.assert_allclose(directions[b] @ axis, np.cos(np.radians(self.phis[rows].astype(np.float64))), atol=1e-12)
+
+    def test_divergence_bins(self):
+        source = Source("varian_clinac_6MV")
+        voxels = np.array([[0, 0, 0], [10, 0, 0], [10, 3, 0]], dtype=np.int32)
+        origin = np.array([0, 0, 0], dtype=np.float32)
+        spacing = np.array([1, 1, 1], dtype=np.float32)
+        voxel_bins, axes = divergence_bins(voxels, origin, spacing, source.position, source.transform, 1.0)
+
+        # 10 cm off axis at 100 and 103 cm from the source diverge by 5.7
+        # and 5.5 degrees, so share the 6 degree bin
+        assert voxel_bins[1] == voxel_bins[2] != voxel_bins[0]
+        np.testing.assert_allclose(axes[voxel_bins[0]], [0, 1, 0], atol=1e-12)
+        np.testing.assert_allclose(axes[voxel_bins[1]], [np.sin(np.radians(6)), np.cos(np.radians(6)), 0], atol=1e-12)
+
+        # Along the beam axis at any gantry angle
+        source.gantry = 90
+        voxel_bins, axes = divergence_bins(voxels[:1], origin, spacing, source.position, source.transform, 1.0)
+        np.testing.assert_allclose(axes[0], -source.position / source.sad, atol=1e-6)
+        with pytest.raises(ValueError):
+            divergence_bins(voxels, origin, spacing, source.position, source.transform, 0)
+
+    def test_dose_tilted(self):
+        size = np.array([7, 9, 7])
+        spacing = np.array([0.4, 0.3, 0.4], dtype=np.float32)
+        terma = np.zeros(size, dtype=np.float32)
+        terma[2, 3, 4] = 1.0
+        terma[4, 5, 3] = 2.0
+        active = active_voxels(terma)
+        kernel = np.stack([np.linspace(0, 1, 5996) ** p for p in (0.5, 1.0, 2.0)])
+        cutoffs = np.full(len(self.phis), 5995)
+        no_densities = np.zeros((1, 1, 1))
+
+        # Turning the kernel axis to -y mirrors the cones, so matches the
+        # untilted cones with the kernel rows reversed
+        axes = np.array([[0.0, 1.0, 0.0], [0.0, -1.0, 0.0]])
+        voxel_bins = np.array([0, 1], dtype=np.int32)
+        dose = np.zeros(size, dtype=np.float32)
+        cpu_dose(dose[None], spacing, size, terma[None], active, voxel_bins, *cone_table(self.thetas, self.phis, axes), kernel[None], cutoffs, no_densities, False)
+
+        correct = np.zeros(size, dtype=np.float32)
+        for v, rows in ((0, kernel), (1, kernel[::-1])):
+            single = np.zeros(size, dtype=np.float32)
+            single[tuple(active[v])] = terma[tuple(active[v])]
+            cpu_dose(correct[None], spacing, size, single[None], active[v:v + 1], np.zeros(1, dtype=np.int32), *cone_table(self.thetas, self.phis), np.ascontiguousarray(rows)[None], cutoffs, no_densities, False)
+        np.testing.assert_allclose(dose, correct, rtol=1e-5, atol=1e-7)
+
+        conehead = Conehead()
+        assert conehead._select_kernel_tilting({}, 'cython') == 'none'
+        assert conehead._select_kernel_tilting({'kernelTilting': 'divergent'}, 'raycast') == 'divergent'
+        with pytest.raises(NotImplementedError):
+            conehead._select_kernel_tilting({'kernelTilting': 'divergent'}, 'gather')
+        with pytest.raises(NotImplementedError):
+            conehead._select_kernel_tilting({'kernelTilting': 'full'}, 'raycast')